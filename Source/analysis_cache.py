@@ -0,0 +1,174 @@
+from typing import Dict, Optional, Set, Tuple
+from collections import OrderedDict
+import sqlite3
+from chess_deck import ChessDeck
+from game_record import encode_move, decode_move
+from move import Move
+from symmetry import SymmetryManager
+
+COLORS = [WHITE, BLACK] = [True, False]
+CacheKey = Tuple[int, str]
+
+BOUNDS = [BOUND_EXACT, BOUND_LOWER, BOUND_UPPER] = range(3)
+EVICTIONS = ("lru", "depth")  # The rows removed first from the file: the least recently used, or the shallowest
+NO_MOVE = 0xFFFF
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis (
+    hash INTEGER NOT NULL,
+    decks TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    bound INTEGER NOT NULL,
+    move INTEGER NOT NULL,
+    used INTEGER NOT NULL,
+    PRIMARY KEY (hash, decks)
+)
+"""
+UPSERT = """
+INSERT INTO analysis (hash, decks, depth, score, bound, move, used) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (hash, decks) DO UPDATE SET depth = excluded.depth, score = excluded.score, bound = excluded.bound,
+    move = excluded.move, used = excluded.used WHERE excluded.depth >= analysis.depth
+"""
+
+
+class AnalysisEntry:
+    """The result of a search of a position, the score is a bound when the search failed low or high"""
+
+    def __init__(self, depth: int, score: int, bound: int = BOUND_EXACT, move: Optional[Move] = None):
+        self.depth = depth
+        self.score = score
+        self.bound = bound
+        self.move = move
+
+    def get_score(self, depth: int, alpha: int, beta: int) -> Optional[int]:
+        """The score if the entry is deep enough and its bound decides the window, None otherwise"""
+        if self.depth < depth:
+            return None
+        if self.bound == BOUND_EXACT or (self.bound == BOUND_LOWER and self.score >= beta) or \
+                (self.bound == BOUND_UPPER and self.score <= alpha):
+            return self.score
+        return None
+
+
+class AnalysisCache:
+    """
+    The AnalysisCache keeps the results of searches between runs in a local SQLite file, keyed by the hash of the
+    canonical position and the signatures of the decks. The entries read or written go to an in memory LRU of
+    max_memory entries, and the written ones are sent to the file in batches of write_batch entries, so the search
+    almost never waits for the disk. The file holds at most max_rows rows, removed following the eviction policy.
+    A best move is stored on the canonical board and mapped back, as CanonicalCache does.
+    """
+
+    def __init__(self, path: str, max_memory: int = 1 << 16, write_batch: int = 512, max_rows: Optional[int] = None,
+                 eviction: str = "lru"):
+        if eviction not in EVICTIONS:
+            raise ValueError(f"Unknown eviction {eviction}, expected one of {', '.join(EVICTIONS)}")
+        self.path = path
+        self.max_memory = max_memory
+        self.write_batch = write_batch
+        self.max_rows = max_rows
+        self.eviction = eviction
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(SCHEMA)
+        self.memory: OrderedDict[CacheKey, AnalysisEntry] = OrderedDict()
+        self.pending: Dict[CacheKey, AnalysisEntry] = {}
+        self.touched: Set[CacheKey] = set()
+        self.symmetries: Dict[str, SymmetryManager] = {}
+        self.used = self.connection.execute("SELECT COALESCE(MAX(used), 0) FROM analysis").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, chess: ChessDeck) -> Tuple[CacheKey, SymmetryManager, int]:
+        decks = f"{chess.white_pieces_deck.get_signature(WHITE)}/{chess.black_pieces_deck.get_signature(BLACK)}"
+        if decks not in self.symmetries:
+            self.symmetries[decks] = SymmetryManager(chess)
+        symmetry = self.symmetries[decks]
+        key, transform = symmetry.canonicalize(chess.game, chess.turn)
+        return (symmetry.compute_position_hash(key), decks), symmetry, transform
+
+    @staticmethod
+    def to_signed(position_hash: int) -> int:
+        """SQLite integers are signed 64 bits"""
+        return position_hash - (1 << 64) if position_hash >= 1 << 63 else position_hash
+
+    def remember(self, key: CacheKey, entry: AnalysisEntry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.max_memory:
+            self.memory.popitem(last=False)
+
+    def get(self, chess: ChessDeck) -> Optional[AnalysisEntry]:
+        key, symmetry, transform = self.get_key(chess)
+        entry = self.memory.get(key)
+        if entry is None:
+            row = self.connection.execute("SELECT depth, score, bound, move FROM analysis WHERE hash = ? AND decks = ?",
+                                          (self.to_signed(key[0]), key[1])).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            depth, score, bound, code = row
+            entry = AnalysisEntry(depth, score, bound, None if code == NO_MOVE else decode_move(code))
+        self.hits += 1
+        self.remember(key, entry)
+        self.touched.add(key)
+        move = None if entry.move is None else symmetry.transform_move(entry.move, transform)
+        return AnalysisEntry(entry.depth, entry.score, entry.bound, move)
+
+    def put(self, chess: ChessDeck, entry: AnalysisEntry):
+        """Store an entry, unless a deeper search of the position is already known"""
+        key, symmetry, transform = self.get_key(chess)
+        known = self.memory.get(key)
+        if known is not None and known.depth > entry.depth:
+            return
+        move = None if entry.move is None else symmetry.transform_move(entry.move, transform)
+        entry = AnalysisEntry(entry.depth, entry.score, entry.bound, move)
+        self.remember(key, entry)
+        self.pending[key] = entry
+        if len(self.pending) >= self.write_batch:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pending entries in one transaction, mark the rows read since the last flush as used, and remove the
+        rows over the limit of the file
+        """
+        if not self.pending and not self.touched:
+            return
+        touched = []
+        for position_hash, decks in self.touched - self.pending.keys():
+            self.used += 1
+            touched.append((self.used, self.to_signed(position_hash), decks))
+        rows = []
+        for (position_hash, decks), entry in self.pending.items():
+            self.used += 1
+            rows.append((self.to_signed(position_hash), decks, entry.depth, entry.score, entry.bound,
+                         NO_MOVE if entry.move is None else encode_move(entry.move), self.used))
+        with self.connection:
+            self.connection.executemany(UPSERT, rows)
+            self.connection.executemany("UPDATE analysis SET used = ? WHERE hash = ? AND decks = ?", touched)
+            if self.max_rows is not None:
+                order = "used" if self.eviction == "lru" else "depth, used"
+                self.connection.execute(f"DELETE FROM analysis WHERE rowid IN (SELECT rowid FROM analysis ORDER BY "
+                                        f"{order} LIMIT MAX((SELECT COUNT(*) FROM analysis) - ?, 0))", (self.max_rows,))
+        self.pending = {}
+        self.touched = set()
+
+    def get_hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        self.flush()
+        return self.connection.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,305 @@
+from typing import Callable, Dict, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import Queue
+from multiprocessing.shared_memory import SharedMemory
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread
+from time import monotonic
+import numpy as np
+from chess_deck import ChessDeck
+
+BatchFunction = Callable[[np.ndarray], np.ndarray]
+
+RESPONSE_TIMEOUT = 60.0
+
+
+class EvaluationMetrics:
+    """Throughput and latency of an EvaluationService, the latencies are kept for the last window requests"""
+
+    def __init__(self, window: int = 10000):
+        self.lock = Lock()
+        self.start = monotonic()
+        self.batches = 0
+        self.evaluated = 0
+        self.evaluation_time = 0.0
+        self.full_batches = 0
+        self.latencies = deque(maxlen=window)
+
+    def record_batch(self, size: int, elapsed: float, is_full: bool, latencies: List[float]):
+        with self.lock:
+            self.batches += 1
+            self.evaluated += size
+            self.evaluation_time += elapsed
+            self.full_batches += is_full
+            self.latencies.extend(latencies)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            elapsed = monotonic() - self.start
+            return {
+                "batches": self.batches,
+                "evaluated": self.evaluated,
+                "mean batch size": self.evaluated / self.batches if self.batches else 0.0,
+                "full batch ratio": self.full_batches / self.batches if self.batches else 0.0,
+                "throughput": self.evaluated / elapsed if elapsed else 0.0,
+                "evaluation time": self.evaluation_time,
+                "latency p50": latencies[len(latencies) // 2] if latencies else 0.0,
+                "latency p99": latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] if latencies else 0.0,
+            }
+
+
+class EvaluationService:
+    """
+    The EvaluationService gathers the positions submitted by one or more searches into batches and runs the batch
+    function once per batch in a background thread. A batch is closed when it reaches max_batch positions, or timeout
+    seconds after its first position arrived. Every submit returns a Future with the evaluation of its position.
+    """
+
+    def __init__(self, evaluate_batch: BatchFunction, max_batch: int = 256, timeout: float = 0.002):
+        self.evaluate_batch = evaluate_batch
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.requests: SimpleQueue = SimpleQueue()
+        self.metrics = EvaluationMetrics()
+        self.thread: Optional[Thread] = None
+        self.running = False
+
+    def start(self) -> "EvaluationService":
+        self.running = True
+        self.metrics = EvaluationMetrics()
+        self.thread = Thread(target=self.run, name="evaluation-service", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.requests.put(None)
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, inputs: np.ndarray) -> Future:
+        future = Future()
+        self.requests.put((inputs, future, monotonic()))
+        return future
+
+    def evaluate(self, inputs: np.ndarray) -> float:
+        """Submit one position and wait for its evaluation"""
+        return self.submit(inputs).result()
+
+    def collect_batch(self) -> List[Tuple[np.ndarray, Future, float]]:
+        """Wait for a first request, then take requests until the batch is full or the timeout passes"""
+        first = self.requests.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = monotonic() + self.timeout
+        while len(batch) < self.max_batch:
+            remaining = deadline - monotonic()
+            try:
+                request = self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait()
+            except Empty:
+                break
+            if request is None:
+                self.running = False
+                break
+            batch.append(request)
+        return batch
+
+    def run(self):
+        while self.running:
+            batch = self.collect_batch()
+            if not batch:
+                continue
+            start = monotonic()
+            try:
+                outputs = self.evaluate_batch(np.stack([inputs for inputs, _, _ in batch]))
+            except Exception as error:
+                for _, future, _ in batch:
+                    future.set_exception(error)
+                continue
+            end = monotonic()
+            for (_, future, _), output in zip(batch, outputs):
+                future.set_result(output)
+            self.metrics.record_batch(len(batch), end - start, len(batch) == self.max_batch,
+                                      [end - submitted for _, _, submitted in batch])
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class BatchedEvaluator:
+    """
+    The evaluator that a Searcher calls to send its leaves to an EvaluationService, or to a ProcessEvaluationClient
+    in a worker process. The features evaluator, an NNUEEvaluator that observes the game of the search, keeps the
+    accumulators and gives the inputs, and the service runs the dense layers in batches, with the evaluate_batch of an
+    evaluator of the same weights as its batch function. The batches gather the leaves of the searches that share
+    the service, one search waits for each of its leaves.
+    """
+
+    def __init__(self, features, service):
+        self.features = features
+        self.service = service
+        self.evaluations = 0
+
+    def attach(self, chess: ChessDeck):
+        self.features.attach(chess)
+
+    def detach(self, chess: ChessDeck):
+        self.features.detach(chess)
+
+    def evaluate(self, chess: ChessDeck) -> int:
+        """Score of the position from the point of view of the side to move"""
+        self.evaluations += 1
+        return int(self.service.evaluate(self.features.get_input(chess.turn)))
+
+
+class ProcessEvaluationClient:
+    """
+    The client of a ProcessEvaluationServer used by a worker process. It writes its inputs into its own slots of the
+    shared memory, sends the slot numbers to the server and reads the outputs from the shared memory when the server
+    answers. It must be given to the worker as an argument of its Process, because it holds multiprocessing queues.
+    A failed evaluation, or a server that does not answer within timeout seconds, raises a RuntimeError. Every group of
+    requests has its own sequence number, that the server sends back, so the late answers of a group that timed out
+    are discarded instead of being taken for the answers of the next group.
+    """
+
+    def __init__(self, client_id: int, memory_name: str, slots: int, input_size: int, client_slots: int,
+                 requests: Queue, responses: Queue, timeout: float = RESPONSE_TIMEOUT):
+        self.client_id = client_id
+        self.memory_name = memory_name
+        self.slots = slots
+        self.input_size = input_size
+        self.first_slot = client_id * client_slots
+        self.client_slots = client_slots
+        self.requests = requests
+        self.responses = responses
+        self.timeout = timeout
+        self.sequence = 0
+        self.memory: Optional[SharedMemory] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["memory"] = None
+        return state
+
+    def attach(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self.memory is None:
+            self.memory = SharedMemory(self.memory_name)
+        return get_shared_arrays(self.memory, self.slots, self.input_size)
+
+    def evaluate_many(self, inputs: np.ndarray) -> np.ndarray:
+        """Evaluate a group of positions, at most client_slots are in flight at the same time"""
+        shared_inputs, shared_outputs = self.attach()
+        outputs = np.empty(len(inputs), np.float32)
+        for start in range(0, len(inputs), self.client_slots):
+            chunk = inputs[start:start + self.client_slots]
+            slots = range(self.first_slot, self.first_slot + len(chunk))
+            shared_inputs[self.first_slot:self.first_slot + len(chunk)] = chunk
+            self.sequence += 1
+            for slot in slots:
+                self.requests.put((self.client_id, slot, self.sequence))
+            errors = []
+            answered = 0
+            deadline = monotonic() + self.timeout
+            while answered < len(chunk):
+                try:
+                    _, sequence, error = self.responses.get(timeout=max(0.0, deadline - monotonic()))
+                except Empty:
+                    raise RuntimeError(f"no evaluation received in {self.timeout} seconds") from None
+                if sequence != self.sequence:
+                    continue
+                answered += 1
+                if error is not None:
+                    errors.append(error)
+            if errors:
+                raise RuntimeError(f"evaluation failed: {errors[0]}")
+            outputs[start:start + len(chunk)] = shared_outputs[self.first_slot:self.first_slot + len(chunk)]
+        return outputs
+
+    def evaluate(self, inputs: np.ndarray) -> float:
+        return float(self.evaluate_many(inputs[None, :])[0])
+
+    def close(self):
+        if self.memory is not None:
+            self.memory.close()
+            self.memory = None
+
+
+def get_shared_arrays(memory: SharedMemory, slots: int, input_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """The inputs of every slot followed by the outputs of every slot, in one shared memory block"""
+    inputs = np.ndarray((slots, input_size), np.float32, buffer=memory.buf)
+    outputs = np.ndarray((slots,), np.float32, buffer=memory.buf, offset=inputs.nbytes)
+    return inputs, outputs
+
+
+class ProcessEvaluationServer:
+    """
+    The ProcessEvaluationServer connects worker processes to an EvaluationService of the main process through shared
+    memory, so the positions of the searches of all the workers are batched together. The inputs and outputs never go
+    through a pipe, only the slot numbers do. A slot whose evaluation failed gets NaN as output and is answered with
+    the error, so its client never waits for it.
+    """
+
+    def __init__(self, service: EvaluationService, input_size: int, clients: int, client_slots: int = 64,
+                 timeout: float = RESPONSE_TIMEOUT):
+        self.service = service
+        self.input_size = input_size
+        self.client_slots = client_slots
+        self.timeout = timeout
+        self.slots = clients * client_slots
+        self.memory = SharedMemory(create=True, size=self.slots * (input_size + 1) * 4)
+        self.inputs, self.outputs = get_shared_arrays(self.memory, self.slots, input_size)
+        self.requests: Queue = Queue()
+        self.responses = [Queue() for _ in range(clients)]
+        self.thread: Optional[Thread] = None
+
+    def get_client(self, client_id: int) -> ProcessEvaluationClient:
+        return ProcessEvaluationClient(client_id, self.memory.name, self.slots, self.input_size, self.client_slots,
+                                       self.requests, self.responses[client_id], self.timeout)
+
+    def start(self) -> "ProcessEvaluationServer":
+        self.service.start()
+        self.thread = Thread(target=self.run, name="evaluation-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            client_id, slot, sequence = request
+            future = self.service.submit(self.inputs[slot].copy())
+            future.add_done_callback(lambda done, client_id=client_id, slot=slot, sequence=sequence:
+                                     self.answer(done, client_id, slot, sequence))
+
+    def answer(self, future: Future, client_id: int, slot: int, sequence: int):
+        try:
+            self.outputs[slot] = future.result()
+            error = None
+        except Exception as exception:
+            self.outputs[slot] = np.nan
+            error = repr(exception)
+        self.responses[client_id].put((slot, sequence, error))
+
+    def stop(self):
+        self.requests.put(None)
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.service.stop()
+        del self.inputs, self.outputs
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,433 @@
+from typing import Callable, Dict, List, Optional
+from copy import deepcopy
+from random import Random
+from time import monotonic, perf_counter
+from chess_deck import ChessDeck
+from decks import Deck
+from game_batch import GameBatch
+from geometry import Geometry
+from pieces import *
+from search import PRUNINGS, Searcher, SearchController, TimeManager
+
+# Decks used by the benchmarks, the fairy deck exercises every kind of attack table
+PRESET_DECKS = {
+    "normal": Deck(normal_chess_deck=True),
+    "knook": Deck(knook_deck=True),
+    "fairy": Deck.from_signatures("GAHZKFNW", "WNFZKHAG"),
+}
+
+# Positions with a single winning move, (preset deck, fen, move), found by the full width search at depth 4
+TACTICAL_POSITIONS = [
+    ("normal", "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1", "d1d8"),  # Back rank mate
+    ("normal", "6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1", "a1a8"),
+    ("normal", "k7/8/1K6/8/8/8/8/7R w - - 0 1", "h1h8"),
+    ("normal", "r1bqkbnr/pppp1ppp/2n5/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 0 1", "h5f7"),  # Scholar's mate
+    ("normal", "r3k3/8/8/1N6/8/8/8/4K3 w - - 0 1", "b5c7"),  # Knight fork
+    ("normal", "4k3/8/8/3q4/8/8/8/3RK3 w - - 0 1", "d1d5"),  # Hanging queen
+]
+
+
+def perft(chess: ChessDeck, depth: int) -> int:
+    """Count the leaf nodes of the legal move tree"""
+    if depth == 0:
+        return 1
+    nodes = 0
+    for move in list(chess.gen_legal_moves()):
+        chess.make_move(move)
+        nodes += perft(chess, depth - 1)
+        chess.pop()
+    return nodes
+
+
+def time_it(function: Callable, repeat: int = 3) -> float:
+    """Best wall time of several runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def bench_mask_attack(depth: int = 3) -> Dict[str, Dict[str, float]]:
+    """
+    Compare the compiled attack functions against the generic attack dictionary lookups, for every preset deck.
+    It measures the raw get_mask_attack calls over every occupied square and a perft of the given depth.
+    """
+    results = {}
+    for name, deck in PRESET_DECKS.items():
+        chess = ChessDeck(deck, deck)
+        compiled = chess.get_mask_attack
+        generic = chess.get_generic_mask_attack
+        occupied = list(chess.bbm.scan_forward(chess.game['All']))
+
+        def calls(mask_attack):
+            for _ in range(200):
+                for sq in occupied:
+                    mask_attack(sq, WHITE)
+                    mask_attack(sq, BLACK)
+
+        row = {
+            "generic calls": time_it(lambda: calls(generic)),
+            "compiled calls": time_it(lambda: calls(compiled)),
+        }
+        chess.get_mask_attack = generic
+        row["generic perft"] = time_it(lambda: perft(chess, depth))
+        del chess.get_mask_attack
+        row["compiled perft"] = time_it(lambda: perft(chess, depth))
+        results[name] = row
+    return results
+
+
+def bench_geometry(depth: int = 3, lookups: int = 20000, seed: int = 0) -> Dict[str, float]:
+    """
+    Check that Geometry(8, 8) generates the same attack tables as computer and that a perft with them is not slower,
+    then measure the compiled attack lookups of the queen and the chancellor on wider boards with random occupancies.
+    """
+    deck = PRESET_DECKS["fairy"]
+    chess = ChessDeck(deck, deck)
+    default_attacks = chess.attacks
+    geometry_attacks = Geometry(8, 8).create_dict_attacks(chess.piece_set)
+    if geometry_attacks != default_attacks:
+        raise AssertionError("Geometry(8, 8) does not generate the tables of computer")
+
+    results = {"default perft": time_it(lambda: perft(chess, depth))}
+    chess.attacks = geometry_attacks
+    chess.attack_generators = {color: chess.compile_attack_generators(color) for color in (WHITE, BLACK)}
+    results["geometry perft"] = time_it(lambda: perft(chess, depth))
+
+    rng = Random(seed)
+    for files, ranks in ((8, 8), (10, 8), (16, 16)):
+        geometry = Geometry(files, ranks)
+        attacks = geometry.create_dict_attacks({Queen(WHITE), Chancellor(WHITE)})
+        functions = []
+        for name in ("Queen", "Chancellor"):
+            sliders = [attacks[name][slide] for slide in ('Diagonal slide', 'Vertical slide', 'Horizontal slide')
+                       if slide in attacks[name]]
+            functions.append(ChessDeck.compile_attack_function(attacks[name].get('Step'), sliders))
+        samples = [(rng.randrange(geometry.size), rng.getrandbits(geometry.size) & rng.getrandbits(geometry.size))
+                   for _ in range(lookups)]
+
+        def calls():
+            for function in functions:
+                for sq, occupied in samples:
+                    function(sq, occupied)
+
+        calls()  # The lazy tables of the wide boards are filled by the first run
+        results[f"{files}x{ranks} lookups"] = time_it(calls) / (len(functions) * lookups)
+    return results
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def bench_move_latency(positions: int = 40, remaining: float = 10.0, increment: float = 0.1, seed: int = 0) -> Dict[str, float]:
+    """
+    Measure the latency of the time managed search on positions taken from random games of the preset decks,
+    with the given clock. It reports the percentiles of the move time and the worst overshoot of the hard deadline.
+    """
+    rng = Random(seed)
+    latencies = []
+    overshoot = 0.0
+    decks = list(PRESET_DECKS.values())
+    for index in range(positions):
+        deck = decks[index % len(decks)]
+        chess = ChessDeck(deck, deck)
+        for _ in range(rng.randrange(4, 30)):
+            moves = list(chess.gen_legal_moves())
+            if not moves:
+                break
+            chess.make_move(rng.choice(moves))
+        time_manager = TimeManager()
+        start = monotonic()
+        time_manager.allocate(remaining=remaining, increment=increment, start=start)
+        SearchController(chess, time_manager).run()
+        elapsed = monotonic() - start
+        latencies.append(elapsed)
+        overshoot = max(overshoot, elapsed - (time_manager.hard_deadline - start))
+    return {
+        "p50": percentile(latencies, 0.5),
+        "p90": percentile(latencies, 0.9),
+        "p99": percentile(latencies, 0.99),
+        "max": max(latencies),
+        "hard overshoot": overshoot,
+    }
+
+
+def bench_session_latency(sessions: int = 8, searches: int = 5, movetime: int = 100, workers: Optional[int] = None
+                          ) -> Dict[str, Dict[str, float]]:
+    """
+    Time from go to bestmove of the engine server, for one session alone and for sessions at the same time. Every
+    session sends searches 'go movetime' one after the other from the start position with a random opening move.
+    The pool starts its workers with a first search that is not measured.
+    """
+    from engine_server import EngineServer, EngineSession
+    import asyncio
+
+    async def run_session(server: EngineServer, seed: int, latencies: List[float]):
+        rng = Random(seed)
+        answered = asyncio.Event()
+        session = EngineSession(server, lambda text: answered.set() if text.startswith("bestmove") else None)
+        for _ in range(searches):
+            session.set_position(["startpos", "moves", rng.choice(["e2e4", "d2d4", "g1f3", "c2c4"])])
+            answered.clear()
+            start = monotonic()
+            await session.handle(f"go movetime {movetime}")
+            await answered.wait()
+            latencies.append(monotonic() - start)
+        await session.stop()
+
+    async def run_all(server: EngineServer) -> Dict[str, Dict[str, float]]:
+        await run_session(server, -1, [])
+        results = {}
+        for count in (1, sessions):
+            latencies = []
+            await asyncio.gather(*[run_session(server, seed, latencies) for seed in range(count)])
+            results[f"{count} session{'s' if count > 1 else ''}"] = {
+                "p50": percentile(latencies, 0.5),
+                "p99": percentile(latencies, 0.99),
+                "max": max(latencies),
+            }
+        return results
+
+    server = EngineServer(workers)
+    try:
+        return asyncio.run(run_all(server))
+    finally:
+        server.close()
+
+
+def bench_nnue(depth: int = 3, batch_size: int = 256) -> Dict[str, float]:
+    """
+    Evaluations per second of the NNUE evaluator: single evaluations, batched evaluations, and inside a fixed depth
+    search of the knook deck compared with the material evaluation of the same search.
+    """
+    from nnue import NNUEEvaluator, NNUEWeights
+    import numpy as np
+
+    deck = PRESET_DECKS["knook"]
+    chess = ChessDeck(deck, deck)
+    evaluator = NNUEEvaluator(NNUEWeights.random())
+    evaluator.attach(chess)
+
+    calls = 2000
+    single = time_it(lambda: [evaluator.evaluate(chess) for _ in range(calls)])
+    inputs = np.stack([evaluator.get_input(chess.turn)] * batch_size)
+    batched = time_it(lambda: evaluator.evaluate_batch(inputs))
+
+    evaluator.evaluations = 0
+    searcher = Searcher(chess, evaluator=evaluator)
+    start = perf_counter()
+    searcher.search_root(depth)
+    nnue_search = perf_counter() - start
+    evaluations = evaluator.evaluations
+    evaluator.detach(chess)
+
+    material = Searcher(chess)
+    start = perf_counter()
+    material.search_root(depth)
+    material_search = perf_counter() - start
+    return {
+        "single evals/s": calls / single,
+        "batched evals/s": batch_size / batched,
+        "search evals/s": evaluations / nnue_search,
+        "search nodes/s": searcher.nodes / nnue_search,
+        "material nodes/s": material.nodes / material_search,
+    }
+
+
+def bench_batch_eval(searches: int = 8, depth: int = 2, max_batches=(1, 8, 64), timeouts=(0.0005, 0.002, 0.01),
+                     seed: int = 0) -> Dict[str, Dict[str, float]]:
+    """
+    Tune the EvaluationService: searches threads run a fixed depth search of the knook deck at the same time, each one
+    with a BatchedEvaluator, for every max_batch and timeout. It reports the wall time, the metrics of the service and
+    the evaluations per second of the same searches with the direct NNUE evaluation, one after the other.
+    """
+    from batch_eval import BatchedEvaluator, EvaluationService
+    from nnue import NNUEEvaluator, NNUEWeights
+    from threading import Thread
+
+    weights = NNUEWeights.random()
+    deck = PRESET_DECKS["knook"]
+    rng = Random(seed)
+    games = []
+    for _ in range(searches):
+        chess = ChessDeck(deck, deck)
+        for _ in range(rng.randrange(2, 12)):
+            chess.make_move(rng.choice(list(chess.gen_legal_moves())))
+        games.append(chess)
+
+    def search(chess: ChessDeck, evaluator):
+        evaluator.attach(chess)
+        Searcher(chess, evaluator=evaluator).search_root(depth)
+        evaluator.detach(chess)
+
+    direct = [NNUEEvaluator(weights) for _ in games]
+    start = perf_counter()
+    for chess, evaluator in zip(games, direct):
+        search(chess, evaluator)
+    elapsed = perf_counter() - start
+    results = {"direct": {"wall time": elapsed, "throughput": sum(e.evaluations for e in direct) / elapsed}}
+
+    for max_batch in max_batches:
+        for timeout in timeouts:
+            with EvaluationService(NNUEEvaluator(weights).evaluate_batch, max_batch, timeout) as service:
+                threads = [Thread(target=search, args=(chess, BatchedEvaluator(NNUEEvaluator(weights), service)))
+                           for chess in games]
+                start = perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                row = {"wall time": perf_counter() - start}
+                metrics = service.metrics.snapshot()
+            row.update((name, metrics[name]) for name in
+                       ("throughput", "mean batch size", "full batch ratio", "latency p50", "latency p99"))
+            results[f"batch {max_batch} timeout {timeout * 1000:g} ms"] = row
+    return results
+
+
+def bench_staged_search(depth: int = 4) -> Dict[str, Dict[str, float]]:
+    """
+    Search the start position of every preset deck with all the moves generated and sorted at every node, and with
+    the staged generation, the nodes, the time and the fraction of the cutoffs found by each stage.
+    """
+    results = {}
+    for name, deck in PRESET_DECKS.items():
+        row = {}
+        for staged in (False, True):
+            searcher = Searcher(ChessDeck(deck, deck), staged=staged)
+            start = perf_counter()
+            searcher.search_root(depth)
+            label = "staged" if staged else "sorted"
+            row[f"{label} nodes"] = searcher.nodes
+            row[f"{label} seconds"] = perf_counter() - start
+        for stage, rate in searcher.get_cutoff_rates().items():
+            row[f"{stage} cutoffs"] = rate
+        results[name] = row
+    return results
+
+
+def bench_pruning(depth: int = 4) -> Dict[str, Dict[str, float]]:
+    """
+    Search the start positions of the preset decks and the TACTICAL_POSITIONS without pruning, with each pruning
+    technique alone and with all of them, the nodes relative to the full width search and the fraction of the
+    tactical positions where the winning move is still found.
+    """
+    configurations = {"none": ()}
+    configurations.update({name: (name,) for name in PRUNINGS})
+    configurations["all"] = PRUNINGS
+    results = {}
+    for label, pruning in configurations.items():
+        nodes = 0
+        for deck in PRESET_DECKS.values():
+            searcher = Searcher(ChessDeck(deck, deck), pruning=pruning)
+            searcher.search_root(depth)
+            nodes += searcher.nodes
+        solved = 0
+        for deck_name, fen, expected in TACTICAL_POSITIONS:
+            deck = PRESET_DECKS[deck_name]
+            searcher = Searcher(ChessDeck(deck, deck, fen), pruning=pruning)
+            _, move = searcher.search_root(depth)
+            nodes += searcher.nodes
+            solved += str(move) == expected
+        results[label] = {"nodes": nodes, "solve rate": solved / len(TACTICAL_POSITIONS)}
+    for row in results.values():
+        row["node ratio"] = row["nodes"] / results["none"]["nodes"]
+    return results
+
+
+def bench_clone(plies: int = 100, seed: int = 0) -> Dict[str, float]:
+    """Time of a copy of a game after some random plies, with deepcopy, clone and clone of the last 8 positions"""
+    deck = PRESET_DECKS["fairy"]
+    chess = ChessDeck(deck, deck)
+    rng = Random(seed)
+    for _ in range(plies):
+        moves = list(chess.gen_legal_moves())
+        if not moves:
+            break
+        chess.make_move(moves[rng.randrange(len(moves))])
+    return {
+        "deepcopy": time_it(lambda: deepcopy(chess)),
+        "clone": time_it(lambda: chess.clone()),
+        "clone history 8": time_it(lambda: chess.clone(8)),
+    }
+
+
+def bench_game_batch(games: int = 256, plies: int = 40, seed: int = 0) -> Dict[str, float]:
+    """
+    Plies per second of random self-play of the normal deck, looping over separate ChessDeck games with make_move
+    compared with one GameBatch of the same number of games, that generates and plays the moves of all of them with
+    array operations. Both count the construction of the games.
+    """
+    deck = PRESET_DECKS["normal"]
+
+    def separate():
+        rng = Random(seed)
+        played = 0
+        for chess in [ChessDeck(deck, deck) for _ in range(games)]:
+            for _ in range(plies):
+                moves = list(chess.gen_legal_moves())
+                if not moves:
+                    break
+                chess.make_move(moves[rng.randrange(len(moves))])
+                played += 1
+        return played
+
+    def batched():
+        rng = Random(seed)
+        batch = GameBatch(deck, deck, games, max_plies=plies)
+        while batch.ongoing.any():
+            batch.step_random(rng)
+        return int(batch.plies.sum())
+
+    start = perf_counter()
+    separate_plies = separate()
+    separate_time = perf_counter() - start
+    start = perf_counter()
+    batched_plies = batched()
+    batched_time = perf_counter() - start
+    return {
+        "separate plies/s": separate_plies / separate_time,
+        "batched plies/s": batched_plies / batched_time,
+    }
+
+
+if __name__ == '__main__':
+    for deck_name, timings in bench_mask_attack().items():
+        print(deck_name)
+        for label, seconds in timings.items():
+            print(f"    {label:<16} {seconds * 1000:10.2f} ms")
+    print("geometry")
+    for label, seconds in bench_geometry().items():
+        print(f"    {label:<16} {seconds * 1000:10.4f} ms")
+    print("nnue")
+    for label, rate in bench_nnue().items():
+        print(f"    {label:<16} {rate:10.0f}")
+    for label, row in bench_batch_eval().items():
+        print(f"batched evaluation {label}")
+        for name, value in row.items():
+            print(f"    {name:<16} {value:10.4f}")
+    for deck_name, row in bench_staged_search().items():
+        print(f"staged search {deck_name}")
+        for label, value in row.items():
+            print(f"    {label:<16} {value:10.2f}")
+    for label, row in bench_pruning().items():
+        print(f"pruning {label}")
+        for name, value in row.items():
+            print(f"    {name:<16} {value:10.2f}")
+    print("copy of a game")
+    for label, seconds in bench_clone().items():
+        print(f"    {label:<16} {seconds * 1_000_000:10.2f} us")
+    print("self-play")
+    for label, rate in bench_game_batch().items():
+        print(f"    {label:<16} {rate:10.0f}")
+    print("move latency with 10s + 0.1s")
+    for label, seconds in bench_move_latency().items():
+        print(f"    {label:<16} {seconds * 1000:10.2f} ms")
+    for label, row in bench_session_latency().items():
+        print(f"time to bestmove of 'go movetime 100', {label}")
+        for name, seconds in row.items():
+            print(f"    {name:<16} {seconds * 1000:10.2f} ms")
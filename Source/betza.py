@@ -0,0 +1,185 @@
+from typing import Dict, List, Set, Tuple, Type
+import re
+from pieces import Piece, NAME_TO_PIECE_TYPE, SYMBOL_TO_PIECE_TYPE, SYMBOL_TO_NAME
+
+Offset = Tuple[int, int]  # (files, ranks)
+Ride = Tuple[Tuple[Offset, ...], int]  # The offsets ridden and the maximum number of steps, 0 for unlimited
+
+# The basic leaps, every one stands for all its rotations and reflections
+ATOMS = {
+    "W": (1, 0),  # Wazir
+    "F": (1, 1),  # Ferz
+    "D": (2, 0),  # Dabbaba
+    "N": (2, 1),  # Knight
+    "A": (2, 2),  # Alfil
+    "H": (3, 0),  # Threeleaper
+    "C": (3, 1),  # Camel
+    "L": (3, 1),
+    "Z": (3, 2),  # Zebra
+    "J": (3, 2),
+    "G": (3, 3),  # Tripper
+}
+# The shorthands for the usual compounds, as (atom, is rider) pairs
+COMPOUNDS = {
+    "K": [("W", False), ("F", False)],
+    "R": [("W", True)],
+    "B": [("F", True)],
+    "Q": [("W", True), ("F", True)],
+}
+MODIFIERS = set("fblrvs")
+TOKEN = re.compile(r"([a-z]*)([A-Z])(?:(\2)|(\d+))?")
+
+
+def get_atom_offsets(atom: str) -> Set[Offset]:
+    files, ranks = ATOMS[atom]
+    offsets = set()
+    for a, b in ((files, ranks), (ranks, files)):
+        for file_sign in (1, -1):
+            for rank_sign in (1, -1):
+                offsets.add((a * file_sign, b * rank_sign))
+    return offsets
+
+
+def is_in_direction(offset: Offset, modifier: str) -> bool:
+    """The directions of white, forward is up the board. For the oblique atoms v and s are the narrow and wide leaps"""
+    files, ranks = offset
+    match modifier:
+        case "f":
+            return ranks > 0
+        case "b":
+            return ranks < 0
+        case "r":
+            return files > 0
+        case "l":
+            return files < 0
+        case "v":
+            return abs(ranks) > abs(files)
+        case "s":
+            return abs(files) > abs(ranks)
+    return False
+
+
+def filter_offsets(offsets: Set[Offset], modifiers: str) -> Set[Offset]:
+    """
+    Keep the offsets of the directions of the modifiers. A forward or backward modifier followed by left or right,
+    like fr, is one direction, the rest of the modifiers add their directions.
+    """
+    if not modifiers:
+        return offsets
+    unknown = set(modifiers) - MODIFIERS
+    if unknown:
+        raise ValueError(f"Unsupported Betza modifiers {''.join(sorted(unknown))}, only {''.join(sorted(MODIFIERS))} are")
+    kept = set()
+    index = 0
+    while index < len(modifiers):
+        pair = modifiers[index:index + 2]
+        if len(pair) == 2 and pair[0] in "fb" and pair[1] in "lr":
+            kept |= {offset for offset in offsets if is_in_direction(offset, pair[0]) and is_in_direction(offset, pair[1])}
+            index += 2
+        else:
+            kept |= {offset for offset in offsets if is_in_direction(offset, modifiers[index])}
+            index += 1
+    return kept
+
+
+class BetzaMoves:
+    """
+    The moves of a piece in Betza notation: leaps, and rides with their maximum number of steps.
+    The full rides of the wazir and the ferz are kept apart as slides, so the engine handles them as rooks and bishops,
+    with the pins and the checks of the lines.
+    """
+
+    def __init__(self, notation: str):
+        self.notation = notation
+        self.leaps: Set[Offset] = set()
+        self.rides: Dict[int, Set[Offset]] = {}
+        self.parse(notation)
+        self.diagonal_slide = self.take_slide(get_atom_offsets("F"))
+        self.vertical_slide = self.take_slide({(0, 1), (0, -1)})
+        self.horizontal_slide = self.take_slide({(1, 0), (-1, 0)})
+
+    def parse(self, notation: str):
+        position = 0
+        while position < len(notation):
+            token = TOKEN.match(notation, position)
+            if token is None:
+                raise ValueError(f"Invalid Betza notation {notation!r} at {notation[position:]!r}")
+            position = token.end()
+            modifiers, letter, doubled, limit = token.groups()
+            if letter in COMPOUNDS:
+                atoms = [(atom, is_rider or bool(doubled) or (limit is not None and int(limit) != 1))
+                         for atom, is_rider in COMPOUNDS[letter]]
+            elif letter in ATOMS:
+                atoms = [(letter, bool(doubled) or (limit is not None and int(limit) != 1))]
+            else:
+                raise ValueError(f"Unknown Betza atom {letter} in {notation!r}")
+            for atom, is_rider in atoms:
+                offsets = filter_offsets(get_atom_offsets(atom), modifiers)
+                if not is_rider:
+                    self.leaps |= offsets
+                else:
+                    self.rides.setdefault(int(limit) if limit else 0, set()).update(offsets)
+
+    def take_slide(self, offsets: Set[Offset]) -> bool:
+        """Take the offsets out of the unlimited rides if all of them are there"""
+        unlimited = self.rides.get(0, set())
+        if not offsets <= unlimited:
+            return False
+        unlimited -= offsets
+        if not unlimited:
+            del self.rides[0]
+        return True
+
+    def get_riders(self) -> Tuple[Ride, ...]:
+        return tuple((tuple(sorted(offsets)), limit) for limit, offsets in sorted(self.rides.items()))
+
+    def is_symmetric(self) -> bool:
+        """The moves are the same for both colors if they do not change when the board is flipped vertically"""
+        return all({(files, -ranks) for files, ranks in offsets} == offsets
+                   for offsets in [self.leaps, *self.rides.values()])
+
+
+def compile_piece(name: str, symbol: str, notation: str, price: int, can_castle: bool = False, is_unique: bool = False,
+                  can_be_promotion: bool = True, is_invincible: bool = False, can_capture: bool = True) -> Type[Piece]:
+    """
+    The compile_piece function creates the piece type of a Betza definition, like "NN" for the nightrider or "CZ" for
+    the camel zebra compound, and registers it with its symbol. The moves are written for white, the ones with a
+    direction are flipped for black. The attack tables are built by ChessDeck.create_dict_attacks from the leaps and
+    rides of the piece. The pieces must be compiled before the modules that size their arrays by PIECE_TYPES are
+    imported, like nnue and training_data.
+    """
+    symbol = symbol.upper()
+    if len(symbol) != 1 or not symbol.isalpha():
+        raise ValueError(f"The symbol of a piece is one letter, not {symbol!r}")
+    if name in NAME_TO_PIECE_TYPE:
+        raise ValueError(f"There is already a piece called {name}")
+    if symbol in SYMBOL_TO_PIECE_TYPE or SYMBOL_TO_NAME.get(symbol.lower(), name) != name:
+        raise ValueError(f"The symbol {symbol} is already used")
+
+    moves = BetzaMoves(notation)
+    if not (moves.leaps or moves.rides or moves.diagonal_slide or moves.vertical_slide or moves.horizontal_slide):
+        raise ValueError(f"The Betza notation {notation!r} has no moves")
+    attributes = {
+        "__slots__": (),
+        "name": name,
+        "symbol": symbol,
+        "betza": notation,
+        "price": price,
+        "leaps": tuple(sorted(moves.leaps)),
+        "riders": moves.get_riders(),
+        "diagonal_slide": moves.diagonal_slide,
+        "vertical_slide": moves.vertical_slide,
+        "horizontal_slide": moves.horizontal_slide,
+        "symmetry": moves.is_symmetric(),
+        "can_castle": can_castle,
+        "is_unique": is_unique,
+        "can_be_promotion": can_be_promotion,
+        "is_invincible": is_invincible,
+        "can_capture": can_capture,
+    }
+    return type(name, (Piece,), attributes)
+
+
+def compile_pieces(definitions: List[Tuple[str, str, str, int]]) -> List[Type[Piece]]:
+    """Compile several (name, symbol, notation, price) definitions"""
+    return [compile_piece(name, symbol, notation, price) for name, symbol, notation, price in definitions]
@@ -1,12 +1,13 @@
 from typing import Optional, List, Iterator, Set, Dict
 from fen_loader import FenLoader
+from geometry import Geometry
 from bitboards import BitboardManager
 from computer import *
 from copy import deepcopy
 from computer import ComputerManager
 from decks import Deck
 from move import Move
-from pieces import King, Piece
+from pieces import King, Piece, NAME_TO_PIECE_TYPE, SYMBOL_TO_PIECE_TYPE
 from enum import Enum
 from collections import deque
 
@@ -16,6 +17,7 @@ Color = bool
 
 COLORS = [WHITE, BLACK] = [True, False]
 COLOR_NAMES = ["black", "white"]
+BOARD = Geometry(8, 8)  # Builds the tables of the pieces compiled by betza
 
 
 class GameResolution(Enum):
@@ -24,9 +26,27 @@ class GameResolution(Enum):
     DRAW_BY_STALEMATE = 3,
     DRAW_BY_REPETITION = 4,
     DRAW_BY_LONG = 5,
+    DRAW_BY_FIFTY_MOVES = 7,
+    DRAW_BY_INSUFFICIENT_MATERIAL = 8,
     ONGOING = 6
 
 
+class MoveLegality(Enum):
+    LEGAL = 0
+    NO_PIECE = 1
+    NOT_YOUR_PIECE = 2
+    UNREACHABLE_SQUARE = 3
+    OWN_PIECE_AT_TARGET = 4
+    INVINCIBLE_TARGET = 5
+    BLOCKED = 6
+    CASTLING_NOT_ALLOWED = 7
+    WRONG_PROMOTION = 8
+    LEAVES_KING_IN_CHECK = 9
+
+
+FIFTY_MOVES_PLIES = 100  # The halfmove clock that draws by the fifty-move rule
+
+
 class ChessDeck:
     def __init__(self, white_pieces_deck: Deck, black_pieces_deck: Deck, fen: Optional[str] = None):
         self.game = None
@@ -34,6 +54,8 @@ class ChessDeck:
         self.bbm = BitboardManager()
         self.cpm = ComputerManager()
 
+        self.white_pieces_deck = white_pieces_deck
+        self.black_pieces_deck = black_pieces_deck
         self.white_deck = white_pieces_deck.get_deck(WHITE)
         self.black_deck = black_pieces_deck.get_deck(BLACK)
 
@@ -45,6 +67,9 @@ class ChessDeck:
 
         self.piece_set = self.white_set.union(self.black_set)
         self.attacks = self.create_dict_attacks()
+        self.attack_generators = {WHITE: self.compile_attack_generators(WHITE), BLACK: self.compile_attack_generators(BLACK)}
+        self.has_riders = {color: any(piece.riders for piece in self.get_set_of_color(color)) for color in COLORS}
+        self.checking_pieces = {WHITE: self.get_checking_pieces(WHITE), BLACK: self.get_checking_pieces(BLACK)}
 
         if fen is None:
             self.reset_game()
@@ -60,6 +85,8 @@ class ChessDeck:
 
         self.game_stack = deque()
         self.game_stack.append(deepcopy(self.game))
+        self.halfmove_stack = deque()
+        self.observers = []
 
     def reset_game(self):
         """
@@ -108,6 +135,28 @@ class ChessDeck:
             self.game["White" if color else "Black"] |= bb_piece
             self.game["All"] |= bb_piece
 
+    def clone(self, history: Optional[int] = None) -> "ChessDeck":
+        """
+        The clone function returns an independent copy of the game for the parallel searches and the evaluations.
+        The decks, the piece sets and the attack tables never change after the construction, so they are shared, and
+        only the board and the stack of positions are copied. The positions of the stack are never modified, make_move
+        pushes a new copy and pop copies the top one, so the clone shares them too.
+        With history, only the last positions of the stack are kept, like the ones that can repeat, so the cost does not
+        grow with the length of the game; the clone cannot pop further back than that.
+        The observers are not copied, they belong to the original game.
+        """
+        clone = type(self).__new__(type(self))
+        clone.__dict__.update(self.__dict__)
+        clone.game = dict(self.game)
+        if history is None:
+            clone.game_stack = deque(self.game_stack)
+            clone.halfmove_stack = deque(self.halfmove_stack)
+        else:
+            clone.game_stack = deque(self.game_stack[index] for index in range(-min(max(history, 1), len(self.game_stack)), 0))
+            clone.halfmove_stack = deque(self.halfmove_stack[index] for index in range(-len(clone.game_stack) + 1, 0))
+        clone.observers = []
+        return clone
+
     def clear_game(self):
         """Clears the game"""
         for key in self.game:
@@ -167,19 +216,6 @@ class ChessDeck:
                 blockers |= between
         return blockers & self.get_pieces_of_color(color)
 
-    def get_attacked_squares_by_sliders(self, king_sq: Square, attackers: Bitboard) -> Bitboard:
-        """Get the attacked squares by the enemy sliders, to know if the king can move to that square, this case is calculed here
-        because the king could block a slide attack by itself."""
-        sliders = BB_EMPTY
-        for piece in self.get_set_of_color(not self.turn):
-            if piece.horizontal_slide or piece.vertical_slide or piece.diagonal_slide:
-                sliders |= self.game[piece.name]
-        attackers &= sliders
-        attacked = BB_EMPTY
-        for attacker in self.bbm.scan_reversed(attackers):
-            attacked |= self.cpm.compute_ray(attacker, king_sq) & ~self.game['All']
-        return attacked
-
     def display_game(self):
         """Displays the game"""
         print(self.from_game_to_str(self.game))
@@ -214,13 +250,17 @@ class ChessDeck:
         describing how to compute those attacks.
         """
         all_attacks = {
-            "King": {"Step": [self.cpm.compute_step_attacks(sq, King(WHITE).step_attacks) for sq in SQUARES]},
+            "King": {"Step": [self.cpm.compute_step_attacks(sq, King.step_attacks) for sq in SQUARES]},
         }
 
         for piece in self.piece_set:
             if piece in all_attacks:
                 continue
 
+            if piece.leaps or piece.riders:
+                all_attacks[piece.name] = BOARD.create_piece_attacks(piece)
+                continue
+
             attacks = {}
             if piece.step_attacks:
                 if piece.symmetry:
@@ -240,6 +280,66 @@ class ChessDeck:
             all_attacks[piece.name] = attacks
         return all_attacks
 
+    def compile_attack_generators(self, color: Color) -> List:
+        """
+        The compile_attack_generators function specializes the attack dictionary for the deck of a color, that is fixed for
+        the whole game. It returns a flat list of (bitboard key, attack function) pairs, one per piece type, where each
+        function only does the table lookups that its piece needs, without any string test at runtime.
+        The pawns go first because they are the most common pieces on the board.
+        """
+        generators = []
+        for piece in sorted(self.get_set_of_color(color), key=lambda p: p.name != 'Pawn'):
+            attacks = self.attacks[piece.name]
+            if 'Step' in attacks:
+                step = attacks['Step']
+            elif 'Steps' in attacks:
+                step = attacks['Steps'][0] if color is WHITE else attacks['Steps'][1]
+            else:
+                step = None
+            sliders = [attacks[slide_type] for slide_type in ('Diagonal slide', 'Vertical slide', 'Horizontal slide')
+                       if slide_type in attacks]
+            if 'Riders' in attacks:
+                sliders += attacks['Riders'][0] if color is WHITE else attacks['Riders'][1]
+            generators.append((piece.name, self.compile_attack_function(step, sliders)))
+        return generators
+
+    @staticmethod
+    def compile_attack_function(step: Optional[List[Bitboard]], sliders: List):
+        """Build the closure that returns the attacks of a piece given its square and the occupancy of the board"""
+        if not sliders:
+            if step is None:
+                return lambda sq, occupied: BB_EMPTY
+            return lambda sq, occupied: step[sq]
+
+        if len(sliders) == 1:
+            (mask, table), = sliders
+            if step is None:
+                return lambda sq, occupied: table[sq][mask[sq] & occupied]
+            return lambda sq, occupied: step[sq] | table[sq][mask[sq] & occupied]
+
+        if len(sliders) == 2:
+            (mask_a, table_a), (mask_b, table_b) = sliders
+            if step is None:
+                return lambda sq, occupied: table_a[sq][mask_a[sq] & occupied] | table_b[sq][mask_b[sq] & occupied]
+            return lambda sq, occupied: step[sq] | table_a[sq][mask_a[sq] & occupied] | table_b[sq][mask_b[sq] & occupied]
+
+        if len(sliders) > 3:
+            step = step or [BB_EMPTY] * len(SQUARES)
+
+            def attack(sq, occupied):
+                bb = step[sq]
+                for mask, table in sliders:
+                    bb |= table[sq][mask[sq] & occupied]
+                return bb
+            return attack
+
+        (mask_a, table_a), (mask_b, table_b), (mask_c, table_c) = sliders
+        if step is None:
+            return lambda sq, occupied: (table_a[sq][mask_a[sq] & occupied] | table_b[sq][mask_b[sq] & occupied] |
+                                         table_c[sq][mask_c[sq] & occupied])
+        return lambda sq, occupied: (step[sq] | table_a[sq][mask_a[sq] & occupied] | table_b[sq][mask_b[sq] & occupied] |
+                                     table_c[sq][mask_c[sq] & occupied])
+
     def is_move_promotion(self, move: Move) -> bool:
         """Check if the move should be a promotion"""
         return self.get_type_at(move.to_sq) == 'Pawn' and (BB_SQUARES[move.to_sq] & BB_PROMOTION_RANKS)
@@ -250,7 +350,7 @@ class ChessDeck:
             return True
         return False
 
-    def is_safe(self, king_sq: Square, move: Move, blockers: Bitboard) -> bool:
+    def is_safe(self, king_sq: Square, move: Move, blockers: Bitboard, attacked: Optional[Bitboard] = None) -> bool:
         """Checks if the move is safe by looking at the blockers and the attackers of the square where the king is.
         It follows this rules:
             The king cannot move to an attacked square.
@@ -258,18 +358,31 @@ class ChessDeck:
             The enpassant pawn cannot move if is pinned
             The enpassant pawn cannot move in enpassant, if removing the two pawn from the same rank would leave the king in check
             A piece cannot move if is pinned
-            A piece can move in the same diagonal, rank or file that is pinned, even take the piece that pins it
+            A piece can move in the same diagonal, rank or file that is pinned, even take the piece that pins it,
+            but a leaper cannot jump over its king nor over the piece that pins it
+        The attacked squares are the attack map of the opponent without the king, see get_king_attack_map, it is computed
+        here if it is not given.
         """
         if move.from_sq == king_sq:
             if self.is_move_castling(move):
                 return True
-            else:
-                return not self.is_square_attacked(move.to_sq, not self.turn)
+            if attacked is None:
+                attacked = self.get_king_attack_map()
+            return not attacked & BB_SQUARES[move.to_sq]
         elif self.is_the_move_a_en_passant(move):
             return bool(not blockers & BB_SQUARES[move.from_sq]) and not self.is_ep_skewered(king_sq, move.from_sq)
         else:
-            return bool(not blockers & BB_SQUARES[move.from_sq] or (
-                    self.cpm.compute_ray(move.from_sq, move.to_sq) & BB_SQUARES[king_sq]))
+            if not blockers & BB_SQUARES[move.from_sq]:
+                return True
+            pinner_sq = self.get_pinner(king_sq, move.from_sq)
+            return bool((self.cpm.compute_between(king_sq, pinner_sq) | BB_SQUARES[pinner_sq]) & BB_SQUARES[move.to_sq])
+
+    def get_pinner(self, king_sq: Square, pinned_sq: Square) -> Square:
+        """The square of the piece that pins the piece of pinned_sq, the first piece behind it on the line from the king"""
+        pinned_bb = BB_SQUARES[pinned_sq]
+        for sq in self.bbm.scan_reversed(self.cpm.compute_ray(king_sq, pinned_sq) & self.get_pieces_of_color(not self.turn)):
+            if self.cpm.compute_between(king_sq, sq) & self.game['All'] == pinned_bb:
+                return sq
 
     def is_square_empty(self, sq: Square) -> bool:
         return self.get_type_at(sq) is None
@@ -321,6 +434,37 @@ class ChessDeck:
         """
         return bool(self.get_attackers_of_square(sq, color))
 
+    def get_attack_map(self, color: Color, occupied: Optional[Bitboard] = None) -> Bitboard:
+        """
+        The squares attacked by the pieces of a color, computed for all of them at once instead of square by square:
+        the pawns are shifted as a set, and the attacks of the rest of the pieces are ORed over their squares.
+        The pieces that cannot capture do not attack. The occupancy of the board is used unless another one is given.
+        """
+        game = self.game
+        if occupied is None:
+            occupied = game['All']
+        pieces = self.get_pieces_of_color(color) & ~game['Non capture']
+        pawns = game['Pawn'] & pieces
+        if color is WHITE:
+            attacked = self.bbm.shift_up_left(pawns) | self.bbm.shift_up_right(pawns)
+        else:
+            attacked = self.bbm.shift_down_left(pawns) | self.bbm.shift_down_right(pawns)
+        for bb_key, attack in self.attack_generators[color]:
+            if bb_key == 'Pawn':
+                continue
+            for sq in self.bbm.scan_reversed(game[bb_key] & pieces):
+                attacked |= attack(sq, occupied)
+        return attacked
+
+    def get_king_attack_map(self) -> Bitboard:
+        """
+        The squares where the king of the player cannot go, the attack map of the opponent with the king taken out of the
+        board, so the sliders that check it also attack the squares behind it. The king is not in check when the map
+        does not have its square, so the castling paths are tested against the same map.
+        """
+        king_bb = self.game['King'] & self.get_pieces_of_color(self.turn)
+        return self.get_attack_map(not self.turn, self.game['All'] & ~king_bb)
+
     def is_move_castling(self, move: Move) -> bool:
         """Checks if a move is a castling move"""
         return (self.get_type_at(move.to_sq) == 'King') & (self.cpm.compute_distance(move.from_sq, move.to_sq) == 2)
@@ -334,51 +478,202 @@ class ChessDeck:
         is_pawn_capture = (self.get_type_at(move.to_sq) == 'Pawn') and (self.game['En passant'] & BB_SQUARES[move.to_sq])
         return is_pawn_capture
 
-    def gen_scape_moves(self, attackers: Bitboard) -> Iterator[Move]:
+    def parse_move(self, uci: str) -> Optional[Move]:
+        """
+        The parse_move function parses a move in the format of the engine (e2e4, or e7e8q with the promotion piece).
+        It returns None if the text is not a move, the legality of the move is checked by check_move.
+        """
+        uci = uci.strip().lower()
+        if len(uci) not in (4, 5):
+            return None
+        from_sq = SQUARE_INDEX.get(uci[:2])
+        to_sq = SQUARE_INDEX.get(uci[2:4])
+        if from_sq is None or to_sq is None:
+            return None
+        promotion = None
+        if len(uci) == 5:
+            if uci[4].upper() not in SYMBOL_TO_PIECE_TYPE:
+                return None
+            promotion = SYMBOL_TO_PIECE_TYPE[uci[4].upper()](self.turn)
+        return Move(from_sq, to_sq, promotion)
+
+    def check_move(self, move: Move) -> MoveLegality:
+        """
+        The check_move function checks the legality of a single move without generating the rest of the moves.
+        First it checks that the piece can reach the square following the same rules as gen_pseudo_moves, then it checks
+        the move against the check and pin context of the king, in the same way that gen_legal_moves does.
+        It returns the reason why the move is illegal, or MoveLegality.LEGAL.
+        """
+        from_bb = BB_SQUARES[move.from_sq]
+        to_bb = BB_SQUARES[move.to_sq]
+        my_pieces = self.get_pieces_of_color(self.turn)
+        if not from_bb & self.game['All']:
+            return MoveLegality.NO_PIECE
+        if not from_bb & my_pieces:
+            return MoveLegality.NOT_YOUR_PIECE
+
+        is_pawn = bool(from_bb & self.game['Pawn'])
+        if move.promotion is not None and (not is_pawn or not to_bb & BB_PROMOTION_RANKS or
+                                           move.promotion.name != self.get_prom_piece(self.turn).name):
+            return MoveLegality.WRONG_PROMOTION
+
+        king_sq = self.get_king_square(self.turn)
+        is_castling = False
+        if move.from_sq == king_sq and self.cpm.compute_distance(move.from_sq, move.to_sq) == 2:
+            if not any(self.gen_castling_moves(from_bb, to_bb)):
+                return MoveLegality.CASTLING_NOT_ALLOWED
+            is_castling = True
+        else:
+            reason = self.check_pseudo_move(move, is_pawn)
+            if reason is not MoveLegality.LEGAL:
+                return reason
+
+        if self.has_riders[not self.turn]:
+            return MoveLegality.LEGAL if self.is_safe_after(move) else MoveLegality.LEAVES_KING_IN_CHECK
+
+        attackers = self.get_attackers_of_square(king_sq, not self.turn)
+        if attackers:
+            if is_castling:
+                return MoveLegality.CASTLING_NOT_ALLOWED
+            evasion_squares = self.get_evasion_squares(king_sq, attackers)
+            if not is_pawn and attackers & self.game['Pawn']:
+                evasion_squares &= ~self.game['En passant']
+            if move.from_sq != king_sq and not to_bb & evasion_squares:
+                return MoveLegality.LEAVES_KING_IN_CHECK
+
+        blockers = BB_EMPTY if move.from_sq == king_sq else self.get_blockers(king_sq, self.turn)
+        if not self.is_safe(king_sq, move, blockers):
+            return MoveLegality.LEAVES_KING_IN_CHECK
+        return MoveLegality.LEGAL
+
+    def check_pseudo_move(self, move: Move, is_pawn: bool) -> MoveLegality:
+        """Check if the piece can reach the square, with the same conditions that gen_pseudo_moves uses for each kind of piece"""
+        to_bb = BB_SQUARES[move.to_sq]
+        attacks = self.get_mask_attack(move.from_sq, self.turn)
+        if is_pawn:
+            if to_bb & attacks:
+                if to_bb & self.game['Invincible']:
+                    return MoveLegality.INVINCIBLE_TARGET
+                if to_bb & (self.get_pieces_of_color(not self.turn) | self.game['En passant']):
+                    return MoveLegality.LEGAL
+                return MoveLegality.UNREACHABLE_SQUARE
+            step = 8 if self.turn is WHITE else -8
+            double_rank = BB_RANK_2 if self.turn is WHITE else BB_RANK_7
+            if move.to_sq == move.from_sq + step:
+                return MoveLegality.BLOCKED if to_bb & self.game['All'] else MoveLegality.LEGAL
+            if move.to_sq == move.from_sq + 2 * step and BB_SQUARES[move.from_sq] & double_rank:
+                if (to_bb | BB_SQUARES[move.from_sq + step]) & self.game['All']:
+                    return MoveLegality.BLOCKED
+                return MoveLegality.LEGAL
+            return MoveLegality.UNREACHABLE_SQUARE
+
+        if not to_bb & attacks:
+            return MoveLegality.UNREACHABLE_SQUARE
+        if to_bb & self.get_pieces_of_color(self.turn):
+            return MoveLegality.OWN_PIECE_AT_TARGET
+        if self.is_piece_non_capturable(move.from_sq) and to_bb & self.game['All']:
+            return MoveLegality.BLOCKED
+        if to_bb & self.game['Invincible']:
+            return MoveLegality.INVINCIBLE_TARGET
+        return MoveLegality.LEGAL
+
+    def is_legal(self, move: Move) -> bool:
+        return self.check_move(move) is MoveLegality.LEGAL
+
+    def get_evasion_squares(self, king_sq: Square, attackers: Bitboard) -> Bitboard:
+        """
+        The squares where a piece other than the king can go to stop a check, it is empty if there is a double check.
+        A pawn that gives check after a double push can also be captured en passant, only by a pawn.
+        """
+        if not self.bbm.is_one_bit_on(attackers):
+            return BB_EMPTY
+        attacker_sq = self.bbm.msb(attackers)
+        attacker_name = self.get_type_at(attacker_sq)
+        if attackers & self.game['Pawn'] and self.game['En passant']:
+            en_passant_sq = self.bbm.msb(self.game['En passant'])
+            if attacker_sq == (en_passant_sq - 8 if self.turn is WHITE else en_passant_sq + 8):
+                return attackers | self.game['En passant']
+        if "Diagonal slide" in self.attacks[attacker_name] or "Horizontal slide" in self.attacks[attacker_name] or "Vertical slide" in self.attacks[attacker_name]:
+            return self.cpm.compute_between(attacker_sq, king_sq) | attackers
+        elif "Step" in self.attacks[attacker_name] or "Steps" in self.attacks[attacker_name]:
+            return attackers
+        return BB_EMPTY
+
+    def gen_scape_moves(self, attackers: Bitboard, end_mask: Bitboard = BB_ALL, attacked: Optional[Bitboard] = None) -> Iterator[Move]:
         """Generates the scape moves of the king. It moves if there is any available square to scape that has no attackers,
-        if it has only one attacker then see if it can be captured or a piece can be put in the middle if it has a slide attack."""
+        if it has only one attacker then see if it can be captured or a piece can be put in the middle if it has a slide attack.
+        The attacked squares are the ones of get_king_attack_map, that is computed if it is not given."""
         king_bb = self.game["King"] & self.get_pieces_of_color(self.turn)
         king_sq = self.get_king_square(self.turn)
         king_attacks = self.get_mask_attack(king_sq, self.turn)
-        attacked_squares = self.get_attacked_squares_by_sliders(king_sq, attackers)
+        if attacked is None:
+            attacked = self.get_king_attack_map()
 
-        for square in self.bbm.scan_reversed(king_attacks & ~self.get_pieces_of_color(self.turn) & ~attacked_squares):
+        for square in self.bbm.scan_reversed(king_attacks & ~self.get_pieces_of_color(self.turn) & ~self.game['Invincible'] & ~attacked & end_mask):
             yield Move(king_sq, square)
 
-        if self.bbm.is_one_bit_on(attackers):
-            attacker_sq = self.bbm.msb(attackers)
-            attacker_name = self.get_type_at(attacker_sq)
-            target_squares = BB_EMPTY
-            if "Diagonal slide" in self.attacks[attacker_name] or "Horizontal slide" in self.attacks[attacker_name] or "Vertical slide" in self.attacks[attacker_name]:
-                target_squares = self.cpm.compute_between(attacker_sq, king_sq) | attackers
-            elif "Step" in self.attacks[attacker_name] or "Steps" in self.attacks[attacker_name]:
-                target_squares |= attackers
+        target_squares = self.get_evasion_squares(king_sq, attackers) & end_mask
+        en_passant = target_squares & self.game['En passant'] if attackers & self.game['Pawn'] else BB_EMPTY
+        if target_squares & ~en_passant:
+            yield from self.gen_pseudo_moves(~king_bb, target_squares & ~en_passant)
+        if en_passant:
+            yield from self.gen_attack_moves(self.game['Pawn'] & self.get_pieces_of_color(self.turn), en_passant)
 
-            if target_squares:
-                yield from self.gen_pseudo_moves(~king_bb, target_squares)
-
-    def gen_legal_moves(self) -> Iterator[Move]:
+    def gen_legal_moves(self, end_mask: Bitboard = BB_ALL) -> Iterator[Move]:
         """First it computes if the king is in check or not by looking up the attackers of the square where the king is.
-        If it has attackers then it calls the function gen_scape_moves to generate the moves that can escape the check."""
+        If it has attackers then it calls the function gen_scape_moves to generate the moves that can escape the check.
+        The king moves and the castling paths are checked against the attack map of the opponent, that is only computed
+        if the king has a square to go to.
+        The end mask keeps the moves that end on its squares, like the captures for a staged generation."""
+        if self.has_riders[not self.turn]:
+            yield from self.gen_tested_moves(end_mask)
+            return
         king_bb = self.game["King"] & (self.game["White"] if self.turn else self.game["Black"])
         king_sq = self.bbm.msb(king_bb)
         attackers = self.get_attackers_of_square(king_sq, not self.turn)
         blockers = self.get_blockers(king_sq, self.turn)
+        attacked = None
+        if self.get_mask_attack(king_sq, self.turn) & ~self.get_pieces_of_color(self.turn) & ~self.game['Invincible'] & end_mask:
+            attacked = self.get_king_attack_map()
         if attackers:
-            for move in self.gen_scape_moves(attackers):
-                if self.is_safe(king_sq, move, blockers):
+            for move in self.gen_scape_moves(attackers, end_mask, attacked or BB_EMPTY):
+                if self.is_safe(king_sq, move, blockers, attacked):
                     yield move
         else:
-            for move in self.gen_pseudo_moves():
-                if self.is_safe(king_sq, move, blockers):
+            for move in self.gen_pseudo_moves(BB_ALL, end_mask, attacked):
+                if self.is_safe(king_sq, move, blockers, attacked):
                     yield move
 
-    def gen_pseudo_moves(self, start_mask: Bitboard = BB_ALL, end_mask: Bitboard = BB_ALL) -> Iterator[Move]:
+    def gen_tested_moves(self, end_mask: Bitboard = BB_ALL) -> Iterator[Move]:
+        """
+        The legal moves when the opponent has riders, whose pins and checks are not on a line: every pseudo move is
+        played and the king is tested
+        """
+        for move in self.gen_pseudo_moves(BB_ALL, end_mask):
+            if self.is_safe_after(move):
+                yield move
+
+    def is_safe_after(self, move: Move) -> bool:
+        """Play the move without saving it and check that the king is not attacked, a castling also needs the king out of check"""
+        king_sq = self.get_king_square(self.turn)
+        if move.from_sq == king_sq and self.cpm.compute_distance(move.from_sq, move.to_sq) == 2 and \
+                self.is_square_attacked(king_sq, not self.turn):
+            return False
+        game, turn, halfmove_clock, fullmove_number, observers = self.game, self.turn, self.halfmove_clock, self.fullmove_number, self.observers
+        self.game = dict(game)
+        self.observers = []
+        self.update_game(move)
+        is_safe = not self.is_square_attacked(self.get_king_square(turn), not turn)
+        self.game, self.turn, self.halfmove_clock, self.fullmove_number, self.observers = game, turn, halfmove_clock, fullmove_number, observers
+        return is_safe
+
+    def gen_pseudo_moves(self, start_mask: Bitboard = BB_ALL, end_mask: Bitboard = BB_ALL, attacked: Optional[Bitboard] = None) -> Iterator[Move]:
         """
         The gen_pseudo_moves function generates all possible pseudo-legal moves for the current player.
         It does this by first generating all possible attack moves and then adding in the remaining legal moves.
         The gen_attack_moves function is used to generate these attack moves, while the gen_push_pawns and
         gen_castling functions are used to add in other legal move types.
+        The attacked squares are passed to gen_castling_moves.
         """
         my_pieces = self.get_pieces_of_color(self.turn)
         their_pieces = self.get_pieces_of_color(not self.turn)
@@ -404,7 +699,7 @@ class ChessDeck:
         for push_move in self.gen_push_pawns(double_move, 16, start_mask, end_mask):
             yield push_move
 
-        for castling_move in self.gen_castling_moves(start_mask, end_mask):
+        for castling_move in self.gen_castling_moves(start_mask, end_mask, attacked):
             yield castling_move
 
     def gen_attack_moves(self, pieces: Bitboard, condition: Bitboard, start_mask: Bitboard = BB_ALL, end_mask: Bitboard = BB_ALL) -> Iterator[Move]:
@@ -417,18 +712,22 @@ class ChessDeck:
     def gen_push_pawns(self, bb_pawns: Bitboard, distance: int, start_mask: Bitboard = BB_ALL, end_mask: Bitboard = BB_ALL) -> Iterator[Move]:
         """ The gen_push_pawns function generates all possible moves for a pawn to move forward one or two squares.
         It checks if the square is empty and if the pawn is on the correct rank to make a double move."""
+        step = 8 if self.turn is WHITE else -8
         for from_sq in self.bbm.scan_reversed(bb_pawns & start_mask):
             to_sq = from_sq + (distance if self.turn is WHITE else -distance)
+            if distance == 16 and not self.is_square_empty(from_sq + step):
+                continue
             if self.is_square_empty(to_sq) and (BB_SQUARES[to_sq] & end_mask) != BB_EMPTY:
                 yield Move(from_sq, to_sq)
 
-    def gen_castling_moves(self, start_mask: Bitboard = BB_ALL, end_mask: Bitboard = BB_ALL) -> Iterator[Move]:
+    def gen_castling_moves(self, start_mask: Bitboard = BB_ALL, end_mask: Bitboard = BB_ALL, attacked: Optional[Bitboard] = None) -> Iterator[Move]:
         """
         The gen_castling_moves function generates all possible castling moves for the current player.
         It does this by iterating through each of the squares on the castling bitboard, and checking
         if there is a piece between those two squares. If there isn't, then it checks to see if
         the king would be attacked by an enemy piece.
         If they aren't, then it creates a Move object with that move and yields it.
+        The squares are checked against the attack map of the opponent, computed once when the first path is free.
         """
         backrank = BB_RANK_1 if self.turn == WHITE else BB_RANK_8
         king = self.game['King'] & self.game['White' if self.turn else 'Black']
@@ -442,7 +741,9 @@ class ChessDeck:
                 continue
 
             king_movement = self.cpm.compute_between(king_sq, candidate if abs(candidate - king_sq) < 4 else candidate + 1)
-            if self.is_bitboard_attacked(king_movement, not self.turn):
+            if attacked is None:
+                attacked = self.get_king_attack_map()
+            if king_movement & attacked:
                 continue
 
             if self.cpm.compute_file(king_sq) < self.cpm.compute_file(candidate):
@@ -451,14 +752,26 @@ class ChessDeck:
                 to_square = self.bbm.msb(self.bbm.shift_2_left(king))
 
             if (BB_SQUARES[to_square] & end_mask) == BB_EMPTY:
-                return
+                continue
             yield Move(king_sq, to_square)
 
     def get_mask_attack(self, sq: Square, color: Color) -> Bitboard:
         """
         The get_mask_attack function returns a bitboard of all the squares that are attacked by the piece on sq.
-        The get_mask_attack function is called from within the gen_pseudo_move function, and it uses information about which pieces
-        are in play for each player.
+        It uses the attack functions compiled for the deck of the player, since only one piece can be on sq
+        it returns as soon as the piece type is found.
+        """
+        bb_sq = BB_SQUARES[sq]
+        game = self.game
+        for bb_key, attack in self.attack_generators[color]:
+            if bb_sq & game[bb_key]:
+                return attack(sq, game['All'])
+        return BB_EMPTY
+
+    def get_generic_mask_attack(self, sq: Square, color: Color) -> Bitboard:
+        """
+        The generic version of get_mask_attack, it looks up the attack dictionary of every piece in play for the player.
+        It is kept as the reference for the compiled attack functions.
         """
         piece_set = self.white_set if color is WHITE else self.black_set
         bb_moves = BB_EMPTY
@@ -479,6 +792,10 @@ class ChessDeck:
                     attack = self.attacks[piece.name][slide_type][1]
                     bb_moves |= attack[sq][mask[sq] & self.game['All']]
 
+            if 'Riders' in self.attacks[piece.name]:
+                for mask, attack in self.attacks[piece.name]['Riders'][0 if color is WHITE else 1]:
+                    bb_moves |= attack[sq][mask[sq] & self.game['All']]
+
         return bb_moves
 
     def get_additional_castling_move(self, move: Move) -> Move:
@@ -491,13 +808,54 @@ class ChessDeck:
             castling_piece_sq = self.bbm.msb(backrank & BB_FILE_A)
             return Move(castling_piece_sq, move.to_sq + 1)
 
+    def get_checking_pieces(self, color: Color) -> Dict[str, bool]:
+        """
+        The pieces of the deck of a color, other than the king and the pawns, that can give check, with whether they
+        are bound to one color of squares. A piece gives check if it can capture and attacks some square, so the Frogs
+        and the Walls never do. A piece is bound to one color if from every square all its attacks on the empty board
+        are of a single color, like the bishop, the knight or the archer.
+        """
+        checking_pieces = {}
+        for bb_key, attack in self.attack_generators[color]:
+            if bb_key in ('King', 'Pawn') or not NAME_TO_PIECE_TYPE[bb_key].can_capture:
+                continue
+            attacks = [attack(sq, BB_EMPTY) for sq in SQUARES]
+            if any(attacks):
+                checking_pieces[bb_key] = all(not bb & BB_LIGHT_SQUARES or not bb & BB_DARK_SQUARES for bb in attacks)
+        return checking_pieces
+
+    def can_mate(self, color: Color) -> bool:
+        """
+        Checks if the material of a color could ever mate, from the attacks of its pieces. A side without pawns, that
+        could promote, cannot mate if it has no piece that gives check, or if its only other piece gives check from one
+        color of squares and the opponent has a bare king: the king of the attacker never covers two orthogonal
+        neighbours of the other king, so one of them is of the other color than the square that is checked.
+        """
+        game = self.game
+        pieces = self.get_pieces_of_color(color)
+        if pieces & game['Pawn']:
+            return True
+        checkers = [bb_key for bb_key in self.checking_pieces[color] if game[bb_key] & pieces]
+        if not checkers:
+            return False
+        if len(checkers) > 1 or not self.checking_pieces[color][checkers[0]] or pieces.bit_count() > 2:
+            return True
+        return self.get_pieces_of_color(not color).bit_count() > 1
+
+    def is_insufficient_material(self) -> bool:
+        return not self.can_mate(WHITE) and not self.can_mate(BLACK)
+
     def get_status_game(self) -> GameResolution:
         """It returns the status of the game"""
+        if self.is_insufficient_material():
+            return GameResolution.DRAW_BY_INSUFFICIENT_MATERIAL
         if not any(self.gen_legal_moves()):
             if self.is_square_attacked(self.get_king_square(self.turn), not self.turn):
                 return GameResolution.WHITE_WINS if self.turn is BLACK else GameResolution.BLACK_WINS
             else:
                 return GameResolution.DRAW_BY_STALEMATE
+        if self.halfmove_clock >= FIFTY_MOVES_PLIES:
+            return GameResolution.DRAW_BY_FIFTY_MOVES
         if self.fullmove_number > 120:
             return GameResolution.DRAW_BY_LONG
         if self.is_repetition():
@@ -517,8 +875,27 @@ class ChessDeck:
 
     def get_fen(self) -> str:
         """Returns the FEN of the current position"""
-        fen = ''
-        return fen
+        ranks = []
+        for rank in range(7, -1, -1):
+            row = ''
+            empty = 0
+            for file in range(8):
+                sq = rank * 8 + file
+                piece_name = self.get_type_at(sq)
+                if piece_name is None:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                symbol = NAME_TO_PIECE_TYPE[piece_name].symbol
+                row += symbol if self.get_color_at(sq) else symbol.lower()
+            ranks.append(row + (str(empty) if empty else ''))
+
+        castling = ''.join(symbol for symbol, sq in (('K', H1), ('Q', A1), ('k', H8), ('q', A8))
+                           if self.game['Castling'] & BB_SQUARES[sq])
+        en_passant = SQUARE_NAMES[self.bbm.msb(self.game['En passant'])] if self.game['En passant'] else '-'
+        return f"{'/'.join(ranks)} {'w' if self.turn else 'b'} {castling or '-'} {en_passant} {self.halfmove_clock} {self.fullmove_number}"
 
     def set_piece_at(self, sq: Square, piece_name: str, color: Color):
         """Set the piece at a square to a specific piece and color"""
@@ -531,6 +908,9 @@ class ChessDeck:
             self.game['Invincible'] |= mask
         if self.attacks[piece_name]['Non capture']:
             self.game['Non capture'] |= mask
+        if self.observers:
+            for observer in self.observers:
+                observer.on_piece_added(sq, piece_name, color)
 
     def remove_piece_at(self, sq: Square) -> str:
         """
@@ -542,9 +922,10 @@ class ChessDeck:
         if bb_key is None:
             return ""
 
+        color = self.get_color_at(sq)
         self.game[bb_key] ^= mask
         self.game['All'] ^= mask
-        self.game['White' if self.get_color_at(sq) else 'Black'] ^= mask
+        self.game['White' if color else 'Black'] ^= mask
 
         if self.is_piece_invincible(sq):
             self.game['Invincible'] ^= mask
@@ -552,6 +933,9 @@ class ChessDeck:
         if self.is_piece_non_capturable(sq):
             self.game['Non capture'] ^= mask
 
+        if self.observers:
+            for observer in self.observers:
+                observer.on_piece_removed(sq, bb_key, color)
         return bb_key
 
     def change_turn(self):
@@ -561,26 +945,9 @@ class ChessDeck:
     def push(self, move: Move) -> str:
         """
         The push function takes a move as input and updates the board accordingly.
-        It also handles castling, en passant.
+        It also handles castling, en passant, and returns the status of the game after the move.
         """
-        self.apply_move(move)
-        if self.is_move_castling(move):
-            additional_move = self.get_additional_castling_move(move)
-            self.apply_move(additional_move)
-
-        if self.has_been_an_en_passant_capture(move):
-            self.remove_piece_at(move.to_sq - 8 if self.turn is WHITE else move.to_sq + 8)
-        self.clear_en_passant()
-        if self.can_be_en_passanted(move):
-            self.set_en_passant(move)
-        if self.is_move_promotion(move):
-            self.set_piece_at(move.to_sq, self.get_prom_piece(self.turn).name, self.turn)
-
-        self.update_castling_rights(move)
-        self.game_stack.append(deepcopy(self.game))
-        if not self.turn:
-            self.fullmove_number += 1
-        self.change_turn()
+        self.make_move(move)
 
         match self.get_status_game():
             case GameResolution.WHITE_WINS:
@@ -598,16 +965,85 @@ class ChessDeck:
             case GameResolution.DRAW_BY_REPETITION:
                 print('Draw by repetition')
                 status = 'Draw'
+            case GameResolution.DRAW_BY_FIFTY_MOVES:
+                print('Draw by the fifty-move rule')
+                status = 'Draw'
+            case GameResolution.DRAW_BY_INSUFFICIENT_MATERIAL:
+                print('Draw by insufficient material')
+                status = 'Draw'
             case _:
                 status = 'Ongoing'
 
         return status
 
+    def make_move(self, move: Move):
+        """
+        The make_move function updates the board with the move, handling castling, en passant and promotions,
+        without computing the status of the game. It is the one used by the self-play and the search.
+        The observers, like incremental evaluators, are told before the move so they can save their state for pop.
+        """
+        if self.observers:
+            for observer in self.observers:
+                observer.on_push()
+        self.halfmove_stack.append(self.halfmove_clock)
+        self.update_game(move)
+        self.game_stack.append(deepcopy(self.game))
+
+    def make_null_move(self):
+        """
+        The make_null_move function passes the turn without moving a piece, the en passant right is lost by passing.
+        It is saved like a move, so pop undoes it.
+        """
+        if self.observers:
+            for observer in self.observers:
+                observer.on_push()
+        self.halfmove_stack.append(self.halfmove_clock)
+        self.halfmove_clock += 1
+        self.clear_en_passant()
+        if not self.turn:
+            self.fullmove_number += 1
+        self.change_turn()
+        self.game_stack.append(deepcopy(self.game))
+
+    def update_game(self, move: Move):
+        """
+        The update_game function plays the move on the board and passes the turn, without saving the position for pop.
+        It is the part of make_move that is shared with the games of a GameBatch, which do not keep their positions.
+        The halfmove clock starts again after a pawn move or a capture.
+        """
+        if BB_SQUARES[move.from_sq] & self.game['Pawn'] or BB_SQUARES[move.to_sq] & self.get_pieces_of_color(not self.turn):
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        self.apply_move(move)
+        if self.is_move_castling(move):
+            additional_move = self.get_additional_castling_move(move)
+            self.apply_move(additional_move)
+
+        if self.has_been_an_en_passant_capture(move):
+            self.remove_piece_at(move.to_sq - 8 if self.turn is WHITE else move.to_sq + 8)
+        self.clear_en_passant()
+        if self.can_be_en_passanted(move):
+            self.set_en_passant(move)
+        if self.is_move_promotion(move):
+            self.set_piece_at(move.to_sq, self.get_prom_piece(self.turn).name, self.turn)
+
+        self.update_castling_rights(move)
+        if not self.turn:
+            self.fullmove_number += 1
+        self.change_turn()
+
     def pop(self):
         """The pop function undoes the last move"""
         self.game_stack.pop()
         self.game = deepcopy(self.game_stack[-1])
+        self.halfmove_clock = self.halfmove_stack.pop()
         self.turn = not self.turn
+        if self.turn is BLACK:
+            self.fullmove_number -= 1
+        if self.observers:
+            for observer in self.observers:
+                observer.on_pop()
 
     def set_en_passant(self, move: Move):
         """Sets the en passant square"""
@@ -651,6 +1087,12 @@ class ChessDeck:
                 case GameResolution.DRAW_BY_REPETITION:
                     print('Draw by repetition')
                     return 'Draw'
+                case GameResolution.DRAW_BY_FIFTY_MOVES:
+                    print('Draw by the fifty-move rule')
+                    return 'Draw'
+                case GameResolution.DRAW_BY_INSUFFICIENT_MATERIAL:
+                    print('Draw by insufficient material')
+                    return 'Draw'
 
             command = input("Insert a move: ")
             filtered_command = command.replace(" ", "").lower()
@@ -663,9 +1105,12 @@ class ChessDeck:
             elif filtered_command == "enpassant":
                 print(self.bbm.bb_to_str(self.game['En passant']))
                 continue
-            for move in self.gen_legal_moves():
-                if str(move) == filtered_command:
-                    self.push(move)
-                    break
-            else:
+            move = self.parse_move(filtered_command)
+            if move is None:
                 print("Invalid move")
+                continue
+            legality = self.check_move(move)
+            if legality is MoveLegality.LEGAL:
+                self.push(move)
+            else:
+                print(f"Invalid move: {legality.name.lower().replace('_', ' ')}")
@@ -29,6 +29,8 @@ BB_SQUARES = [
 ] = [1 << sq for sq in range(64)]
 
 BB_CORNERS = BB_A1 | BB_H1 | BB_A8 | BB_H8
+BB_LIGHT_SQUARES = 0x55aa_55aa_55aa_55aa
+BB_DARK_SQUARES = 0xaa55_aa55_aa55_aa55
 
 BB_FILES = [
     BB_FILE_A,
@@ -55,13 +57,18 @@ BB_RANKS = [
 FILE_NAMES = ["a", "b", "c", "d", "e", "f", "g", "h"]
 RANK_NAMES = ["1", "2", "3", "4", "5", "6", "7", "8"]
 SQUARE_NAMES = [f + r for r in RANK_NAMES for f in FILE_NAMES]
+SQUARE_INDEX = {name: sq for sq, name in enumerate(SQUARE_NAMES)}
 BB_PROMOTION_RANKS = BB_RANK_1 | BB_RANK_8
 
 
 class ComputerManager:
     @staticmethod
     def compute_square(name: str) -> Square:
-        return SQUARE_NAMES.index(name)
+        """The square of its name, like e4, it raises ValueError if there is no square with that name"""
+        try:
+            return SQUARE_INDEX[name]
+        except KeyError:
+            raise ValueError(f"{name!r} is not a square") from None
 
     @staticmethod
     def compute_square_name(sq: Square) -> str:
@@ -0,0 +1,155 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+from pieces import *
+
+COLORS = [WHITE, BLACK] = [True, False]
+Color = bool
+
+MAX_WEIGHT = {WHITE: 64, BLACK: 66}
+
+# Pools of pieces that each slot of the deck accepts, the king is always on the file e
+SLOT_POOLS = [
+    WHITE_CASTLE_PIECES, WHITE_COMMON_PIECES, WHITE_COMMON_PIECES, WHITE_UNIQUE_PIECES,
+    [King(WHITE)], WHITE_COMMON_PIECES, WHITE_COMMON_PIECES, WHITE_CASTLE_PIECES,
+]
+
+
+class DeckCodec:
+    """
+    The DeckCodec numbers the legal decks of a color, the signatures that follow SLOT_POOLS within the price budget,
+    from 0 to size - 1 in the order of the pools, so the results and the tables of the decks can be flat arrays indexed
+    by the deck id. completions[slot][weight] counts the ways to fill the slots from slot on when weight points are
+    already spent, the index of a deck is the number of legal decks that come before it, summed slot by slot.
+    There is no symmetry that merges legal decks: the board mirror moves the king to the file d, and the color flip
+    changes who moves first and the budget. The unordered pairs of decks, the same matchup with the colors swapped,
+    are numbered by encode_pair.
+    """
+
+    def __init__(self, color: Color = WHITE, max_weight: Optional[int] = None):
+        self.color = color
+        self.max_weight = MAX_WEIGHT[color] if max_weight is None else max_weight
+        self.symbols = [[piece.symbol for piece in pool] for pool in SLOT_POOLS]
+        self.prices = [[piece.price for piece in pool] for pool in SLOT_POOLS]
+        self.completions = self.count_completions()
+        self.size = self.completions[0][0]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def count_completions(self) -> List[List[int]]:
+        completions = [[0] * (self.max_weight + 1) for _ in self.symbols] + [[1] * (self.max_weight + 1)]
+        for slot in range(len(self.symbols) - 1, -1, -1):
+            for weight in range(self.max_weight + 1):
+                completions[slot][weight] = sum(completions[slot + 1][weight + price] for price in self.prices[slot]
+                                                if weight + price <= self.max_weight)
+        return completions
+
+    def encode(self, signature: str) -> int:
+        """The index of a legal signature, a ValueError is raised if it is not legal for the color"""
+        if len(signature) != len(self.symbols):
+            raise ValueError(f"A deck has {len(self.symbols)} pieces, not {signature!r}")
+        index = 0
+        weight = 0
+        for slot, symbol in enumerate(signature.upper()):
+            if symbol not in self.symbols[slot]:
+                raise ValueError(f"The piece {symbol} cannot be in the slot {slot} of {signature!r}")
+            for other, price in zip(self.symbols[slot], self.prices[slot]):
+                if other == symbol:
+                    weight += price
+                    break
+                if weight + price <= self.max_weight:
+                    index += self.completions[slot + 1][weight + price]
+            if weight > self.max_weight:
+                raise ValueError(f"The deck {signature!r} weighs more than {self.max_weight}")
+        return index
+
+    def decode(self, index: int) -> str:
+        """The signature of a deck index"""
+        if not 0 <= index < self.size:
+            raise IndexError(f"The deck index {index} is out of 0 to {self.size - 1}")
+        signature = ""
+        weight = 0
+        for slot in range(len(self.symbols)):
+            for symbol, price in zip(self.symbols[slot], self.prices[slot]):
+                if weight + price > self.max_weight:
+                    continue
+                completions = self.completions[slot + 1][weight + price]
+                if index < completions:
+                    signature += symbol
+                    weight += price
+                    break
+                index -= completions
+        return signature
+
+    def is_legal(self, signature: str) -> bool:
+        try:
+            self.encode(signature)
+        except ValueError:
+            return False
+        return True
+
+    def get_pieces(self, index: int) -> List[Piece]:
+        """The pieces of a deck index, of the color of the codec"""
+        return [piece_from_symbol(symbol, self.color) for symbol in self.decode(index)]
+
+    def gen_signatures(self, slot: int = 0, weight: int = 0, prefix: str = "") -> Iterator[str]:
+        """Generate every legal signature in the order of their indexes"""
+        if slot == len(self.symbols):
+            yield prefix
+            return
+        for symbol, price in zip(self.symbols[slot], self.prices[slot]):
+            if weight + price <= self.max_weight and self.completions[slot + 1][weight + price]:
+                yield from self.gen_signatures(slot + 1, weight + price, prefix + symbol)
+
+    def count_by_weight(self) -> List[int]:
+        """counts[weight] is the number of legal decks that weigh exactly weight points"""
+        counts = [0] * (self.max_weight + 1)
+        for signature in self.gen_signatures():
+            counts[sum(NAME_TO_PIECE_TYPE[SYMBOL_TO_NAME[symbol.lower()]].price for symbol in signature)] += 1
+        return counts
+
+    def count_by_piece(self) -> Dict[str, int]:
+        """The number of legal decks that have each piece at least once"""
+        counts = {symbol: 0 for symbols in self.symbols for symbol in symbols}
+        for signature in self.gen_signatures():
+            for symbol in set(signature):
+                counts[symbol] += 1
+        return counts
+
+    def encode_pair(self, first: str, second: str) -> int:
+        """The index of an unordered pair of decks, the same for both orders, from 0 to size * (size + 1) / 2 - 1"""
+        high, low = sorted((self.encode(first), self.encode(second)), reverse=True)
+        return high * (high + 1) // 2 + low
+
+    def decode_pair(self, index: int) -> Tuple[str, str]:
+        high = int(((8 * index + 1) ** 0.5 - 1) / 2)
+        while high * (high + 1) // 2 > index:
+            high -= 1
+        while (high + 1) * (high + 2) // 2 <= index:
+            high += 1
+        return self.decode(high), self.decode(index - high * (high + 1) // 2)
+
+
+class MatchupCodec:
+    """The MatchupCodec numbers the (white deck, black deck) matchups, from 0 to the product of both sizes - 1"""
+
+    def __init__(self, white_codec: Optional[DeckCodec] = None, black_codec: Optional[DeckCodec] = None):
+        self.white_codec = DeckCodec(WHITE) if white_codec is None else white_codec
+        self.black_codec = DeckCodec(BLACK) if black_codec is None else black_codec
+        self.size = self.white_codec.size * self.black_codec.size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def encode(self, white_signature: str, black_signature: str) -> int:
+        return self.white_codec.encode(white_signature) * self.black_codec.size + self.black_codec.encode(black_signature)
+
+    def decode(self, index: int) -> Tuple[str, str]:
+        if not 0 <= index < self.size:
+            raise IndexError(f"The matchup index {index} is out of 0 to {self.size - 1}")
+        white_index, black_index = divmod(index, self.black_codec.size)
+        return self.white_codec.decode(white_index), self.black_codec.decode(black_index)
+
+    def get_pieces(self, index: int) -> Tuple[List[Piece], List[Piece]]:
+        """The white pieces and the black pieces of a matchup index, the arguments of Deck"""
+        white_index, black_index = divmod(index, self.black_codec.size)
+        return self.white_codec.get_pieces(white_index), self.black_codec.get_pieces(black_index)
@@ -0,0 +1,188 @@
+from typing import List, Optional, Tuple
+from multiprocessing import Pool
+from random import Random
+from math import sqrt
+from chess_deck import ChessDeck, FIFTY_MOVES_PLIES, GameResolution
+from computer import BB_SQUARES
+from deck_codec import DeckCodec, MAX_WEIGHT, SLOT_POOLS
+from decks import Deck
+from pieces import *
+
+COLORS = [WHITE, BLACK] = [True, False]
+Color = bool
+
+NORMAL_SIGNATURE = "RNBQKBNR"
+
+
+def play_game(task: Tuple[str, str, int, int]) -> float:
+    """
+    The play_game function plays a self-play game between two deck signatures and returns the score of white,
+    1 for a win, 0.5 for a draw and 0 for a loss. Both sides play a greedy policy that captures the most expensive
+    piece available and plays a random move otherwise, the seed makes the game reproducible.
+    It lives at module level so the process pool can pickle it.
+    """
+    white_signature, black_signature, seed, max_plies = task
+    rng = Random(seed)
+    chess = ChessDeck(Deck.from_signatures(white_signature, NORMAL_SIGNATURE),
+                      Deck.from_signatures(NORMAL_SIGNATURE, black_signature))
+    prices = {piece.name: piece.price for piece in chess.piece_set}
+
+    for _ in range(max_plies):
+        if chess.is_insufficient_material():
+            return 0.5
+        moves = list(chess.gen_legal_moves())
+        if not moves:
+            if chess.is_square_attacked(chess.get_king_square(chess.turn), not chess.turn):
+                return 0.0 if chess.turn is WHITE else 1.0
+            return 0.5
+        if chess.halfmove_clock >= FIFTY_MOVES_PLIES or chess.fullmove_number > 120 or chess.is_repetition():
+            return 0.5
+
+        their_pieces = chess.get_pieces_of_color(not chess.turn)
+        captures = [move for move in moves if BB_SQUARES[move.to_sq] & their_pieces]
+        if captures:
+            best_price = max(prices[chess.get_type_at(move.to_sq)] for move in captures)
+            moves = [move for move in captures if prices[chess.get_type_at(move.to_sq)] == best_price]
+        chess.make_move(moves[rng.randrange(len(moves))])
+    return 0.5
+
+
+class DeckScore:
+    """The accumulated self-play results of a deck, the score is always from the point of view of the deck"""
+
+    def __init__(self):
+        self.games = 0
+        self.points = 0.0
+
+    def add(self, points: float):
+        self.games += 1
+        self.points += points
+
+    def mean(self) -> float:
+        return self.points / self.games if self.games else 0.5
+
+    def interval(self, z: float) -> Tuple[float, float]:
+        """Wilson score interval of the win rate, draws count as half a win"""
+        if not self.games:
+            return 0.0, 1.0
+        n = self.games
+        p = self.mean()
+        center = (p + z * z / (2 * n)) / (1 + z * z / n)
+        margin = z * sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+        return center - margin, center + margin
+
+
+class DeckOptimizer:
+    """
+    Evolutionary search over the legal decks of one color against a fixed opponent deck.
+    Every generation the candidates are evaluated by batches of parallel self-play games, the batches stop as soon as
+    the confidence interval of the leader separates from the rest (successive elimination). The results of every
+    deck already played are cached in a flat list indexed by the DeckCodec index of the deck, so a deck that survives
+    to the next generation or is found again by a mutation is not replayed, whatever the case of its signature.
+    The objective can be 'strong', maximize the win rate, or 'balanced', get the win rate closer to 0.5.
+    """
+
+    def __init__(self, color: Color = WHITE, opponent_signature: str = NORMAL_SIGNATURE, objective: str = "strong",
+                 batch_size: int = 8, max_games: int = 64, z: float = 1.96, max_plies: int = 240,
+                 processes: Optional[int] = None, seed: int = 0):
+        self.color = color
+        self.opponent_signature = opponent_signature
+        self.objective = objective
+        self.batch_size = batch_size
+        self.max_games = max_games
+        self.z = z
+        self.max_plies = max_plies
+        self.processes = processes
+        self.rng = Random(seed)
+        self.codec = DeckCodec(color)
+        self.scores: List[Optional[DeckScore]] = [None] * self.codec.size
+        self.games_played = 0
+
+    def is_signature_legal(self, signature: str) -> bool:
+        """Check the signature against the slot rules and the price budget of the color"""
+        deck = [Deck.piece_from_symbol(symbol, self.color) for symbol in signature]
+        pair = Deck(deck, None) if self.color is WHITE else Deck(None, deck)
+        return (pair.is_castling_pieces_at_extremes(self.color) and pair.is_king_in_place(self.color)
+                and not pair.is_more_than_one_king(self.color) and pair.weight_deck(self.color) <= MAX_WEIGHT[self.color])
+
+    def random_signature(self) -> str:
+        """A uniform random legal signature"""
+        return self.codec.decode(self.rng.randrange(self.codec.size))
+
+    def mutate(self, signature: str) -> str:
+        """Change the piece of one random slot, except the king, keeping the deck legal"""
+        while True:
+            slot = self.rng.choice([0, 1, 2, 3, 5, 6, 7])
+            pool = SLOT_POOLS[slot]
+            mutant = signature[:slot] + pool[self.rng.randrange(len(pool))].symbol + signature[slot + 1:]
+            if mutant != signature and self.is_signature_legal(mutant):
+                return mutant
+
+    def get_score(self, signature: str) -> DeckScore:
+        index = self.codec.encode(signature)
+        if self.scores[index] is None:
+            self.scores[index] = DeckScore()
+        return self.scores[index]
+
+    def canonicalize(self, signature: str) -> str:
+        """The signature that the codec gives to the deck, the one used for the candidates"""
+        return self.codec.decode(self.codec.encode(signature))
+
+    def fitness(self, signature: str) -> float:
+        mean = self.get_score(signature).mean()
+        return mean if self.objective == "strong" else -abs(mean - 0.5)
+
+    def fitness_interval(self, signature: str) -> Tuple[float, float]:
+        low, high = self.get_score(signature).interval(self.z)
+        if self.objective == "strong":
+            return low, high
+        # The distance to 0.5 is bounded by the farthest and the closest points of the interval
+        worst = max(abs(low - 0.5), abs(high - 0.5))
+        best = 0.0 if low <= 0.5 <= high else min(abs(low - 0.5), abs(high - 0.5))
+        return -worst, -best
+
+    def is_separated(self, candidates: List[str]) -> bool:
+        """The leader is separated when its lower bound is over the upper bound of every other candidate"""
+        leader = max(candidates, key=self.fitness)
+        leader_low = self.fitness_interval(leader)[0]
+        return all(self.fitness_interval(other)[1] < leader_low for other in candidates if other != leader)
+
+    def make_task(self, signature: str, index: int) -> Tuple[str, str, int, int]:
+        seed = self.rng.getrandbits(32) + index
+        if self.color is WHITE:
+            return signature, self.opponent_signature, seed, self.max_plies
+        return self.opponent_signature, signature, seed, self.max_plies
+
+    def evaluate(self, candidates: List[str], pool) -> List[str]:
+        """
+        Play batches of games for the candidates until the leader separates or every candidate reaches max_games.
+        The candidates whose upper bound falls under the lower bound of the leader are eliminated between batches.
+        Returns the candidates sorted by fitness.
+        """
+        candidates = list(dict.fromkeys(self.canonicalize(signature) for signature in candidates))
+        alive = list(candidates)
+        while len(alive) > 1 and not self.is_separated(alive):
+            pending = [signature for signature in alive if self.get_score(signature).games < self.max_games]
+            if not pending:
+                break
+            tasks = [(signature, self.make_task(signature, i)) for signature in pending for i in range(self.batch_size)]
+            for (signature, _), white_points in zip(tasks, pool.imap(play_game, [task for _, task in tasks])):
+                self.get_score(signature).add(white_points if self.color is WHITE else 1.0 - white_points)
+                self.games_played += 1
+
+            leader_low = max(self.fitness_interval(signature)[0] for signature in alive)
+            alive = [signature for signature in alive if self.fitness_interval(signature)[1] >= leader_low]
+        return sorted(candidates, key=self.fitness, reverse=True)
+
+    def optimize(self, generations: int = 10, population: int = 8) -> Tuple[str, DeckScore]:
+        """Run the evolutionary search and return the best signature found with its score"""
+        signatures = [self.random_signature() for _ in range(population)]
+        with Pool(self.processes) as pool:
+            for _ in range(generations):
+                ranked = self.evaluate(signatures, pool)
+                survivors = ranked[:max(1, population // 2)]
+                signatures = list(survivors)
+                while len(signatures) < population:
+                    signatures.append(self.mutate(self.rng.choice(survivors)))
+            ranked = self.evaluate(signatures, pool)
+        return ranked[0], self.get_score(ranked[0])
@@ -0,0 +1,68 @@
+from typing import List, Optional, Tuple
+from random import Random
+import numpy as np
+from deck_codec import DeckCodec, MatchupCodec
+from decks import Deck
+
+COLORS = [WHITE, BLACK] = [True, False]
+Color = bool
+
+
+class DeckSampler:
+    """
+    The DeckSampler draws legal decks uniformly, every legal deck of the color has the same probability, instead of
+    filling the slots one by one and rejecting the decks over the budget, which favors the cheap pieces.
+    A deck is a uniform index of the DeckCodec, and the signatures of every index are precomputed, so a sample is one
+    random number and one list lookup. The bulk samples are drawn with numpy, seeded, for the large tournaments.
+    """
+
+    def __init__(self, color: Color = WHITE, seed: Optional[int] = None, codec: Optional[DeckCodec] = None):
+        self.codec = DeckCodec(color) if codec is None else codec
+        self.color = self.codec.color
+        self.signatures = list(self.codec.gen_signatures())
+        self.rng = Random(seed)
+        self.generator = np.random.default_rng(seed)
+
+    def sample_index(self) -> int:
+        return self.rng.randrange(self.codec.size)
+
+    def sample(self) -> str:
+        """A uniform legal signature"""
+        return self.signatures[self.rng.randrange(self.codec.size)]
+
+    def sample_pieces(self) -> List:
+        return self.codec.get_pieces(self.sample_index())
+
+    def sample_indexes(self, count: int) -> np.ndarray:
+        """count uniform deck indexes, with replacement"""
+        return self.generator.integers(0, self.codec.size, count, dtype=np.int32)
+
+    def sample_signatures(self, count: int) -> List[str]:
+        return [self.signatures[index] for index in self.sample_indexes(count).tolist()]
+
+
+class MatchupSampler:
+    """The MatchupSampler draws uniform (white deck, black deck) matchups, each deck uniform among the legal ones of its color"""
+
+    def __init__(self, seed: Optional[int] = None, codec: Optional[MatchupCodec] = None):
+        self.codec = MatchupCodec() if codec is None else codec
+        self.white_sampler = DeckSampler(WHITE, codec=self.codec.white_codec)
+        self.black_sampler = DeckSampler(BLACK, codec=self.codec.black_codec)
+        self.rng = Random(seed)
+        self.generator = np.random.default_rng(seed)
+
+    def sample(self) -> Tuple[str, str]:
+        return (self.white_sampler.signatures[self.rng.randrange(self.codec.white_codec.size)],
+                self.black_sampler.signatures[self.rng.randrange(self.codec.black_codec.size)])
+
+    def sample_deck(self) -> Deck:
+        return Deck.from_signatures(*self.sample())
+
+    def sample_indexes(self, count: int) -> np.ndarray:
+        """count uniform matchup indexes of the MatchupCodec, with replacement"""
+        return self.generator.integers(0, self.codec.size, count, dtype=np.int64)
+
+    def sample_signatures(self, count: int) -> List[Tuple[str, str]]:
+        white_indexes, black_indexes = np.divmod(self.sample_indexes(count), self.codec.black_codec.size)
+        white, black = self.white_sampler.signatures, self.black_sampler.signatures
+        return [(white[w], black[b]) for w, b in zip(white_indexes.tolist(), black_indexes.tolist())]
@@ -1,5 +1,6 @@
 from typing import Optional, Set, List
 from pieces import *
+from deck_codec import DeckCodec
 from random import randint
 
 COLORS = [WHITE, BLACK] = [True, False]
@@ -7,6 +8,7 @@ Color = bool
 
 # A deck consist of 8 pieces of each color, the white deck and the black deck can be different, due to the black pieces
 # having more points in compensation of playing second
+DECK_CODECS = {WHITE: DeckCodec(WHITE), BLACK: DeckCodec(BLACK)}
 
 
 class Deck:
@@ -32,6 +34,27 @@ class Deck:
         """Get all the pieces that a pawn can be promoted from the deck"""
         return self.get_deck(color)[3]
 
+    def get_signature(self, color: Color) -> str:
+        """Return the canonical signature of the deck, the upper case symbols of the pieces from file a to file h.
+        Empty slots are written as '-'"""
+        return "".join("-" if piece is None else piece.symbol for piece in self.get_deck(color))
+
+    @staticmethod
+    def piece_from_symbol(symbol: str, color: Color) -> Optional[Piece]:
+        """Get the piece of the given color from its symbol, None if the symbol is an empty slot"""
+        if symbol == "-":
+            return None
+        if symbol.upper() not in SYMBOL_TO_PIECE_TYPE:
+            raise ValueError(f"Unknown piece symbol {symbol}")
+        return piece_from_symbol(symbol, color)
+
+    @staticmethod
+    def from_signatures(white_signature: str, black_signature: str) -> "Deck":
+        """Create a deck from the signatures of the white and the black pieces"""
+        white_pieces = [Deck.piece_from_symbol(symbol, WHITE) for symbol in white_signature]
+        black_pieces = [Deck.piece_from_symbol(symbol, BLACK) for symbol in black_signature]
+        return Deck(white_pieces, black_pieces)
+
     def weight_deck(self, color: Color) -> int:
         """Return how many points have been used with the deck"""
         return sum(piece.price for piece in self.get_deck(color))
@@ -88,16 +111,10 @@ class Deck:
         return piece
 
     def create_random_deck(self, color: Color):
-        """Create a random deck of pieces following the basic rules, but not the weight rules"""
-        deck: List = [None] * 8
-        deck[4] = King(color)
-        deck[3] = self.create_random_unique_piece(color)
-        deck[0] = self.create_random_castling_piece(color)
-        deck[-1] = self.create_random_castling_piece(color)
-        for i in range(8):
-            if deck[i] is None:
-                deck[i] = self.create_random_common_piece(color)
-        return deck
+        """Create a random legal deck of pieces, following the slot rules and the weight rules. Every legal deck has the
+        same probability, see DeckCodec"""
+        codec = DECK_CODECS[color]
+        return codec.get_pieces(randint(0, codec.size - 1))
 
     def is_deck_legal(self) -> bool:
         if self.weight_deck(WHITE) > 64:
@@ -108,6 +125,6 @@ class Deck:
             return False
         if self.is_more_than_one_king(WHITE) or self.is_more_than_one_king(BLACK):
             return False
-        if self.is_king_in_place(WHITE) or self.is_king_in_place(BLACK):
+        if not self.is_king_in_place(WHITE) or not self.is_king_in_place(BLACK):
             return False
         return True
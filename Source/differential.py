@@ -0,0 +1,585 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+from collections import deque
+from copy import deepcopy
+from random import Random
+from benchmark import perft
+from bitboards import BitboardManager
+from chess_deck import BOARD, ChessDeck, GameResolution
+from computer import *
+from decks import Deck
+from fen_loader import FenLoader
+from game_batch import GameBatch
+from move import Move
+from pieces import NAME_TO_PIECE_TYPE, Piece
+
+Square = int
+Bitboard = int
+Color = bool
+COLORS = [WHITE, BLACK] = [True, False]
+
+# The positions walked by check_perft, as (name, white signature, black signature, fen), None is the start position.
+# They cover the castling with Ghost and Wall, the invincible and non capturing Frogs, the skewered en passant and the
+# leapers pinned by a slider, that cannot jump over the king nor over the piece that pins them, and the en passant
+# capture of a pawn that gives check after its double push.
+PERFT_POSITIONS = [
+    ("start", "RNBQKBNR", "RNBQKBNR", None),
+    ("kiwipete", "RNBQKBNR", "RNBQKBNR", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"),
+    ("endgame", "RNBQKBNR", "RNBQKBNR", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"),
+    ("promotions", "RNBQKBNR", "RNBQKBNR", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1"),
+    ("knook", "RNBCKBNR", "RNBCKBNR", None),
+    ("fairy", "GAHZKFNW", "WNFZKHAG", None),
+    ("fairy castling", "GAHZKFNW", "WNFZKHAG", "w3k2g/pppf1ppp/8/4p3/4P3/8/PPPF1PPP/G3K2W w KQkq - 0 1"),
+    ("skewered en passant", "GAHZKFNW", "WNFZKHAG", "7k/8/8/K2pP2z/8/8/8/8 w - d6 0 1"),
+    ("pinned leapers", "GNBQKBNG", "RNBQKBNR", "4k3/8/8/4r3/4G3/8/8/4K3 w - - 0 1"),
+    ("pinned frog", "GAHZKFNW", "WNFZKHAG", "4k3/4z3/8/8/4F3/8/8/4K3 w - - 0 1"),
+    ("checking en passant", "RNBQKBNR", "RNBQKBNR", "8/8/8/4k3/3Pp3/8/8/4K3 b - d3 0 1"),
+]
+
+# The positions whose perft of the optimized ChessDeck is compared with the known node count, too deep for the
+# reference, as (name, white signature, black signature, fen, depth, nodes)
+PERFT_COUNTS = [
+    ("endgame perft 5", "RNBQKBNR", "RNBQKBNR", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", 5, 674624),
+]
+
+# The positions checked after a null move of the player to move, like the one of the null move pruning
+NULL_MOVE_POSITIONS = [
+    ("null en passant", "RNBQKBNR", "RNBQKBNR", "4k3/2p5/8/3pP3/8/8/8/R3K3 w - d6 0 2"),
+]
+
+# The decks of the random games of check_game_batch, as (name, white signature, black signature)
+GAME_BATCHES = [
+    ("batch normal", "RNBQKBNR", "RNBQKBNR"),
+    ("batch knook", "RNBCKBNR", "RNBCKBNR"),
+    ("batch fairy", "GAHZKFNW", "WNFZKHAG"),
+]
+
+
+class ReferenceChessDeck:
+    """
+    The ReferenceChessDeck is the specification that the optimized ChessDeck is compared against. It does not inherit
+    from ChessDeck: the board, the attack dictionary, the pseudo moves and the make and unmake are frozen copies of the
+    code of ChessDeck before its optimization, so a later change of any of them only changes one of the two sides.
+    The legality is not the pin and check logic of ChessDeck but its definition: a pseudo move is legal if the king of
+    the player is not attacked once it is played, and a castling also needs the king out of check and its path not
+    attacked. Only the bitboard helpers and the precomputed tables of computer and geometry are shared.
+    Do not change these methods to follow ChessDeck.
+    """
+
+    def __init__(self, white_pieces_deck: Deck, black_pieces_deck: Deck, fen: Optional[str] = None):
+        self.bbm = BitboardManager()
+        self.cpm = ComputerManager()
+        self.white_deck = white_pieces_deck.get_deck(WHITE)
+        self.black_deck = black_pieces_deck.get_deck(BLACK)
+        self.white_set = white_pieces_deck.get_set_pieces(WHITE)
+        self.black_set = black_pieces_deck.get_set_pieces(BLACK)
+        self.white_prom = white_pieces_deck.get_prom_piece(WHITE)
+        self.black_prom = black_pieces_deck.get_prom_piece(BLACK)
+        self.piece_set = self.white_set.union(self.black_set)
+        self.attacks = self.create_dict_attacks()
+
+        if fen is None:
+            self.reset_game()
+            self.turn = WHITE
+            self.halfmove_clock = 0
+            self.fullmove_number = 1
+        else:
+            fnl = FenLoader(fen, self.piece_set, self.attacks)
+            self.game = fnl.load_board()
+            self.turn = fnl.load_turn()
+            self.halfmove_clock = fnl.load_halfmove_clock()
+            self.fullmove_number = fnl.load_fullmove_number()
+        self.game_stack = deque()
+        self.game_stack.append(deepcopy(self.game))
+        self.halfmove_stack = deque()
+
+    def create_dict_attacks(self) -> Dict:
+        all_attacks = {}
+        for piece in self.piece_set:
+            if piece.leaps or piece.riders:
+                all_attacks[piece.name] = BOARD.create_piece_attacks(piece)
+                continue
+            attacks = {}
+            if piece.step_attacks:
+                if piece.symmetry:
+                    attacks['Step'] = [self.cpm.compute_step_attacks(sq, piece.step_attacks) for sq in SQUARES]
+                else:
+                    attacks['Steps'] = [[self.cpm.compute_step_attacks(sq, direction) for sq in SQUARES] for direction
+                                        in piece.step_attacks]
+            if piece.horizontal_slide:
+                attacks['Horizontal slide'] = [BB_RANK_MASK, BB_RANK_ATTACK]
+            if piece.vertical_slide:
+                attacks['Vertical slide'] = [BB_FILE_MASK, BB_FILE_ATTACK]
+            if piece.diagonal_slide:
+                attacks['Diagonal slide'] = [BB_DIAG_MASK, BB_DIAG_ATTACK]
+            attacks['Invincible'] = piece.is_invincible
+            attacks['Non capture'] = not piece.can_capture
+            all_attacks[piece.name] = attacks
+        return all_attacks
+
+    def reset_game(self):
+        self.game = {
+            "Pawn": BB_RANK_2 | BB_RANK_7,
+            "White": BB_RANK_2,
+            "Black": BB_RANK_7,
+            "All": BB_RANK_2 | BB_RANK_7,
+            "Castling": BB_CORNERS,
+            "En passant": BB_EMPTY,
+            "Invincible": BB_EMPTY,
+            "Non capture": BB_EMPTY
+        }
+        for color, deck in ((WHITE, self.white_deck), (BLACK, self.black_deck)):
+            for position, piece in enumerate(deck):
+                if piece is None:
+                    continue
+                bb_piece = (BB_RANK_1 if color else BB_RANK_8) & BB_FILES[position]
+                self.game[piece.name] = self.game.get(piece.name, BB_EMPTY) | bb_piece
+                if piece.is_invincible:
+                    self.game['Invincible'] |= bb_piece
+                if not piece.can_capture:
+                    self.game['Non capture'] |= bb_piece
+                self.game["White" if color else "Black"] |= bb_piece
+                self.game["All"] |= bb_piece
+
+    def get_pieces_of_color(self, color: Color) -> Bitboard:
+        return self.game["White"] if color else self.game["Black"]
+
+    def get_prom_piece(self, color: Color) -> Piece:
+        return self.white_prom if color else self.black_prom
+
+    def get_type_at(self, sq: Square) -> Optional[str]:
+        mask = BB_SQUARES[sq]
+        for key, bitboard in self.game.items():
+            if key in ['All', 'White', 'Black', 'Castling', 'Invincible', 'Non capture', 'En passant']:
+                continue
+            if mask & bitboard:
+                return key
+        return None
+
+    def get_color_at(self, sq: Square) -> Optional[Color]:
+        mask = BB_SQUARES[sq]
+        if mask & self.game['White']:
+            return WHITE
+        elif mask & self.game['Black']:
+            return BLACK
+        return None
+
+    def get_king_square(self, color: Color) -> Square:
+        return self.bbm.msb(self.game['King'] & self.get_pieces_of_color(color))
+
+    def get_mask_attack(self, sq: Square, color: Color) -> Bitboard:
+        piece_set = self.white_set if color is WHITE else self.black_set
+        bb_moves = BB_EMPTY
+        for piece in piece_set:
+            bb_sq = BB_SQUARES[sq]
+            if not (bb_sq & self.game[piece.name]):
+                continue
+            if 'Step' in self.attacks[piece.name]:
+                bb_moves |= self.attacks[piece.name]['Step'][sq]
+            elif 'Steps' in self.attacks[piece.name]:
+                bb_moves |= self.attacks[piece.name]['Steps'][0][sq] if color is WHITE else self.attacks[piece.name]['Steps'][1][sq]
+            for slide_type in ('Diagonal slide', 'Vertical slide', 'Horizontal slide'):
+                if slide_type in self.attacks[piece.name]:
+                    mask = self.attacks[piece.name][slide_type][0]
+                    attack = self.attacks[piece.name][slide_type][1]
+                    bb_moves |= attack[sq][mask[sq] & self.game['All']]
+            if 'Riders' in self.attacks[piece.name]:
+                for mask, attack in self.attacks[piece.name]['Riders'][0 if color is WHITE else 1]:
+                    bb_moves |= attack[sq][mask[sq] & self.game['All']]
+        return bb_moves
+
+    def is_square_attacked(self, sq: Square, color: Color) -> bool:
+        for attacking_piece in self.bbm.scan_reversed(self.get_pieces_of_color(color) & ~self.game['Non capture']):
+            if self.get_mask_attack(attacking_piece, color) & BB_SQUARES[sq]:
+                return True
+        return False
+
+    def is_bitboard_attacked(self, bb: Bitboard, color: Color) -> bool:
+        for sq in self.bbm.scan_reversed(bb):
+            if self.is_square_attacked(sq, color):
+                return True
+        return False
+
+    def gen_legal_moves(self) -> Iterator[Move]:
+        for move in self.gen_pseudo_moves():
+            if self.is_safe_after(move):
+                yield move
+
+    def is_safe_after(self, move: Move) -> bool:
+        king_sq = self.get_king_square(self.turn)
+        if move.from_sq == king_sq and self.cpm.compute_distance(move.from_sq, move.to_sq) == 2 and \
+                self.is_square_attacked(king_sq, not self.turn):
+            return False
+        game, turn, fullmove_number = self.game, self.turn, self.fullmove_number
+        self.game = dict(game)
+        self.update_game(move)
+        is_safe = not self.is_square_attacked(self.get_king_square(turn), not turn)
+        self.game, self.turn, self.fullmove_number = game, turn, fullmove_number
+        return is_safe
+
+    def gen_pseudo_moves(self) -> Iterator[Move]:
+        my_pieces = self.get_pieces_of_color(self.turn)
+        their_pieces = self.get_pieces_of_color(not self.turn)
+        my_pawns = self.game["Pawn"] & my_pieces
+        my_non_capturing_pieces = self.game['Non capture'] & my_pieces
+        my_regular_pieces = my_pieces & ~self.game["Pawn"] & ~self.game['Non capture']
+        yield from self.gen_attack_moves(my_regular_pieces, ~my_pieces & ~self.game['Invincible'])
+        yield from self.gen_attack_moves(my_pawns, (their_pieces | self.game['En passant']) & ~self.game['Invincible'])
+        yield from self.gen_attack_moves(my_non_capturing_pieces, ~self.game['All'])
+        double_move = my_pawns & (BB_RANK_2 if self.turn is WHITE else BB_RANK_7)
+        yield from self.gen_push_pawns(my_pawns, 8)
+        yield from self.gen_push_pawns(double_move, 16)
+        yield from self.gen_castling_moves()
+
+    def gen_attack_moves(self, pieces: Bitboard, condition: Bitboard) -> Iterator[Move]:
+        for from_sq in self.bbm.scan_reversed(pieces):
+            for to_sq in self.bbm.scan_reversed(self.get_mask_attack(from_sq, self.turn) & condition):
+                yield Move(from_sq, to_sq)
+
+    def gen_push_pawns(self, bb_pawns: Bitboard, distance: int) -> Iterator[Move]:
+        step = 8 if self.turn is WHITE else -8
+        for from_sq in self.bbm.scan_reversed(bb_pawns):
+            to_sq = from_sq + (distance if self.turn is WHITE else -distance)
+            if distance == 16 and self.game['All'] & BB_SQUARES[from_sq + step]:
+                continue
+            if not self.game['All'] & BB_SQUARES[to_sq]:
+                yield Move(from_sq, to_sq)
+
+    def gen_castling_moves(self) -> Iterator[Move]:
+        backrank = BB_RANK_1 if self.turn == WHITE else BB_RANK_8
+        king = self.game['King'] & self.get_pieces_of_color(self.turn)
+        king_sq = self.bbm.msb(king)
+        for candidate in self.bbm.scan_reversed(self.game["Castling"] & backrank):
+            if self.cpm.compute_between(candidate, king_sq) & self.game['All']:
+                continue
+            king_movement = self.cpm.compute_between(king_sq, candidate if abs(candidate - king_sq) < 4 else candidate + 1)
+            if self.is_bitboard_attacked(king_movement, not self.turn):
+                continue
+            if self.cpm.compute_file(king_sq) < self.cpm.compute_file(candidate):
+                yield Move(king_sq, king_sq + 2)
+            else:
+                yield Move(king_sq, king_sq - 2)
+
+    def make_move(self, move: Move):
+        pieces = self.game['All'].bit_count()
+        is_pawn_move = BB_SQUARES[move.from_sq] & self.game['Pawn']
+        self.halfmove_stack.append(self.halfmove_clock)
+        self.update_game(move)
+        self.halfmove_clock = 0 if is_pawn_move or self.game['All'].bit_count() < pieces else self.halfmove_clock + 1
+        self.game_stack.append(deepcopy(self.game))
+
+    def update_game(self, move: Move):
+        self.apply_move(move)
+        if self.get_type_at(move.to_sq) == 'King' and self.cpm.compute_distance(move.from_sq, move.to_sq) == 2:
+            backrank = BB_RANK_1 if self.turn == WHITE else BB_RANK_8
+            if move.is_going_right():
+                self.apply_move(Move(self.bbm.msb(backrank & BB_FILE_H), move.to_sq - 1))
+            else:
+                self.apply_move(Move(self.bbm.msb(backrank & BB_FILE_A), move.to_sq + 1))
+        if self.get_type_at(move.to_sq) == 'Pawn' and self.game['En passant'] & BB_SQUARES[move.to_sq]:
+            self.remove_piece_at(move.to_sq - 8 if self.turn is WHITE else move.to_sq + 8)
+        self.game['En passant'] = BB_EMPTY
+        if self.get_type_at(move.to_sq) == 'Pawn' and self.cpm.compute_distance(move.from_sq, move.to_sq) == 2:
+            self.game['En passant'] |= BB_SQUARES[move.to_sq - 8] if self.turn is WHITE else BB_SQUARES[move.to_sq + 8]
+        if self.get_type_at(move.to_sq) == 'Pawn' and BB_SQUARES[move.to_sq] & BB_PROMOTION_RANKS:
+            self.set_piece_at(move.to_sq, self.get_prom_piece(self.turn).name, self.turn)
+        backrank = BB_RANK_1 if self.turn is WHITE else BB_RANK_8
+        if self.get_type_at(move.to_sq) == 'King':
+            self.game['Castling'] &= ~backrank
+        elif BB_SQUARES[move.from_sq] & self.game['Castling']:
+            self.game['Castling'] ^= BB_SQUARES[move.from_sq]
+        if not self.turn:
+            self.fullmove_number += 1
+        self.turn = not self.turn
+
+    def apply_move(self, move: Move):
+        bb_key = self.remove_piece_at(move.from_sq)
+        self.set_piece_at(move.to_sq, bb_key, self.turn)
+
+    def set_piece_at(self, sq: Square, piece_name: str, color: Color):
+        mask = BB_SQUARES[sq]
+        self.remove_piece_at(sq)
+        self.game[piece_name] |= mask
+        self.game['All'] |= mask
+        self.game['White' if color else 'Black'] |= mask
+        if self.attacks[piece_name]['Invincible']:
+            self.game['Invincible'] |= mask
+        if self.attacks[piece_name]['Non capture']:
+            self.game['Non capture'] |= mask
+
+    def remove_piece_at(self, sq: Square) -> str:
+        mask = BB_SQUARES[sq]
+        bb_key = self.get_type_at(sq)
+        if bb_key is None:
+            return ""
+        self.game[bb_key] ^= mask
+        self.game['All'] ^= mask
+        self.game['White' if self.get_color_at(sq) else 'Black'] ^= mask
+        if self.game['Invincible'] & mask:
+            self.game['Invincible'] ^= mask
+        if self.game['Non capture'] & mask:
+            self.game['Non capture'] ^= mask
+        return bb_key
+
+    def make_null_move(self):
+        """Pass the turn, the en passant right is lost and the halfmove clock goes on"""
+        self.halfmove_stack.append(self.halfmove_clock)
+        self.halfmove_clock += 1
+        self.game['En passant'] = BB_EMPTY
+        if not self.turn:
+            self.fullmove_number += 1
+        self.turn = not self.turn
+        self.game_stack.append(deepcopy(self.game))
+
+    def pop(self):
+        self.game_stack.pop()
+        self.game = deepcopy(self.game_stack[-1])
+        self.halfmove_clock = self.halfmove_stack.pop()
+        self.turn = not self.turn
+        if self.turn is BLACK:
+            self.fullmove_number -= 1
+
+    def get_fen(self) -> str:
+        ranks = []
+        for rank in range(7, -1, -1):
+            row = ''
+            empty = 0
+            for file in range(8):
+                piece_name = self.get_type_at(rank * 8 + file)
+                if piece_name is None:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                symbol = NAME_TO_PIECE_TYPE[piece_name].symbol
+                row += symbol if self.get_color_at(rank * 8 + file) else symbol.lower()
+            ranks.append(row + (str(empty) if empty else ''))
+        castling = ''.join(symbol for symbol, sq in (('K', H1), ('Q', A1), ('k', H8), ('q', A8))
+                           if self.game['Castling'] & BB_SQUARES[sq])
+        en_passant = SQUARE_NAMES[self.bbm.msb(self.game['En passant'])] if self.game['En passant'] else '-'
+        return f"{'/'.join(ranks)} {'w' if self.turn else 'b'} {castling or '-'} {en_passant} {self.halfmove_clock} {self.fullmove_number}"
+
+
+class Divergence:
+    """The first position where the optimized ChessDeck and the reference disagree, with the moves that reach it"""
+
+    def __init__(self, fen: str, moves: List[str], reason: str, missing: List[str] = (), extra: List[str] = ()):
+        self.fen = fen
+        self.moves = moves
+        self.reason = reason
+        self.missing = list(missing)
+        self.extra = list(extra)
+
+    def __str__(self):
+        text = f"{self.reason} at {self.fen} after [{' '.join(self.moves)}]"
+        if self.missing:
+            text += f", missing {' '.join(self.missing)}"
+        if self.extra:
+            text += f", extra {' '.join(self.extra)}"
+        return text
+
+
+class DifferentialChecker:
+    """
+    The DifferentialChecker plays the same moves on an optimized ChessDeck and on a ReferenceChessDeck and compares
+    the legal moves of every position and the position after every make_move and pop.
+    It walks perft trees and random self-play games, and shrinks the moves of a divergence to a minimal sequence
+    that still diverges, keeping every move legal for the reference.
+    """
+
+    def __init__(self, white_deck: Deck, black_deck: Deck, fen: Optional[str] = None):
+        self.white_deck = white_deck
+        self.black_deck = black_deck
+        self.fen = fen
+        self.positions = 0
+        self.reset()
+
+    @staticmethod
+    def from_signatures(white_signature: str, black_signature: str, fen: Optional[str] = None) -> "DifferentialChecker":
+        deck = Deck.from_signatures(white_signature, black_signature)
+        return DifferentialChecker(deck, deck, fen)
+
+    def reset(self):
+        self.chess = ChessDeck(self.white_deck, self.black_deck, self.fen)
+        self.reference = ReferenceChessDeck(self.white_deck, self.black_deck, self.fen)
+        self.path: List[str] = []
+
+    def get_legal_moves(self) -> Tuple[Dict[str, Move], Optional[Divergence]]:
+        """The legal moves of the reference by their names, and the divergence of the position if there is one"""
+        self.positions += 1
+        expected = {str(move): move for move in self.reference.gen_legal_moves()}
+        found = [str(move) for move in self.chess.gen_legal_moves()]
+        if len(found) != len(set(found)):
+            duplicated = sorted({name for name in found if found.count(name) > 1})
+            return expected, Divergence(self.reference.get_fen(), list(self.path), "duplicated moves", extra=duplicated)
+        if set(found) != set(expected):
+            return expected, Divergence(self.reference.get_fen(), list(self.path), "different legal moves",
+                                        sorted(set(expected) - set(found)), sorted(set(found) - set(expected)))
+        return expected, None
+
+    def compare_positions(self, reason: str) -> Optional[Divergence]:
+        chess, reference = self.chess, self.reference
+        if chess.game != reference.game or chess.turn != reference.turn or chess.fullmove_number != reference.fullmove_number or \
+                chess.halfmove_clock != reference.halfmove_clock:
+            return Divergence(reference.get_fen(), list(self.path), f"{reason}, the optimized position is {chess.get_fen()}")
+        return None
+
+    def make_move(self, name: str, move: Move) -> Optional[Divergence]:
+        self.path.append(name)
+        self.chess.make_move(move)
+        self.reference.make_move(move)
+        return self.compare_positions("different position after make_move")
+
+    def make_null_move(self) -> Optional[Divergence]:
+        self.path.append("0000")
+        self.chess.make_null_move()
+        self.reference.make_null_move()
+        return self.compare_positions("different position after make_null_move")
+
+    def pop(self) -> Optional[Divergence]:
+        self.chess.pop()
+        self.reference.pop()
+        divergence = self.compare_positions("different position after pop")
+        self.path.pop()
+        return divergence
+
+    def check_perft(self, depth: int) -> Optional[Divergence]:
+        """Walk the legal move tree from the current position in both, returns the first divergence"""
+        legal_moves, divergence = self.get_legal_moves()
+        if divergence is not None or depth == 0:
+            return divergence
+        for name, move in legal_moves.items():
+            divergence = self.make_move(name, move) or self.check_perft(depth - 1)
+            if divergence is not None:
+                return divergence
+            divergence = self.pop()
+            if divergence is not None:
+                return divergence
+        return None
+
+    def replay(self, moves: List[str]) -> Optional[Divergence]:
+        """
+        Play the moves from the start position, comparing every position on the way. It returns the first divergence,
+        or None if there is none or if a move is not legal for the reference.
+        """
+        self.reset()
+        for name in moves:
+            legal_moves, divergence = self.get_legal_moves()
+            if divergence is not None:
+                return divergence
+            if name not in legal_moves:
+                return None
+            divergence = self.make_move(name, legal_moves[name])
+            if divergence is not None:
+                return divergence
+        return self.get_legal_moves()[1]
+
+    def shrink(self, divergence: Divergence) -> Divergence:
+        """
+        Remove moves from the sequence of a divergence while it still diverges, until no move can be removed.
+        It tries single moves and then pairs of one move of each player, that keep the turn of the moves in between.
+        """
+        shrunk = self.remove_moves(divergence)
+        while shrunk is not None:
+            divergence = shrunk
+            shrunk = self.remove_moves(divergence)
+        return divergence
+
+    def remove_moves(self, divergence: Divergence) -> Optional[Divergence]:
+        moves = divergence.moves
+        removals = [(index,) for index in range(len(moves))]
+        removals += [(first, second) for first in range(len(moves)) for second in range(first + 1, len(moves), 2)]
+        for removal in removals:
+            shrunk = self.replay([name for index, name in enumerate(moves) if index not in removal])
+            if shrunk is not None and len(shrunk.moves) < len(moves):
+                return shrunk
+        return None
+
+    def check_random_games(self, games: int, max_plies: int = 80, seed: int = 0) -> Optional[Divergence]:
+        """Play random games from the start position in both, returns the first divergence, shrunk"""
+        rng = Random(seed)
+        for _ in range(games):
+            self.reset()
+            for _ in range(max_plies):
+                legal_moves, divergence = self.get_legal_moves()
+                if divergence is None and legal_moves:
+                    name = rng.choice(sorted(legal_moves))
+                    divergence = self.make_move(name, legal_moves[name])
+                if divergence is not None:
+                    return self.shrink(divergence)
+                if not legal_moves or self.chess.is_repetition():
+                    break
+        return None
+
+
+def check_game_batch(white_signature: str, black_signature: str, games: int, max_plies: int = 80,
+                     seed: int = 0) -> Tuple[Optional[Divergence], int]:
+    """
+    Play random games in a GameBatch and the same moves in a ChessDeck per slot, returns the first position where the
+    legal moves, the board, the counters or the result of a slot differ from the ChessDeck, and the positions compared
+    """
+    deck = Deck.from_signatures(white_signature, black_signature)
+    batch = GameBatch(deck, deck, games, max_plies)
+    games = [ChessDeck(deck, deck) for _ in range(games)]
+    rng = Random(seed)
+    positions = 0
+    while batch.ongoing.any():
+        ongoing = batch.ongoing.copy()
+        legal_moves = batch.gen_legal_moves()
+        for slot, chess in enumerate(games):
+            if not ongoing[slot]:
+                continue
+            positions += 1
+            moves = [str(move) for move in batch.histories[slot]]
+            batch_chess = batch.load(slot)
+            if batch_chess.game != chess.game or batch_chess.get_fen() != chess.get_fen():
+                return Divergence(chess.get_fen(), moves, f"the batch has the board {batch_chess.get_fen()}"), positions
+            if batch.results[slot] is not None:
+                status = chess.get_status_game()
+                if status != batch.results[slot] and not (status is GameResolution.ONGOING and batch.plies[slot] >= max_plies):
+                    return Divergence(chess.get_fen(), moves, f"the batch ends with {batch.results[slot]}"), positions
+                continue
+            expected = {str(move) for move in chess.gen_legal_moves()}
+            generated = {str(move) for move in legal_moves[slot]}
+            if expected != generated:
+                return Divergence(chess.get_fen(), moves, "the batch generates other moves",
+                                  sorted(expected - generated), sorted(generated - expected)), positions
+        chosen = [moves[rng.randrange(len(moves))] if moves else None for moves in legal_moves]
+        for chess, move in zip(games, chosen):
+            if move is not None:
+                chess.make_move(move)
+        batch.step(chosen)
+    return None, positions
+
+
+def check_all(depth: int = 2, games: int = 10, max_plies: int = 80, seed: int = 0) -> List[Tuple[str, Optional[Divergence], int]]:
+    """
+    Run the perft positions and the random games of every position, the perft of the null move positions after a
+    null move, the perft counts and the random games of the game batches, returns (name, divergence, positions) rows
+    """
+    results = []
+    for name, white_signature, black_signature, fen in PERFT_POSITIONS:
+        checker = DifferentialChecker.from_signatures(white_signature, black_signature, fen)
+        divergence = checker.check_perft(depth)
+        if divergence is not None:
+            divergence = checker.shrink(divergence)
+        else:
+            divergence = checker.check_random_games(games, max_plies, seed)
+        results.append((name, divergence, checker.positions))
+    for name, white_signature, black_signature, fen in NULL_MOVE_POSITIONS:
+        checker = DifferentialChecker.from_signatures(white_signature, black_signature, fen)
+        divergence = checker.make_null_move() or checker.check_perft(depth) or checker.pop()
+        results.append((name, divergence, checker.positions))
+    for name, white_signature, black_signature, fen, count_depth, expected in PERFT_COUNTS:
+        deck = Deck.from_signatures(white_signature, black_signature)
+        nodes = perft(ChessDeck(deck, deck, fen), count_depth)
+        divergence = None if nodes == expected else Divergence(fen, [], f"perft {count_depth} gives {nodes} instead of {expected}")
+        results.append((name, divergence, nodes))
+    for name, white_signature, black_signature in GAME_BATCHES:
+        results.append((name, *check_game_batch(white_signature, black_signature, games, max_plies, seed)))
+    return results
+
+
+if __name__ == '__main__':
+    for position_name, first_divergence, checked in check_all():
+        print(f"{position_name:<20} {checked:8d} positions  {first_divergence or 'ok'}")
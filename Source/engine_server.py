@@ -0,0 +1,328 @@
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import Manager
+from time import monotonic
+import argparse
+import asyncio
+import sys
+from analysis_cache import AnalysisCache
+from chess_deck import ChessDeck, MoveLegality
+from decks import Deck
+from opening_book import OpeningBook
+from search import SearchController, TimeManager
+
+COLORS = [WHITE, BLACK] = [True, False]
+
+ENGINE_NAME = "Calabruix"
+ENGINE_AUTHOR = "PinyaColada"
+NORMAL_SIGNATURE = "RNBQKBNR"
+MAX_DEPTH = 64
+DEFAULT_DEPTH = 3
+GO_OPTIONS = ("depth", "movetime", "nodes", "wtime", "btime", "winc", "binc", "movestogo")
+
+# The analysis caches opened by the worker process, a worker keeps its connection between searches
+analysis_caches: Dict[str, AnalysisCache] = {}
+
+
+class SharedTimeManager(TimeManager):
+    """A TimeManager whose deadlines live in the manager of the server, so the session can change them during a ponder"""
+
+    def __init__(self, soft_deadline, hard_deadline):
+        self.shared_soft_deadline = soft_deadline
+        self.shared_hard_deadline = hard_deadline
+
+    @property
+    def soft_deadline(self) -> float:
+        return self.shared_soft_deadline.value
+
+    @property
+    def hard_deadline(self) -> float:
+        return self.shared_hard_deadline.value
+
+
+def get_analysis_cache(path: str) -> AnalysisCache:
+    if path not in analysis_caches:
+        analysis_caches[path] = AnalysisCache(path)
+    return analysis_caches[path]
+
+
+def run_search(white_signature: str, black_signature: str, fen: Optional[str], moves: List[str], depth: int,
+               stop_event, soft_deadline, hard_deadline, cache_path: Optional[str] = None
+               ) -> Tuple[Optional[str], int, int, int]:
+    """
+    The run_search function is the job that runs in the worker processes. It rebuilds the game from the decks, the
+    starting position and the moves, and searches with iterative deepening until the depth is reached, the stop event
+    is set or the deadlines pass. The deadlines are shared with the session, so a ponderhit can set them later.
+    With a cache path, the search reads and writes the analysis cache, that is flushed when the search ends.
+    Returns the best move, its score, the depth reached and the nodes searched.
+    """
+    deck = Deck.from_signatures(white_signature, black_signature)
+    chess = ChessDeck(deck, deck, fen)
+    for uci in moves:
+        chess.make_move(chess.parse_move(uci))
+
+    cache = get_analysis_cache(cache_path) if cache_path else None
+    controller = SearchController(chess, SharedTimeManager(soft_deadline, hard_deadline), depth,
+                                  should_stop=stop_event.is_set, cache=cache)
+    result = controller.run()
+    if cache is not None:
+        cache.flush()
+    return (None if result.move is None else str(result.move)), result.score, result.depth, result.nodes
+
+
+class EngineSession:
+    """
+    One client of the engine, it holds the decks and the position declared by the client and at most one search.
+    The protocol is UCI with one extension to declare the decks: 'deck white RNBQKBNR' and 'deck black RNBQKBNR'.
+    The searches run in the process pool of the server, so reading commands is never blocked by a search.
+    """
+
+    def __init__(self, server: "EngineServer", write: Callable[[str], None]):
+        self.server = server
+        self.write = write
+        self.white_signature = NORMAL_SIGNATURE
+        self.black_signature = NORMAL_SIGNATURE
+        self.fen: Optional[str] = None
+        self.moves: List[str] = []
+        self.stop_event = server.manager.Event()
+        self.soft_deadline = server.manager.Value('d', 0.0)
+        self.hard_deadline = server.manager.Value('d', 0.0)
+        self.turn = WHITE
+        self.go_options: Dict[str, float] = {}
+        self.search_task: Optional[asyncio.Task] = None
+
+    def new_game(self) -> ChessDeck:
+        deck = Deck.from_signatures(self.white_signature, self.black_signature)
+        return ChessDeck(deck, deck, self.fen)
+
+    def get_game(self) -> ChessDeck:
+        """The game of the current position, the moves were already checked by set_position"""
+        chess = self.new_game()
+        for uci in self.moves:
+            chess.make_move(chess.parse_move(uci))
+        return chess
+
+    async def handle(self, line: str) -> bool:
+        """Handle one command, returns False when the session must be closed"""
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, arguments = tokens[0], tokens[1:]
+        match command:
+            case "uci":
+                self.write(f"id name {ENGINE_NAME}")
+                self.write(f"id author {ENGINE_AUTHOR}")
+                self.write("uciok")
+            case "isready":
+                self.write("readyok")
+            case "ucinewgame":
+                await self.stop()
+                self.fen = None
+                self.moves = []
+            case "deck":
+                self.set_deck(arguments)
+            case "position":
+                self.set_position(arguments)
+            case "go":
+                await self.go(arguments)
+            case "stop":
+                await self.stop()
+            case "ponderhit":
+                if not self.set_deadlines(self.go_options):
+                    self.stop_event.set()
+            case "quit":
+                await self.stop()
+                return False
+            case _:
+                self.write(f"info string unknown command {command}")
+        return True
+
+    def set_deck(self, arguments: List[str]):
+        if len(arguments) != 2 or arguments[0] not in ("white", "black"):
+            self.write("info string usage: deck white|black <signature>")
+            return
+        try:
+            pieces = [Deck.piece_from_symbol(symbol, arguments[0] == "white") for symbol in arguments[1]]
+        except ValueError as error:
+            self.write(f"info string {error}")
+            return
+        if len(pieces) != 8:
+            self.write("info string a deck has 8 slots")
+            return
+        if arguments[0] == "white":
+            self.white_signature = arguments[1].upper()
+        else:
+            self.black_signature = arguments[1].upper()
+
+    def set_position(self, arguments: List[str]):
+        """
+        position startpos|fen <fen> [moves <move>...], every move is checked before it is accepted.
+        A fen that cannot be loaded or an illegal move is answered with an info string and the previous position is kept.
+        """
+        moves_index = arguments.index("moves") if "moves" in arguments else len(arguments)
+        fen = " ".join(arguments[1:moves_index]) if arguments and arguments[0] == "fen" else None
+        try:
+            deck = Deck.from_signatures(self.white_signature, self.black_signature)
+            chess = ChessDeck(deck, deck, fen)
+            if any((chess.game['King'] & chess.get_pieces_of_color(color)).bit_count() != 1 for color in COLORS):
+                raise ValueError("every side needs one king")
+        except (IndexError, KeyError, ValueError) as error:
+            self.write(f"info string invalid fen {fen!r}: {error!r}")
+            return
+        moves = []
+        for uci in arguments[moves_index + 1:]:
+            move = chess.parse_move(uci)
+            legality = MoveLegality.UNREACHABLE_SQUARE if move is None else chess.check_move(move)
+            if legality is not MoveLegality.LEGAL:
+                self.write(f"info string illegal move {uci}: {legality.name.lower()}")
+                return
+            chess.make_move(move)
+            moves.append(uci)
+        self.fen = fen
+        self.moves = moves
+        self.turn = chess.turn
+
+    async def go(self, arguments: List[str]):
+        await self.stop()
+        options, flags = self.parse_go(arguments)
+        pondering = "ponder" in flags or "infinite" in flags
+        timed = any(option in options for option in ("movetime", "wtime", "btime"))
+        depth = int(options.get("depth", MAX_DEPTH if timed or pondering else DEFAULT_DEPTH))
+        if not pondering and self.server.book is not None:
+            move = self.server.book.choose_move(self.get_game())
+            if move is not None:
+                self.write("info string book move")
+                self.write(f"bestmove {move}")
+                return
+
+        self.stop_event.clear()
+        self.go_options = options
+        if pondering:
+            self.soft_deadline.value = self.hard_deadline.value = 0.0
+        else:
+            self.set_deadlines(options)
+        self.search_task = asyncio.create_task(self.search(depth))
+
+    def set_deadlines(self, options: Dict[str, float]) -> bool:
+        """Set the shared deadlines from the time options of go, returns False if there is no time limit"""
+        clock, increment = ("wtime", "winc") if self.turn is WHITE else ("btime", "binc")
+        time_manager = TimeManager()
+        time_manager.allocate(remaining=options[clock] / 1000 if clock in options else None,
+                              increment=options.get(increment, 0) / 1000,
+                              moves_to_go=int(options["movestogo"]) if "movestogo" in options else None,
+                              movetime=options["movetime"] / 1000 if "movetime" in options else None)
+        self.soft_deadline.value = time_manager.soft_deadline
+        self.hard_deadline.value = time_manager.hard_deadline
+        return bool(time_manager.hard_deadline)
+
+    @staticmethod
+    def parse_go(arguments: List[str]) -> Tuple[Dict[str, float], Set[str]]:
+        """Split the arguments of go into the options that have a value and the flags"""
+        options = {}
+        flags = set()
+        tokens = iter(arguments)
+        for token in tokens:
+            if token in GO_OPTIONS:
+                value = next(tokens, None)
+                if value is not None and value.lstrip("-").isdigit():
+                    options[token] = float(value)
+            else:
+                flags.add(token)
+        return options, flags
+
+    async def search(self, depth: int):
+        """Run the search in the pool, a search that fails is answered with an info string and the null move"""
+        loop = asyncio.get_running_loop()
+        pool = self.server.pool
+        try:
+            best, score, reached, nodes = await loop.run_in_executor(
+                pool, run_search, self.white_signature, self.black_signature, self.fen, list(self.moves), depth,
+                self.stop_event, self.soft_deadline, self.hard_deadline, self.server.cache_path)
+        except Exception as error:
+            if isinstance(error, BrokenProcessPool):
+                self.server.replace_pool(pool)
+            self.write(f"info string search failed: {error!r}")
+            self.write("bestmove 0000")
+            return
+        self.write(f"info depth {reached} score cp {score} nodes {nodes}")
+        self.write(f"bestmove {best if best is not None else '0000'}")
+
+    async def stop(self):
+        """Stop the running search, if any, and wait until it has written its best move"""
+        if self.search_task is None:
+            return
+        self.stop_event.set()
+        await self.search_task
+        self.search_task = None
+
+
+class EngineServer:
+    """
+    The engine server serves many sessions in one process, from the standard input or from a local socket.
+    All the sessions share one process pool for their searches, the opening book, that is probed before searching,
+    and the analysis cache file.
+    """
+
+    def __init__(self, workers: Optional[int] = None, book_path: Optional[str] = None, cache_path: Optional[str] = None):
+        self.manager = Manager()
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.book = OpeningBook(book_path) if book_path else None
+        self.cache_path = cache_path
+
+    def replace_pool(self, broken: ProcessPoolExecutor):
+        """Start a new process pool in place of a broken one, the sessions that saw it break call it once each"""
+        if self.pool is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    async def serve_session(self, reader: asyncio.StreamReader, write: Callable[[str], None]):
+        session = EngineSession(self, write)
+        while True:
+            line = await reader.readline()
+            if not line or not await session.handle(line.decode().strip()):
+                break
+        await session.stop()
+
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await self.serve_session(reader, lambda text: writer.write((text + "\n").encode()))
+        writer.close()
+
+    async def serve_stdin(self):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+        def write(text: str):
+            sys.stdout.write(text + "\n")
+            sys.stdout.flush()
+
+        await self.serve_session(reader, write)
+
+    async def serve_socket(self, host: str, port: int):
+        server = await asyncio.start_server(self.serve_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+        self.manager.shutdown()
+        if self.book is not None:
+            self.book.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="UCI-like engine server for deck chess")
+    parser.add_argument("--port", type=int, help="serve on a local socket instead of the standard input")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--workers", type=int, help="number of search processes")
+    parser.add_argument("--book", help="opening book file built with opening_book.build_book")
+    parser.add_argument("--cache", help="SQLite file of the analysis cache, created if it does not exist")
+    args = parser.parse_args()
+
+    engine = EngineServer(args.workers, args.book, args.cache)
+    try:
+        asyncio.run(engine.serve_socket(args.host, args.port) if args.port else engine.serve_stdin())
+    finally:
+        engine.close()
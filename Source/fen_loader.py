@@ -63,7 +63,7 @@ class FenLoader:
                 board["Non capture"] |= BB_SQUARES[i]
 
         if self.en_passant != "-":
-            board["En Passant"] = BB_SQUARES[ComputerManager.compute_square(self.en_passant)]
+            board["En passant"] = BB_SQUARES[ComputerManager.compute_square(self.en_passant)]
 
         if "K" in self.castling:
             board["Castling"] |= BB_SQUARES[ComputerManager.compute_square("h1")]
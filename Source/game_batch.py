@@ -0,0 +1,443 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+from collections import Counter
+from random import Random
+import numpy as np
+from chess_deck import ChessDeck, FIFTY_MOVES_PLIES, GameResolution, BOARD
+from computer import BB_FILE_A, BB_FILE_H, BB_RANK_1, BB_RANK_3, BB_RANK_6, BB_RANK_8, BB_PROMOTION_RANKS, \
+    ComputerManager
+from decks import Deck
+from geometry import DIAGONAL_DIRECTIONS, VERTICAL_DIRECTIONS, HORIZONTAL_DIRECTIONS, flip_offsets
+from move import Move
+
+Square = int
+Bitboard = int
+Color = bool
+COLORS = [WHITE, BLACK] = [True, False]
+
+MAX_FULLMOVES = 120  # The limit of get_status_game for a long game
+SPECIAL_KEYS = ['All', 'White', 'Black', 'Castling', 'Invincible', 'Non capture', 'En passant']
+
+ZERO, ONE = np.uint64(0), np.uint64(1)
+SHIFTS = [np.uint64(shift) for shift in (1, 2, 4, 8, 16, 32)]
+SQUARE_BITS = np.array([1 << sq for sq in range(64)], np.uint64)
+BETWEEN = np.array([[ComputerManager().compute_between(a, b) for b in range(64)] for a in range(64)], np.uint64)
+# The bits of every byte value, one after the other, with the number of bits and the first one of every value
+BYTE_BITS = np.array([bit for value in range(256) for bit in range(8) if value >> bit & 1], np.int64)
+BYTE_COUNTS = np.array([value.bit_count() for value in range(256)], np.int64)
+BYTE_STARTS = np.cumsum(BYTE_COUNTS) - BYTE_COUNTS
+
+
+def scan_bitboards(bitboards: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The set bits of an array of bitboards, as the index of the bitboard and the square of every bit, in order.
+    The boards are sparse, so only their bytes that are not empty are expanded to their bits.
+    """
+    data = bitboards.astype('<u8').view(np.uint8)
+    nonempty = np.flatnonzero(data)
+    values = data[nonempty]
+    counts = BYTE_COUNTS[values]
+    firsts = np.cumsum(counts) - counts
+    nth = np.arange(firsts[-1] + counts[-1] if len(counts) else 0) - np.repeat(firsts, counts)
+    bits = BYTE_BITS[np.repeat(BYTE_STARTS[values], counts) + nth]
+    positions = np.repeat(nonempty, counts)
+    return positions >> 3, (positions & 7) * 8 + bits
+
+
+def or_by_index(out: np.ndarray, index: np.ndarray, bitboards: np.ndarray):
+    """OR the bitboards into out at their index, the indices are sorted like the ones of scan_bitboards"""
+    if not len(index):
+        return
+    starts = np.flatnonzero(np.concatenate(([True], index[1:] != index[:-1])))
+    out[index[starts]] |= np.bitwise_or.reduceat(bitboards, starts)
+
+
+class BatchAttacks:
+    """
+    The attacks of a piece type of a color for many squares and occupancies at once. The step attacks are a table of
+    64 bitboards, and every slide or ride is split in its directed rays, that are cut at the nearest occupied square:
+    the lowest one when the ray goes up the square numbers, the highest one when it goes down.
+    """
+
+    def __init__(self, step: Optional[List[Bitboard]], rays: List[Tuple[Tuple[int, int], int]]):
+        self.step = None if step is None else np.array(step, np.uint64)
+        self.rays = [(np.array([BOARD.compute_sliding_attacks(sq, 0, [direction], limit) for sq in range(64)], np.uint64),
+                      direction[1] * 8 + direction[0] > 0) for direction, limit in rays]
+
+    @staticmethod
+    def from_piece(chess: ChessDeck, name: str, color: Color) -> "BatchAttacks":
+        """The tables of a piece as compile_attack_generators picks them, with the rays of its slides and rides"""
+        attacks = chess.attacks[name]
+        if 'Step' in attacks:
+            step = attacks['Step']
+        elif 'Steps' in attacks:
+            step = attacks['Steps'][0] if color is WHITE else attacks['Steps'][1]
+        else:
+            step = None
+        piece = next(piece for piece in chess.get_set_of_color(color) if piece.name == name)
+        directions = ((DIAGONAL_DIRECTIONS if piece.diagonal_slide else []) +
+                      (VERTICAL_DIRECTIONS if piece.vertical_slide else []) +
+                      (HORIZONTAL_DIRECTIONS if piece.horizontal_slide else []))
+        rays = [(direction, 0) for direction in directions]
+        for offsets, limit in piece.riders:
+            rays += [(direction, limit) for direction in (offsets if color is WHITE else flip_offsets(offsets))]
+        return BatchAttacks(step, rays)
+
+    def has_rays(self) -> bool:
+        return bool(self.rays)
+
+    def attack(self, squares: np.ndarray, occupied: np.ndarray, rays_only: bool = False) -> np.ndarray:
+        attacked = self.step[squares] if self.step is not None and not rays_only else np.zeros(len(squares), np.uint64)
+        for table, is_up in self.rays:
+            ray = table[squares]
+            blockers = ray & occupied
+            if is_up:
+                nearest = blockers & (ZERO - blockers)
+                attacked |= ray & ((nearest << ONE) - ONE)
+            else:
+                for shift in SHIFTS:
+                    blockers |= blockers >> shift
+                attacked |= ray & ~(blockers >> ONE)
+        return attacked
+
+
+class GameBatch:
+    """
+    The GameBatch plays many games of the same decks at once, one slot per game, with the board stored as a struct of
+    arrays: every key of the game dictionary is one array of 64 bits integers with a bitboard per slot, and the turns and
+    move counters are arrays too. The legal moves of all the ongoing games are generated together, a piece type at a
+    time: its squares in every slot are scanned at once and its steps and rays are looked up for all of them, the pawn
+    pushes are shifts of the arrays of pawns, and step plays a move in every game with the same array operations.
+    The moves follow the rules of ChessDeck.update_game, and a move is legal when the king is not attacked after it:
+    the king moves are checked against the attack map of the opponent without the king, and the other moves are
+    only played and tested when the king is in check, for en passant, or when a slide or a ride of the opponent reaches
+    the piece that moves.
+    The games end as get_status_game would end them, or after max_plies plies as a long game, when the moves of the
+    next ply are generated. recycle starts a new game in the slots whose game is over.
+    """
+
+    def __init__(self, white_pieces_deck: Deck, black_pieces_deck: Deck, size: int, max_plies: int = 2 * MAX_FULLMOVES):
+        self.chess = ChessDeck(white_pieces_deck, black_pieces_deck)
+        self.keys = list(self.chess.game)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.kinds = [key for key in self.keys if key not in SPECIAL_KEYS]
+        self.kind_rows = np.array([self.index[kind] for kind in self.kinds])
+        self.invincible_rows = [self.index[kind] for kind in self.kinds if self.chess.attacks[kind]['Invincible']]
+        self.non_capture_rows = [self.index[kind] for kind in self.kinds if self.chess.attacks[kind]['Non capture']]
+        self.prom_rows = {color: self.index[self.chess.get_prom_piece(color).name] for color in COLORS}
+        self.attacks = {color: [(name, BatchAttacks.from_piece(self.chess, name, color))
+                                for name, _ in self.chess.attack_generators[color]] for color in COLORS}
+        self.start = np.array([self.chess.game[key] for key in self.keys], np.uint64)
+        self.size = size
+        self.max_plies = max_plies
+
+        self.boards = np.repeat(self.start[:, None], size, axis=1)
+        self.turns = np.ones(size, bool)
+        self.halfmove_clocks = np.zeros(size, np.int64)
+        self.fullmove_numbers = np.ones(size, np.int64)
+        self.plies = np.zeros(size, np.int64)
+        self.ongoing = np.ones(size, bool)
+        self.histories: List[List[Move]] = [[] for _ in range(size)]
+        self.repetitions: List[Counter] = [Counter([self.start.tobytes()]) for _ in range(size)]
+        self.results: List[Optional[GameResolution]] = [None] * size
+        self.move_slots = self.move_from = self.move_to = np.zeros(0, np.int64)
+
+    def load(self, slot: int) -> ChessDeck:
+        """A ChessDeck with the position of the slot, the moves played on it do not change the slot"""
+        chess = self.chess
+        chess.game = {key: int(self.boards[i, slot]) for i, key in enumerate(self.keys)}
+        chess.turn = bool(self.turns[slot])
+        chess.halfmove_clock = int(self.halfmove_clocks[slot])
+        chess.fullmove_number = int(self.fullmove_numbers[slot])
+        return chess
+
+    def is_ongoing(self, slot: int) -> bool:
+        return self.results[slot] is None
+
+    def finish(self, slots: np.ndarray, result: GameResolution):
+        for slot in slots.tolist():
+            self.results[slot] = result
+        self.ongoing[slots] = False
+
+    def can_mate(self, slots: np.ndarray, color: Color) -> np.ndarray:
+        """ChessDeck.can_mate for the games of the slots"""
+        boards = self.boards[:, slots]
+        pieces = boards[self.index['White' if color else 'Black']]
+        their_pieces = boards[self.index['Black' if color else 'White']]
+        checking_pieces = self.chess.checking_pieces[color]
+        checkers = np.zeros(len(slots), np.int64)
+        bound = np.zeros(len(slots), bool)
+        for name, is_bound in checking_pieces.items():
+            present = (boards[self.index[name]] & pieces) != 0
+            checkers += present
+            bound |= present & is_bound
+        return (((pieces & boards[self.index['Pawn']]) != 0) | (checkers > 1) |
+                ((checkers == 1) & (~bound | (np.bitwise_count(pieces) > 2) | (np.bitwise_count(their_pieces) > 1))))
+
+    def gen_attack_map(self, color: Color, boards: np.ndarray, pieces: np.ndarray, occupied: np.ndarray,
+                       rays_only: bool = False) -> np.ndarray:
+        """The squares attacked by the pieces of a color in every board, only by their slides and rides if rays_only"""
+        attacked = np.zeros(len(occupied), np.uint64)
+        for name, attacks in self.attacks[color]:
+            if rays_only and not attacks.has_rays():
+                continue
+            index, squares = scan_bitboards(boards[self.index[name]] & pieces)
+            if len(index):
+                or_by_index(attacked, index, attacks.attack(squares, occupied[index], rays_only))
+        return attacked
+
+    def is_king_attacked(self, color: Color, boards: np.ndarray, pieces: np.ndarray, occupied: np.ndarray,
+                         king: np.ndarray) -> np.ndarray:
+        """Whether the king of every board is attacked by the pieces of the opponent of color"""
+        attacked = np.zeros(len(occupied), bool)
+        for name, attacks in self.attacks[not color]:
+            index, squares = scan_bitboards(boards[self.index[name]] & pieces)
+            if len(index):
+                hits = (attacks.attack(squares, occupied[index]) & king[index]) != 0
+                attacked[index[hits]] = True
+        return attacked
+
+    def gen_turn_moves(self, slots: np.ndarray, color: Color) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The legal moves of the games of the slots, where color is to move, as the arrays of the index of the slot,
+        the origin and the target square of every move, and whether every game is in check
+        """
+        boards = self.boards[:, slots]
+        game = {key: boards[i] for i, key in enumerate(self.keys)}
+        my_pieces = game['White' if color else 'Black']
+        their_pieces = game['Black' if color else 'White']
+        occupied = game['All']
+        king = game['King'] & my_pieces
+        king_index, king_squares = scan_bitboards(king)
+        king_sq = np.zeros(len(slots), np.int64)
+        king_sq[king_index] = king_squares
+        attackers = their_pieces & ~game['Non capture']
+        attacked = self.gen_attack_map(not color, boards, attackers, occupied & ~king)
+        in_check = (attacked & king) != 0
+
+        indices, origins, targets = [], [], []
+        regular = ~my_pieces & ~game['Invincible']
+        for name, attacks in self.attacks[color]:
+            index, squares = scan_bitboards(game[name] & my_pieces)
+            if not len(index):
+                continue
+            if name == 'Pawn':
+                condition = (their_pieces | game['En passant']) & ~game['Invincible']
+            elif self.chess.attacks[name]['Non capture']:
+                condition = ~occupied
+            else:
+                condition = regular
+            piece, to_squares = scan_bitboards(attacks.attack(squares, occupied[index]) & condition[index])
+            indices.append(index[piece])
+            origins.append(squares[piece])
+            targets.append(to_squares)
+
+        pawns = game['Pawn'] & my_pieces
+        if color is WHITE:
+            single = (pawns << np.uint64(8)) & ~occupied
+            double = ((single & np.uint64(BB_RANK_3)) << np.uint64(8)) & ~occupied
+        else:
+            single = (pawns >> np.uint64(8)) & ~occupied
+            double = ((single & np.uint64(BB_RANK_6)) >> np.uint64(8)) & ~occupied
+        forward = 8 if color is WHITE else -8
+        for pushes, distance in ((single, forward), (double, 2 * forward)):
+            index, to_squares = scan_bitboards(pushes)
+            indices.append(index)
+            origins.append(to_squares - distance)
+            targets.append(to_squares)
+
+        index = np.concatenate(indices)
+        from_sq = np.concatenate(origins)
+        to_sq = np.concatenate(targets)
+        to_bb = SQUARE_BITS[to_sq]
+        is_king = from_sq == king_sq[index]
+        legal = np.where(is_king, (attacked[index] & to_bb) == 0, True)
+        ray_attacked = self.gen_attack_map(not color, boards, attackers, occupied, rays_only=True)
+        is_en_passant = ((SQUARE_BITS[from_sq] & game['Pawn'][index]) != 0) & ((to_bb & game['En passant'][index]) != 0)
+        tested = ~is_king & (in_check[index] | is_en_passant | ((ray_attacked[index] & SQUARE_BITS[from_sq]) != 0))
+        if tested.any():
+            test_index, test_from, test_to = index[tested], from_sq[tested], to_bb[tested]
+            captured = test_to | np.where(is_en_passant[tested], SQUARE_BITS[(to_sq[tested] - forward) % 64], ZERO)
+            my_after = (my_pieces[test_index] & ~SQUARE_BITS[test_from]) | test_to
+            their_after = their_pieces[test_index] & ~captured
+            legal[tested] = ~self.is_king_attacked(color, boards[:, test_index], their_after & attackers[test_index],
+                                                   my_after | their_after, king[test_index])
+
+        castling_index, castling_to = self.gen_castling_moves(game, color, king, king_sq, attacked, in_check)
+        index = np.concatenate((index[legal], castling_index))
+        from_sq = np.concatenate((from_sq[legal], king_sq[castling_index]))
+        to_sq = np.concatenate((to_sq[legal], castling_to))
+        order = np.argsort(index, kind='stable')
+        return index[order], from_sq[order], to_sq[order], in_check
+
+    @staticmethod
+    def gen_castling_moves(game: Dict[str, np.ndarray], color: Color, king: np.ndarray, king_sq: np.ndarray,
+                           attacked: np.ndarray, in_check: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """ChessDeck.gen_castling_moves for every game that is not in check, with the corners of the backrank"""
+        backrank = BB_RANK_1 if color is WHITE else BB_RANK_8
+        indices, targets = [], []
+        for corner_bb in (backrank & BB_FILE_A, backrank & BB_FILE_H):
+            corner = corner_bb.bit_length() - 1
+            index = np.flatnonzero(((game['Castling'] & np.uint64(corner_bb)) != 0) & (king != 0) & ~in_check)
+            king_at = king_sq[index]
+            file = king_at % 8
+            to_sq = np.where(file < corner % 8, king_at + 2, king_at - 2)
+            king_end = np.where(np.abs(corner - king_at) < 4, corner, corner + 1)
+            can_castle = (((BETWEEN[corner, king_at] & game['All'][index]) == 0) &
+                          ((BETWEEN[king_at, king_end] & attacked[index]) == 0) &
+                          (np.abs(to_sq % 8 - file) == 2) & (to_sq // 8 == king_at // 8))
+            indices.append(index[can_castle])
+            targets.append(to_sq[can_castle])
+        return np.concatenate(indices), np.concatenate(targets)
+
+    def gen_legal_move_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Generate the legal moves of every ongoing game as the arrays of the slot, the origin and the target square of
+        every move, sorted by slot. The games are finished here in the same order of checks that get_status_game
+        follows, and the finished games have no moves.
+        """
+        slots = np.flatnonzero(self.ongoing)
+        insufficient = ~self.can_mate(slots, WHITE) & ~self.can_mate(slots, BLACK)
+        self.finish(slots[insufficient], GameResolution.DRAW_BY_INSUFFICIENT_MATERIAL)
+        slots = slots[~insufficient]
+
+        move_slots, move_from, move_to = [], [], []
+        for color in COLORS:
+            turn_slots = slots[self.turns[slots] == color]
+            if not len(turn_slots):
+                continue
+            index, from_sq, to_sq, in_check = self.gen_turn_moves(turn_slots, color)
+            has_moves = np.bincount(index, minlength=len(turn_slots)) > 0
+            winner = GameResolution.WHITE_WINS if color is BLACK else GameResolution.BLACK_WINS
+            self.finish(turn_slots[~has_moves & in_check], winner)
+            self.finish(turn_slots[~has_moves & ~in_check], GameResolution.DRAW_BY_STALEMATE)
+            move_slots.append(turn_slots[index])
+            move_from.append(from_sq)
+            move_to.append(to_sq)
+
+        slots = slots[self.ongoing[slots]]
+        fifty = self.halfmove_clocks[slots] >= FIFTY_MOVES_PLIES
+        self.finish(slots[fifty], GameResolution.DRAW_BY_FIFTY_MOVES)
+        slots = slots[~fifty]
+        long = (self.fullmove_numbers[slots] > MAX_FULLMOVES) | (self.plies[slots] >= self.max_plies)
+        self.finish(slots[long], GameResolution.DRAW_BY_LONG)
+        slots = slots[~long]
+        repeated = [slot for slot in slots.tolist()
+                    if self.repetitions[slot][self.boards[:, slot].tobytes()] >= 3]
+        self.finish(np.array(repeated, np.int64), GameResolution.DRAW_BY_REPETITION)
+
+        if not move_slots:
+            self.move_slots = self.move_from = self.move_to = np.zeros(0, np.int64)
+            return self.move_slots, self.move_from, self.move_to
+        move_slots, move_from, move_to = np.concatenate(move_slots), np.concatenate(move_from), np.concatenate(move_to)
+        order = np.argsort(move_slots, kind='stable')
+        keep = self.ongoing[move_slots[order]]
+        self.move_slots, self.move_from, self.move_to = move_slots[order][keep], move_from[order][keep], move_to[order][keep]
+        return self.move_slots, self.move_from, self.move_to
+
+    def gen_legal_moves(self) -> List[List[Move]]:
+        """The legal moves of gen_legal_move_arrays as a list of moves per slot"""
+        legal_moves: List[List[Move]] = [[] for _ in range(self.size)]
+        for slot, from_sq, to_sq in zip(*(array.tolist() for array in self.gen_legal_move_arrays())):
+            legal_moves[slot].append(Move(from_sq, to_sq))
+        return legal_moves
+
+    def move_pieces(self, boards: np.ndarray, from_bb: np.ndarray, to_bb: np.ndarray, turns: np.ndarray):
+        """Move the piece of every origin to its target, that loses its piece, the boards without a move have 0 in both"""
+        white, black = self.index['White'], self.index['Black']
+        kinds = boards[self.kind_rows]
+        moving = (kinds & from_bb) != 0
+        moved = moving.any(axis=0)
+        boards[self.kind_rows] = (kinds & ~(from_bb | to_bb)) | np.where(moving, to_bb, ZERO)
+        boards[white] = (boards[white] & ~(from_bb | to_bb)) | np.where(moved & turns, to_bb, ZERO)
+        boards[black] = (boards[black] & ~(from_bb | to_bb)) | np.where(moved & ~turns, to_bb, ZERO)
+
+    def step_arrays(self, slots: np.ndarray, from_sq: np.ndarray, to_sq: np.ndarray):
+        """Play a move in the game of every slot, like ChessDeck.update_game, the slots are different"""
+        index = self.index
+        boards = self.boards[:, slots]
+        turns = self.turns[slots]
+        from_bb, to_bb = SQUARE_BITS[from_sq], SQUARE_BITS[to_sq]
+        their_pieces = np.where(turns, boards[index['Black']], boards[index['White']])
+        resets = ((boards[index['Pawn']] & from_bb) != 0) | ((their_pieces & to_bb) != 0)
+        self.halfmove_clocks[slots] = np.where(resets, 0, self.halfmove_clocks[slots] + 1)
+        is_pawn = (boards[index['Pawn']] & from_bb) != 0
+        is_king = (boards[index['King']] & from_bb) != 0
+        self.move_pieces(boards, from_bb, to_bb, turns)
+
+        distance = np.maximum(np.abs(from_sq % 8 - to_sq % 8), np.abs(from_sq // 8 - to_sq // 8))
+        backrank = np.where(turns, np.uint64(BB_RANK_1), np.uint64(BB_RANK_8))
+        castling = is_king & (distance == 2)
+        going_right = to_sq > from_sq
+        corner = np.where(going_right, backrank & np.uint64(BB_FILE_H), backrank & np.uint64(BB_FILE_A))
+        rook_to = SQUARE_BITS[np.where(going_right, to_sq - 1, to_sq + 1)]
+        self.move_pieces(boards, np.where(castling, corner, ZERO), np.where(castling, rook_to, ZERO), turns)
+
+        forward = np.where(turns, 8, -8)
+        en_passant = index['En passant']
+        captured = np.where(is_pawn & ((boards[en_passant] & to_bb) != 0), SQUARE_BITS[(to_sq - forward) % 64], ZERO)
+        boards[self.kind_rows] &= ~captured
+        boards[index['White']] &= ~captured
+        boards[index['Black']] &= ~captured
+        boards[en_passant] = np.where(is_pawn & (distance == 2), SQUARE_BITS[(to_sq - forward) % 64], ZERO)
+
+        promoted = np.where(is_pawn, to_bb & np.uint64(BB_PROMOTION_RANKS), ZERO)
+        boards[index['Pawn']] &= ~promoted
+        for color in COLORS:
+            boards[self.prom_rows[color]] |= np.where(turns == color, promoted, ZERO)
+
+        castling_rights = index['Castling']
+        boards[castling_rights] &= np.where(is_king, ~backrank, ~(from_bb & boards[castling_rights]))
+        boards[index['All']] = boards[index['White']] | boards[index['Black']]
+        boards[index['Invincible']] = np.bitwise_or.reduce(boards[self.invincible_rows], axis=0) \
+            if self.invincible_rows else ZERO
+        boards[index['Non capture']] = np.bitwise_or.reduce(boards[self.non_capture_rows], axis=0) \
+            if self.non_capture_rows else ZERO
+        self.boards[:, slots] = boards
+
+        self.fullmove_numbers[slots] += ~turns
+        self.turns[slots] = ~turns
+        self.plies[slots] += 1
+        keys = boards.T.copy()
+        for i, (slot, move_from, move_to) in enumerate(zip(slots.tolist(), from_sq.tolist(), to_sq.tolist())):
+            self.histories[slot].append(Move(move_from, move_to))
+            if not self.halfmove_clocks[slot]:
+                self.repetitions[slot].clear()  # The positions before a pawn move or a capture cannot repeat
+            self.repetitions[slot][keys[i].tobytes()] += 1
+
+    def step(self, moves: Sequence[Optional[Move]]):
+        """Play the move of every ongoing game, the moves of the finished games and the None moves are ignored"""
+        played = [(slot, move) for slot, move in enumerate(moves) if move is not None and self.results[slot] is None]
+        if played:
+            self.step_arrays(np.array([slot for slot, _ in played]), np.array([move.from_sq for _, move in played]),
+                             np.array([move.to_sq for _, move in played]))
+
+    def step_random(self, rng: Random):
+        """Generate the moves and play a random one in every ongoing game"""
+        move_slots, move_from, move_to = self.gen_legal_move_arrays()
+        slots, starts, counts = np.unique(move_slots, return_index=True, return_counts=True)
+        if not len(slots):
+            return
+        chosen = starts + np.array([rng.randrange(count) for count in counts.tolist()])
+        self.step_arrays(slots, move_from[chosen], move_to[chosen])
+
+    def get_finished(self) -> List[int]:
+        return np.flatnonzero(~self.ongoing).tolist()
+
+    def reset_slot(self, slot: int):
+        self.boards[:, slot] = self.start
+        self.turns[slot] = WHITE
+        self.halfmove_clocks[slot] = 0
+        self.fullmove_numbers[slot] = 1
+        self.plies[slot] = 0
+        self.histories[slot] = []
+        self.repetitions[slot] = Counter([self.start.tobytes()])
+        self.results[slot] = None
+        self.ongoing[slot] = True
+
+    def recycle(self) -> List[Tuple[List[Move], GameResolution]]:
+        """Start a new game in every finished slot, returns the moves and the result of the finished games"""
+        finished = []
+        for slot in self.get_finished():
+            finished.append((self.histories[slot], self.results[slot]))
+            self.reset_slot(slot)
+        return finished
@@ -0,0 +1,195 @@
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+from array import array
+from mmap import mmap, ACCESS_READ
+import os
+import struct
+from chess_deck import ChessDeck
+from decks import Deck
+from move import Move
+
+# A game file is the magic and version followed by the games one after the other, every game is:
+#   white signature (8 bytes) | black signature (8 bytes) | result (u8) | fen length (u16) | fen | plies (u16) | moves
+# where every move is packed in 16 bits: origin square | target square << 6 | flags << 12.
+# An empty fen means the starting position of the decks. The index file holds the u64 offset of every game.
+MAGIC = b"CDGR"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sB")
+GAME_HEADER = struct.Struct("<8s8sBH")
+PLIES = struct.Struct("<H")
+OFFSET = struct.Struct("<Q")
+
+RESULTS = [RESULT_UNKNOWN, RESULT_WHITE_WINS, RESULT_BLACK_WINS, RESULT_DRAW] = range(4)
+FLAG_PROMOTION = 1
+
+
+def encode_move(move: Move) -> int:
+    return move.from_sq | move.to_sq << 6 | (FLAG_PROMOTION if move.promotion is not None else 0) << 12
+
+
+def decode_move(code: int) -> Move:
+    """The promotion piece is always the one of the deck, so the flag is enough to know it and it is not stored"""
+    return Move(code & 63, (code >> 6) & 63)
+
+
+class GameRecord:
+    def __init__(self, white_signature: str, black_signature: str, moves: List[int], result: int = RESULT_UNKNOWN,
+                 fen: Optional[str] = None):
+        self.white_signature = white_signature
+        self.black_signature = black_signature
+        self.moves = moves
+        self.result = result
+        self.fen = fen
+
+    def get_moves(self) -> List[Move]:
+        return [decode_move(code) for code in self.moves]
+
+    def new_game(self) -> ChessDeck:
+        deck = Deck.from_signatures(self.white_signature, self.black_signature)
+        return ChessDeck(deck, deck, self.fen)
+
+
+class GameWriter:
+    """
+    The GameWriter streams games to a game file and their offsets to the index file, it is meant to be the output of
+    tournaments and self-play. A game can be written at once with write_game, or move by move with begin_game,
+    add_move and end_game. When it appends to a game file whose index is missing or does not reach the last game,
+    the index is rebuilt by scanning the games first.
+    """
+
+    def __init__(self, path: str, index_path: Optional[str] = None):
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        index_path = index_path or path + ".idx"
+        if not is_new:
+            self.repair_index(path, index_path)
+        self.file: BinaryIO = open(path, "ab")
+        self.index: BinaryIO = open(index_path, "ab")
+        if is_new:
+            self.file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        self.current: Optional[GameRecord] = None
+
+    @staticmethod
+    def repair_index(path: str, index_path: str):
+        """Write the offsets of the GameReader, that scans the games, if the index file does not have all of them"""
+        with GameReader(path, index_path) as reader:
+            offsets = reader.offsets
+        if os.path.exists(index_path) and os.path.getsize(index_path) == len(offsets) * OFFSET.size:
+            return
+        with open(index_path, "wb") as index:
+            index.write(offsets.tobytes())
+
+    def write_game(self, white_signature: str, black_signature: str, moves: List[Move], result: int = RESULT_UNKNOWN,
+                   fen: Optional[str] = None):
+        self.write_record(GameRecord(white_signature, black_signature, [encode_move(move) for move in moves], result, fen))
+
+    def write_record(self, record: GameRecord):
+        fen = (record.fen or "").encode()
+        self.index.write(OFFSET.pack(self.file.tell()))
+        self.file.write(GAME_HEADER.pack(record.white_signature.encode(), record.black_signature.encode(), record.result,
+                                         len(fen)))
+        self.file.write(fen)
+        self.file.write(PLIES.pack(len(record.moves)))
+        self.file.write(array("H", record.moves).tobytes())
+
+    def begin_game(self, white_signature: str, black_signature: str, fen: Optional[str] = None):
+        self.current = GameRecord(white_signature, black_signature, [], RESULT_UNKNOWN, fen)
+
+    def add_move(self, move: Move):
+        self.current.moves.append(encode_move(move))
+
+    def end_game(self, result: int):
+        self.current.result = result
+        self.write_record(self.current)
+        self.current = None
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class GameReader:
+    """
+    The GameReader maps a game file in memory and gives random access to its games through the index file, that is
+    rebuilt by scanning the games when it does not exist or does not reach the last game. The moves are read as an
+    array of 16 bits integers.
+    """
+
+    def __init__(self, path: str, index_path: Optional[str] = None):
+        self.file = open(path, "rb")
+        self.data = mmap(self.file.fileno(), 0, access=ACCESS_READ)
+        magic, version = FILE_HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a game file of version {VERSION}")
+
+        index_path = index_path or path + ".idx"
+        self.offsets = array("Q")
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as index:
+                self.offsets = array("Q", index.read())
+        if not self.is_index_complete():
+            self.offsets = array("Q", self.scan_offsets())
+
+    def is_index_complete(self) -> bool:
+        """The last offset of the index is a game that ends at the end of the file"""
+        if not self.offsets:
+            return len(self.data) == FILE_HEADER.size
+        if self.offsets[-1] >= len(self.data):
+            return False
+        return self.read_at(self.offsets[-1])[1] == len(self.data)
+
+    def scan_offsets(self) -> Iterator[int]:
+        offset = FILE_HEADER.size
+        while offset < len(self.data):
+            yield offset
+            offset = self.read_at(offset)[1]
+
+    def read_at(self, offset: int) -> Tuple[GameRecord, int]:
+        """Read the game that starts at offset, returns it and the offset of the next one"""
+        white, black, result, fen_length = GAME_HEADER.unpack_from(self.data, offset)
+        offset += GAME_HEADER.size
+        fen = self.data[offset:offset + fen_length].decode() or None
+        offset += fen_length
+        plies, = PLIES.unpack_from(self.data, offset)
+        offset += PLIES.size
+        moves = array("H")
+        moves.frombytes(self.data[offset:offset + 2 * plies])
+        record = GameRecord(white.decode(), black.decode(), moves.tolist(), result, fen)
+        return record, offset + 2 * plies
+
+    def read_game(self, index: int) -> GameRecord:
+        return self.read_at(self.offsets[index])[0]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self) -> Iterator[GameRecord]:
+        for offset in self.offsets:
+            yield self.read_at(offset)[0]
+
+    def replay(self, index: int) -> Iterator[Tuple[ChessDeck, Optional[Move]]]:
+        """
+        Reconstruct the positions of a game incrementally, it yields the same ChessDeck after every move with the
+        move that is about to be played, and a last time with None once the game is over.
+        """
+        record = self.read_game(index)
+        chess = record.new_game()
+        for code in record.moves:
+            move = decode_move(code)
+            yield chess, move
+            chess.make_move(move)
+        yield chess, None
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,264 @@
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+from pieces import Piece, King
+
+Square = int
+Bitboard = int
+Offset = Tuple[int, int]  # (files, ranks)
+
+MAX_SIDE = 16
+EAGER_MASK_BITS = 12  # The slide tables of a square with more relevant squares are filled on demand
+FILE_NAMES = "abcdefghijklmnop"
+
+DIAGONAL_DIRECTIONS = [(1, 1), (-1, 1), (1, -1), (-1, -1)]
+VERTICAL_DIRECTIONS = [(0, 1), (0, -1)]
+HORIZONTAL_DIRECTIONS = [(1, 0), (-1, 0)]
+
+
+def deltas_to_offsets(deltas: Iterable[int]) -> List[Offset]:
+    """
+    The step attacks of the pieces are written as square deltas of the 8x8 board, where a delta can move at most two
+    files, so every delta is decoded to its (files, ranks) offset to be used on any board.
+    """
+    offsets = []
+    for delta in deltas:
+        ranks = (delta + 4) // 8
+        offsets.append((delta - 8 * ranks, ranks))
+    return offsets
+
+
+def flip_offsets(offsets: Iterable[Offset]) -> Tuple[Offset, ...]:
+    """The offsets of black, the moves are written for white and forward is up the board"""
+    return tuple(sorted((files, -ranks) for files, ranks in offsets))
+
+
+class SlideTable(dict):
+    """
+    The attacks of a slider from one square, keyed by the occupancy of its relevant squares like the tables of computer.
+    A lazy table computes and keeps the attacks of an occupancy the first time it is looked up, so the wide boards do
+    not build every subset, and the lookup is the same expression for both.
+    """
+
+    def __init__(self, geometry: "Geometry", sq: Square, directions: List[Offset], limit: int = 0):
+        super().__init__()
+        self.geometry = geometry
+        self.sq = sq
+        self.directions = directions
+        self.limit = limit
+
+    def __missing__(self, occupied: Bitboard) -> Bitboard:
+        attacks = self.geometry.compute_sliding_attacks(self.sq, occupied, self.directions, self.limit)
+        self[occupied] = attacks
+        return attacks
+
+
+class Geometry:
+    """
+    The Geometry describes a board of files x ranks squares, from 1x1 to 16x16, with the square 0 at a1 and the squares
+    numbered rank by rank like the 8x8 board of computer. The bitboards are Python integers, that are as wide as needed,
+    so a 10x8 board fits in 80 bits and a 16x16 board in 256 bits without splitting them in words.
+    It generates the masks, the shifts with the masks of its width and the step and slide tables of the pieces.
+    Geometry(8, 8) generates the same tables as computer.
+    """
+
+    def __init__(self, files: int = 8, ranks: int = 8):
+        if not (1 <= files <= MAX_SIDE and 1 <= ranks <= MAX_SIDE):
+            raise ValueError(f"A board has from 1 to {MAX_SIDE} files and ranks, not {files}x{ranks}")
+        self.files = files
+        self.ranks = ranks
+        self.size = files * ranks
+        self.bb_all: Bitboard = (1 << self.size) - 1
+        self.bb_squares = [1 << sq for sq in range(self.size)]
+        self.bb_ranks = [((1 << files) - 1) << (rank * files) for rank in range(ranks)]
+        self.bb_files = [sum(1 << (rank * files + file) for rank in range(ranks)) for file in range(files)]
+        self.bb_corners = (self.bb_squares[0] | self.bb_squares[files - 1] | self.bb_squares[self.size - files] |
+                           self.bb_squares[self.size - 1])
+        self.bb_promotion_ranks = self.bb_ranks[0] | self.bb_ranks[-1]
+        self.square_names = [FILE_NAMES[file] + str(rank + 1) for rank in range(ranks) for file in range(files)]
+        self.square_index = {name: sq for sq, name in enumerate(self.square_names)}
+        self.shift_masks: Dict[int, Bitboard] = {}
+        self.slide_tables: Dict[Tuple, Tuple[List[Bitboard], List[Dict[Bitboard, Bitboard]]]] = {}
+
+    def __repr__(self):
+        return f"Geometry({self.files}, {self.ranks})"
+
+    def compute_square(self, file: int, rank: int) -> Square:
+        return rank * self.files + file
+
+    def compute_file(self, sq: Square) -> int:
+        return sq % self.files
+
+    def compute_rank(self, sq: Square) -> int:
+        return sq // self.files
+
+    def is_on_board(self, file: int, rank: int) -> bool:
+        return 0 <= file < self.files and 0 <= rank < self.ranks
+
+    def get_shift_mask(self, files: int) -> Bitboard:
+        """The squares that stay on the board when they are shifted by some files, so the shift does not wrap"""
+        if files not in self.shift_masks:
+            kept = [file for file in range(self.files) if 0 <= file + files < self.files]
+            self.shift_masks[files] = sum((self.bb_files[file] for file in kept), 0)
+        return self.shift_masks[files]
+
+    def shift(self, bb: Bitboard, files: int, ranks: int) -> Bitboard:
+        """Shift a bitboard by an offset, the squares that leave the board are dropped"""
+        bb &= self.get_shift_mask(files)
+        delta = ranks * self.files + files
+        return (bb << delta) & self.bb_all if delta >= 0 else bb >> -delta
+
+    def shift_up(self, bb: Bitboard) -> Bitboard:
+        return (bb << self.files) & self.bb_all
+
+    def shift_down(self, bb: Bitboard) -> Bitboard:
+        return bb >> self.files
+
+    def shift_right(self, bb: Bitboard) -> Bitboard:
+        return self.shift(bb, 1, 0)
+
+    def shift_left(self, bb: Bitboard) -> Bitboard:
+        return self.shift(bb, -1, 0)
+
+    def shift_up_left(self, bb: Bitboard) -> Bitboard:
+        return self.shift(bb, -1, 1)
+
+    def shift_up_right(self, bb: Bitboard) -> Bitboard:
+        return self.shift(bb, 1, 1)
+
+    def shift_down_left(self, bb: Bitboard) -> Bitboard:
+        return self.shift(bb, -1, -1)
+
+    def shift_down_right(self, bb: Bitboard) -> Bitboard:
+        return self.shift(bb, 1, -1)
+
+    def flip_vertical(self, bb: Bitboard) -> Bitboard:
+        row = (1 << self.files) - 1
+        flipped = 0
+        for rank in range(self.ranks):
+            flipped |= ((bb >> (rank * self.files)) & row) << ((self.ranks - 1 - rank) * self.files)
+        return flipped
+
+    def flip_horizontal(self, bb: Bitboard) -> Bitboard:
+        flipped = 0
+        for file in range(self.files):
+            flipped |= self.shift(bb & self.bb_files[file], self.files - 1 - 2 * file, 0)
+        return flipped
+
+    def scan_forward(self, bb: Bitboard) -> Iterator[Square]:
+        while bb:
+            r = bb & -bb
+            yield r.bit_length() - 1
+            bb ^= r
+
+    def compute_edges(self, sq: Square) -> Bitboard:
+        """The edges that a rook would reach from the square on an empty board, they never block a slide"""
+        return (((self.bb_ranks[0] | self.bb_ranks[-1]) & ~self.bb_ranks[self.compute_rank(sq)]) |
+                ((self.bb_files[0] | self.bb_files[-1]) & ~self.bb_files[self.compute_file(sq)]))
+
+    def compute_sliding_attacks(self, sq: Square, occupied: Bitboard, directions: Iterable[Offset],
+                                limit: int = 0) -> Bitboard:
+        """The squares reached by riding the offsets until an occupied square, or at most limit times if it is not 0"""
+        attacks = 0
+        start_file, start_rank = self.compute_file(sq), self.compute_rank(sq)
+        for file_step, rank_step in directions:
+            file, rank = start_file + file_step, start_rank + rank_step
+            steps = 1
+            while self.is_on_board(file, rank):
+                bb = self.bb_squares[self.compute_square(file, rank)]
+                attacks |= bb
+                if occupied & bb or steps == limit:
+                    break
+                file, rank = file + file_step, rank + rank_step
+                steps += 1
+        return attacks
+
+    def compute_ray_mask(self, sq: Square, directions: Iterable[Offset], limit: int = 0) -> Bitboard:
+        """
+        The squares whose occupancy changes the attacks of a rider, every square of its rays but the last one of each.
+        For the rook and the bishop it is the empty board attack without the edges.
+        """
+        mask = 0
+        for direction in directions:
+            ray = list(self.scan_forward(self.compute_sliding_attacks(sq, 0, [direction], limit)))
+            if ray:
+                farthest = max(ray, key=lambda target: abs(target - sq))
+                mask |= sum(self.bb_squares[target] for target in ray) & ~self.bb_squares[farthest]
+        return mask
+
+    def compute_step_attacks(self, sq: Square, offsets: Iterable[Offset]) -> Bitboard:
+        attacks = 0
+        file, rank = self.compute_file(sq), self.compute_rank(sq)
+        for file_step, rank_step in offsets:
+            if self.is_on_board(file + file_step, rank + rank_step):
+                attacks |= self.bb_squares[self.compute_square(file + file_step, rank + rank_step)]
+        return attacks
+
+    def compute_gen_carry_rippler(self, mask: Bitboard) -> Iterator[Bitboard]:
+        subset = 0
+        while True:
+            yield subset
+            subset = (subset - mask) & mask
+            if not subset:
+                break
+
+    def compute_mask_attack_table(self, directions: List[Offset], limit: int = 0
+                                  ) -> Tuple[List[Bitboard], List[Dict[Bitboard, Bitboard]]]:
+        """
+        The mask and attack tables of a rider, in the format of computer.compute_mask_attack_table. The squares with
+        more than EAGER_MASK_BITS relevant squares get a lazy SlideTable instead of the table of every subset.
+        The tables are cached, so the pieces with the same rides share them.
+        """
+        key = (tuple(directions), limit)
+        if key in self.slide_tables:
+            return self.slide_tables[key]
+        mask_table = []
+        attack_table = []
+        for sq in range(self.size):
+            mask = self.compute_ray_mask(sq, directions, limit)
+            table = SlideTable(self, sq, directions, limit)
+            if mask.bit_count() <= EAGER_MASK_BITS:
+                for subset in self.compute_gen_carry_rippler(mask):
+                    table[subset] = self.compute_sliding_attacks(sq, subset, directions, limit)
+            mask_table.append(mask)
+            attack_table.append(table)
+        self.slide_tables[key] = (mask_table, attack_table)
+        return self.slide_tables[key]
+
+    def create_piece_attacks(self, piece: Piece) -> Dict:
+        """
+        The attack dictionary of a piece, with the same keys as ChessDeck.create_dict_attacks. The pieces compiled by
+        betza have leaps instead of step attacks, and their rides that are not slides have a table per limit under
+        'Riders', one list for white and one for black like 'Steps'.
+        """
+        attacks = {}
+        if piece.leaps:
+            if piece.symmetry:
+                attacks['Step'] = [self.compute_step_attacks(sq, piece.leaps) for sq in range(self.size)]
+            else:
+                attacks['Steps'] = [[self.compute_step_attacks(sq, offsets) for sq in range(self.size)]
+                                    for offsets in (piece.leaps, flip_offsets(piece.leaps))]
+        elif piece.step_attacks:
+            if piece.symmetry:
+                offsets = deltas_to_offsets(piece.step_attacks)
+                attacks['Step'] = [self.compute_step_attacks(sq, offsets) for sq in range(self.size)]
+            else:
+                attacks['Steps'] = [[self.compute_step_attacks(sq, deltas_to_offsets(direction))
+                                     for sq in range(self.size)] for direction in piece.step_attacks]
+        if piece.horizontal_slide:
+            attacks['Horizontal slide'] = list(self.compute_mask_attack_table(HORIZONTAL_DIRECTIONS))
+        if piece.vertical_slide:
+            attacks['Vertical slide'] = list(self.compute_mask_attack_table(VERTICAL_DIRECTIONS))
+        if piece.diagonal_slide:
+            attacks['Diagonal slide'] = list(self.compute_mask_attack_table(DIAGONAL_DIRECTIONS))
+        if piece.riders:
+            attacks['Riders'] = [[list(self.compute_mask_attack_table(list(offsets), limit)) for offsets, limit in rides]
+                                 for rides in (piece.riders, [(flip_offsets(offsets), limit) for offsets, limit in piece.riders])]
+        attacks['Invincible'] = piece.is_invincible
+        attacks['Non capture'] = not piece.can_capture
+        return attacks
+
+    def create_dict_attacks(self, piece_set: Set[Piece]) -> Dict:
+        """The attack dictionary of a set of pieces on this board, as ChessDeck.create_dict_attacks builds it for 8x8"""
+        all_attacks = {"King": self.create_piece_attacks(King(True))}
+        for piece in piece_set:
+            all_attacks[piece.name] = self.create_piece_attacks(piece)
+        return all_attacks
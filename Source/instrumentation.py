@@ -0,0 +1,185 @@
+from typing import Callable, Dict, List, Optional
+from collections import defaultdict
+from functools import wraps
+from inspect import isgeneratorfunction
+from time import perf_counter
+import json
+import chess_deck
+from chess_deck import ChessDeck
+
+# The methods of ChessDeck that are measured, with the phase their own time is added to
+FUNCTION_PHASES = {
+    "gen_legal_moves": "movegen",
+    "gen_scape_moves": "movegen",
+    "gen_pseudo_moves": "movegen",
+    "gen_attack_moves": "movegen",
+    "gen_push_pawns": "movegen",
+    "gen_castling_moves": "movegen",
+    "gen_tested_moves": "movegen",
+    "get_mask_attack": "movegen",
+    "get_type_at": "movegen",
+    "is_safe": "legality",
+    "is_safe_after": "legality",
+    "get_blockers": "legality",
+    "get_attackers_of_square": "legality",
+    "check_move": "legality",
+    "is_square_attacked": "legality",
+    "is_bitboard_attacked": "legality",
+    "get_attack_map": "legality",
+    "make_move": "make/unmake",
+    "make_null_move": "make/unmake",
+    "pop": "make/unmake",
+    "deepcopy": "make/unmake",
+    "get_status_game": "status",
+    "is_repetition": "status",
+}
+
+
+class Instrumentation:
+    """
+    The Instrumentation collects the call counts, the time per function and per phase, and the hit rates of the
+    registered caches of the engine. It replaces the methods of ChessDeck with measuring wrappers only while it is
+    enabled, and puts the original ones back when it is disabled, so it costs nothing when it is not used.
+    The time of every call stack is also kept, to export a flamegraph compatible collapsed stack file.
+    The slider lookups are counted by the attack functions compiled while it is enabled, see instrument.
+    """
+
+    def __init__(self, functions: Optional[Dict[str, str]] = None):
+        self.functions = FUNCTION_PHASES if functions is None else functions
+        self.originals: Dict[str, Callable] = {}
+        self.original_compile = None
+        self.caches: Dict[str, object] = {}
+        self.reset()
+
+    def reset(self):
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.total_time: Dict[str, float] = defaultdict(float)
+        self.self_time: Dict[str, float] = defaultdict(float)
+        self.collapsed: Dict[str, float] = defaultdict(float)
+        self.slider_lookups = 0
+        self.stack: List[List] = []
+
+    def is_enabled(self) -> bool:
+        return bool(self.originals)
+
+    def enter(self, name: str):
+        self.stack.append([name, perf_counter(), 0.0])
+
+    def exit(self):
+        name, start, children_time = self.stack.pop()
+        elapsed = perf_counter() - start
+        own = elapsed - children_time
+        self.total_time[name] += elapsed
+        self.self_time[name] += own
+        self.collapsed[";".join([frame[0] for frame in self.stack] + [name])] += own
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    def wrap(self, name: str, function: Callable) -> Callable:
+        instrumentation = self
+        if isgeneratorfunction(function):
+            @wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                instrumentation.calls[name] += 1
+                generator = function(*args, **kwargs)
+                while True:
+                    instrumentation.enter(name)
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        return
+                    finally:
+                        instrumentation.exit()
+                    yield item
+            return generator_wrapper
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            instrumentation.calls[name] += 1
+            instrumentation.enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                instrumentation.exit()
+        return wrapper
+
+    def counting_compile(self, step, sliders):
+        """Compile the attack function of a piece, counting the slider tables it looks up on every call"""
+        attack = self.original_compile(step, sliders)
+        if not sliders:
+            return attack
+        instrumentation = self
+        lookups = len(sliders)
+
+        def counted_attack(sq, occupied):
+            instrumentation.slider_lookups += lookups
+            return attack(sq, occupied)
+        return counted_attack
+
+    def enable(self) -> "Instrumentation":
+        if self.is_enabled():
+            return self
+        for name in self.functions:
+            if name == "deepcopy":
+                self.originals[name] = chess_deck.deepcopy
+                chess_deck.deepcopy = self.wrap(name, chess_deck.deepcopy)
+            elif hasattr(ChessDeck, name):
+                self.originals[name] = ChessDeck.__dict__[name]
+                setattr(ChessDeck, name, self.wrap(name, ChessDeck.__dict__[name]))
+        self.original_compile = ChessDeck.__dict__["compile_attack_function"].__func__
+        setattr(ChessDeck, "compile_attack_function", staticmethod(self.counting_compile))
+        return self
+
+    def disable(self):
+        for name, original in self.originals.items():
+            if name == "deepcopy":
+                chess_deck.deepcopy = original
+            else:
+                setattr(ChessDeck, name, original)
+        if self.original_compile is not None:
+            setattr(ChessDeck, "compile_attack_function", staticmethod(self.original_compile))
+            self.original_compile = None
+        self.originals = {}
+
+    def instrument(self, chess: ChessDeck):
+        """Compile again the attack functions of a game created before enabling, so its slider lookups are counted"""
+        chess.attack_generators = {color: chess.compile_attack_generators(color) for color in (True, False)}
+
+    def register_cache(self, name: str, cache):
+        """Register a cache with hits and misses counters, like CanonicalCache"""
+        self.caches[name] = cache
+
+    def report(self) -> Dict:
+        nodes = self.calls.get("make_move", 0)
+        phases = defaultdict(float)
+        for name, own in self.self_time.items():
+            phases[self.functions.get(name, "other")] += own
+        return {
+            "nodes": nodes,
+            "calls": dict(self.calls),
+            "calls per node": {name: calls / nodes for name, calls in self.calls.items()} if nodes else {},
+            "slider lookups": self.slider_lookups,
+            "slider lookups per node": self.slider_lookups / nodes if nodes else 0.0,
+            "phases": dict(phases),
+            "functions": {name: {"calls": self.calls[name], "total time": self.total_time[name],
+                                 "self time": self.self_time[name]} for name in self.total_time},
+            "caches": {name: {"hits": cache.hits, "misses": cache.misses,
+                              "hit rate": cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else 0.0}
+                       for name, cache in self.caches.items()},
+        }
+
+    def to_json(self, path: str):
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=1)
+
+    def to_collapsed(self, path: str):
+        """Write the collapsed stacks with their own time in microseconds, the input format of flamegraph.pl"""
+        with open(path, "w") as file:
+            for stack, own in sorted(self.collapsed.items()):
+                file.write(f"{stack} {max(int(own * 1_000_000), 1)}\n")
+
+    def __enter__(self):
+        return self.enable()
+
+    def __exit__(self, *args):
+        self.disable()
@@ -0,0 +1,140 @@
+from typing import Dict, List
+import numpy as np
+from chess_deck import ChessDeck
+from pieces import PIECE_TYPES
+
+Square = int
+Color = bool
+COLORS = [WHITE, BLACK] = [True, False]
+
+FEATURES = 2 * len(PIECE_TYPES) * 64
+HIDDEN = 128
+SECOND = 32
+OUTPUT_SCALE = 600  # The output of the network is scaled to centipawns
+
+
+def compute_features(type_id: int, sq: Square, color: Color) -> Dict[Color, int]:
+    """
+    The feature of a piece from the point of view of each player: the pieces of the player go first and
+    the board is flipped vertically for black, so both perspectives share the same weights.
+    """
+    return {
+        WHITE: (2 * type_id + (0 if color is WHITE else 1)) * 64 + sq,
+        BLACK: (2 * type_id + (0 if color is BLACK else 1)) * 64 + (sq ^ 56),
+    }
+
+
+class NNUEWeights:
+    """The weights of the network, a feature transformer of FEATURES x HIDDEN followed by two small dense layers"""
+
+    def __init__(self, w1: np.ndarray, b1: np.ndarray, w2: np.ndarray, b2: np.ndarray, w3: np.ndarray, b3: np.ndarray):
+        self.w1 = np.ascontiguousarray(w1, np.float32)
+        self.b1 = np.asarray(b1, np.float32)
+        self.w2 = np.asarray(w2, np.float32)
+        self.b2 = np.asarray(b2, np.float32)
+        self.w3 = np.asarray(w3, np.float32)
+        self.b3 = np.asarray(b3, np.float32)
+
+    @staticmethod
+    def load(path: str) -> "NNUEWeights":
+        """Load the weights from a local .npz file with the arrays w1, b1, w2, b2, w3 and b3"""
+        with np.load(path) as data:
+            weights = NNUEWeights(*(data[name] for name in ("w1", "b1", "w2", "b2", "w3", "b3")))
+        if weights.w1.shape != (FEATURES, weights.b1.shape[0]):
+            raise ValueError(f"{path} has {weights.w1.shape[0]} features, expected {FEATURES}")
+        return weights
+
+    @staticmethod
+    def random(seed: int = 0, hidden: int = HIDDEN, second: int = SECOND) -> "NNUEWeights":
+        """Random weights, to start a training or to benchmark"""
+        rng = np.random.default_rng(seed)
+        return NNUEWeights(rng.normal(0, 0.1, (FEATURES, hidden)), np.zeros(hidden),
+                           rng.normal(0, 1 / np.sqrt(2 * hidden), (2 * hidden, second)), np.zeros(second),
+                           rng.normal(0, 1 / np.sqrt(second), (second, 1)), np.zeros(1))
+
+    def save(self, path: str):
+        np.savez(path, w1=self.w1, b1=self.b1, w2=self.w2, b2=self.b2, w3=self.w3, b3=self.b3)
+
+
+class NNUEEvaluator:
+    """
+    An evaluator whose first layer is an accumulator over the (piece type, square, color) features of both players.
+    It observes a ChessDeck, so the accumulators are updated from the same set_piece_at and remove_piece_at deltas
+    that change the board, and saved and restored with make_move and pop. Only the small layers run per evaluation,
+    and evaluate_batch runs them for many accumulators at once.
+    """
+
+    def __init__(self, weights: NNUEWeights):
+        self.weights = weights
+        self.type_ids = {piece_type.name: piece_type.type_id for piece_type in PIECE_TYPES}
+        self.accumulators = {WHITE: weights.b1.copy(), BLACK: weights.b1.copy()}
+        self.stack: List[Dict[Color, np.ndarray]] = []
+        self.evaluations = 0
+
+    def attach(self, chess: ChessDeck):
+        """Start observing a game, the accumulators are computed once from scratch"""
+        self.check_pieces(chess)
+        if self not in chess.observers:
+            chess.observers.append(self)
+        self.refresh(chess)
+
+    def detach(self, chess: ChessDeck):
+        chess.observers.remove(self)
+
+    def check_pieces(self, chess: ChessDeck):
+        """
+        The features are sized with the piece types registered when the weights are built, a piece compiled by betza
+        later has no row in the weights, so a game with it cannot be evaluated
+        """
+        piece_types = self.weights.w1.shape[0] // (2 * 64)
+        for piece in chess.piece_set:
+            if piece.name not in self.type_ids or self.type_ids[piece.name] >= piece_types:
+                raise ValueError(f"The piece {piece.name} has no features in weights of {piece_types} piece types")
+
+    def refresh(self, chess: ChessDeck):
+        game = chess.game
+        self.stack = []
+        for perspective in COLORS:
+            self.accumulators[perspective] = self.weights.b1.copy()
+        for name in self.type_ids:
+            if name not in game:
+                continue
+            for color, pieces in ((WHITE, game['White']), (BLACK, game['Black'])):
+                for sq in chess.bbm.scan_forward(game[name] & pieces):
+                    self.on_piece_added(sq, name, color)
+
+    def on_piece_added(self, sq: Square, piece_name: str, color: Color):
+        features = compute_features(self.type_ids[piece_name], sq, color)
+        self.accumulators[WHITE] += self.weights.w1[features[WHITE]]
+        self.accumulators[BLACK] += self.weights.w1[features[BLACK]]
+
+    def on_piece_removed(self, sq: Square, piece_name: str, color: Color):
+        features = compute_features(self.type_ids[piece_name], sq, color)
+        self.accumulators[WHITE] -= self.weights.w1[features[WHITE]]
+        self.accumulators[BLACK] -= self.weights.w1[features[BLACK]]
+
+    def on_push(self):
+        self.stack.append({WHITE: self.accumulators[WHITE].copy(), BLACK: self.accumulators[BLACK].copy()})
+
+    def on_pop(self):
+        self.accumulators = self.stack.pop()
+
+    def get_input(self, turn: Color) -> np.ndarray:
+        """The input of the dense layers, the accumulator of the side to move goes first"""
+        return np.concatenate((self.accumulators[turn], self.accumulators[not turn]))
+
+    def forward(self, inputs: np.ndarray) -> np.ndarray:
+        """Run the dense layers on a batch of inputs of shape (batch, 2 * hidden), returns centipawns"""
+        weights = self.weights
+        hidden = np.clip(inputs, 0.0, 1.0) @ weights.w2 + weights.b2
+        output = np.clip(hidden, 0.0, 1.0) @ weights.w3 + weights.b3
+        return output[:, 0] * OUTPUT_SCALE
+
+    def evaluate(self, chess: ChessDeck) -> int:
+        """Score of the position from the point of view of the side to move"""
+        self.evaluations += 1
+        return int(self.forward(self.get_input(chess.turn)[None, :])[0])
+
+    def evaluate_batch(self, inputs: np.ndarray) -> np.ndarray:
+        self.evaluations += len(inputs)
+        return self.forward(inputs).astype(np.int64)
@@ -0,0 +1,172 @@
+from typing import Dict, List, Optional, Tuple
+from bisect import bisect_left
+from collections import defaultdict
+from hashlib import blake2b
+from mmap import mmap, ACCESS_READ
+from random import Random
+import struct
+from chess_deck import ChessDeck
+from game_record import GameReader, GameRecord, encode_move, decode_move, RESULT_WHITE_WINS, RESULT_BLACK_WINS, \
+    RESULT_DRAW
+from move import Move
+from symmetry import SymmetryManager
+
+COLORS = [WHITE, BLACK] = [True, False]
+
+# A book file is the magic, the version and the number of entries followed by the entries sorted by key and move:
+#   key (u64) | move (u16) | wins (u32) | draws (u32) | losses (u32)
+# The key is the hash of the deck signatures and of the canonical position, the move is the packed move of the
+# canonical board, and the results are counted from the point of view of the side to move.
+MAGIC = b"CDOB"
+VERSION = 1
+HEADER = struct.Struct("<4sBI")
+ENTRY = struct.Struct("<QHIII")
+
+
+def compute_book_key(white_signature: str, black_signature: str, position_hash: int) -> int:
+    """The key of a position of a deck pair, the same position with other decks is another entry"""
+    data = f"{white_signature}/{black_signature}".encode() + position_hash.to_bytes(8, "little")
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), "little")
+
+
+class BookMove:
+    def __init__(self, move: Move, wins: int, draws: int, losses: int):
+        self.move = move
+        self.wins = wins
+        self.draws = draws
+        self.losses = losses
+
+    def get_games(self) -> int:
+        return self.wins + self.draws + self.losses
+
+    def get_score(self) -> float:
+        """The score of the move for the side to move, between 0 and 1"""
+        return (self.wins + self.draws / 2) / self.get_games()
+
+    def __repr__(self):
+        return f"BookMove({self.move}, +{self.wins} ={self.draws} -{self.losses})"
+
+
+class OpeningBookBuilder:
+    """
+    The OpeningBookBuilder aggregates the results of the moves played in the first max_plies of stored games,
+    per deck pair and canonical position, and writes them as a book file. The moves played in less than
+    min_games games are left out of the book.
+    """
+
+    def __init__(self, max_plies: int = 16, min_games: int = 2):
+        self.max_plies = max_plies
+        self.min_games = min_games
+        self.stats: Dict[Tuple[int, int], List[int]] = defaultdict(lambda: [0, 0, 0])
+        self.games = 0
+
+    def add_game(self, record: GameRecord):
+        """Add the opening of a game, the games without a result are skipped"""
+        if record.result not in (RESULT_WHITE_WINS, RESULT_BLACK_WINS, RESULT_DRAW):
+            return
+        chess = record.new_game()
+        symmetry = SymmetryManager(chess)
+        white_signature = chess.white_pieces_deck.get_signature(WHITE)
+        black_signature = chess.black_pieces_deck.get_signature(BLACK)
+        for move in record.get_moves()[:self.max_plies]:
+            key, transform = symmetry.canonicalize(chess.game, chess.turn)
+            book_key = compute_book_key(white_signature, black_signature, symmetry.compute_position_hash(key))
+            entry = self.stats[(book_key, encode_move(symmetry.transform_move(move, transform)))]
+            if record.result == RESULT_DRAW:
+                entry[1] += 1
+            elif (record.result == RESULT_WHITE_WINS) == (chess.turn is WHITE):
+                entry[0] += 1
+            else:
+                entry[2] += 1
+            chess.make_move(move)
+        self.games += 1
+
+    def add_games(self, path: str):
+        with GameReader(path) as reader:
+            for record in reader:
+                self.add_game(record)
+
+    def write(self, path: str) -> int:
+        """Write the book file, returns the number of entries written"""
+        entries = sorted((book_key, move, *results) for (book_key, move), results in self.stats.items()
+                         if sum(results) >= self.min_games)
+        with open(path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, len(entries)))
+            for entry in entries:
+                file.write(ENTRY.pack(*entry))
+        return len(entries)
+
+
+def build_book(game_paths: List[str], path: str, max_plies: int = 16, min_games: int = 2) -> int:
+    builder = OpeningBookBuilder(max_plies, min_games)
+    for game_path in game_paths:
+        builder.add_games(game_path)
+    return builder.write(path)
+
+
+class OpeningBook:
+    """
+    The OpeningBook maps a book file in memory and finds the moves of a position with a binary search over the keys,
+    so opening a book costs nothing and a probe reads a few pages. The moves found are checked to be legal, because
+    two positions may share a key.
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        self.data = mmap(self.file.fileno(), 0, access=ACCESS_READ)
+        magic, version, self.size = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a book file of version {VERSION}")
+        self.symmetries: Dict[Tuple[str, str], SymmetryManager] = {}
+
+    def get_key_at(self, index: int) -> int:
+        return struct.unpack_from("<Q", self.data, HEADER.size + index * ENTRY.size)[0]
+
+    def get_symmetry(self, chess: ChessDeck) -> SymmetryManager:
+        signatures = (chess.white_pieces_deck.get_signature(WHITE), chess.black_pieces_deck.get_signature(BLACK))
+        if signatures not in self.symmetries:
+            self.symmetries[signatures] = SymmetryManager(chess)
+        return self.symmetries[signatures]
+
+    def get_moves(self, chess: ChessDeck) -> List[BookMove]:
+        """The legal book moves of the current position, the most played first"""
+        symmetry = self.get_symmetry(chess)
+        key, transform = symmetry.canonicalize(chess.game, chess.turn)
+        book_key = compute_book_key(chess.white_pieces_deck.get_signature(WHITE),
+                                    chess.black_pieces_deck.get_signature(BLACK), symmetry.compute_position_hash(key))
+        moves = []
+        index = bisect_left(range(self.size), book_key, key=self.get_key_at)
+        while index < self.size:
+            entry_key, code, wins, draws, losses = ENTRY.unpack_from(self.data, HEADER.size + index * ENTRY.size)
+            if entry_key != book_key:
+                break
+            move = symmetry.transform_move(decode_move(code), transform)
+            if chess.is_legal(move):
+                moves.append(BookMove(move, wins, draws, losses))
+            index += 1
+        return sorted(moves, key=lambda book_move: book_move.get_games(), reverse=True)
+
+    def choose_move(self, chess: ChessDeck, rng: Optional[Random] = None, min_score: float = 0.0) -> Optional[Move]:
+        """
+        Choose a book move, the most played one, or a random one weighted by the games played if a random generator is
+        given. The moves that score less than min_score are never chosen. Returns None when the position is out of book.
+        """
+        moves = [book_move for book_move in self.get_moves(chess) if book_move.get_score() >= min_score]
+        if not moves:
+            return None
+        if rng is None:
+            return moves[0].move
+        return rng.choices(moves, weights=[book_move.get_games() for book_move in moves])[0].move
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,3 +1,5 @@
+from typing import Dict, List, Tuple, Type
+
 Color = bool
 Square = int
 Bitboard = int
@@ -16,25 +18,70 @@ SYMBOL_TO_NAME = {
     "f": "Frog",
     "h": "Archer",
     "z": "Amazon",
+    "a": "Archbishop",
 }
 
+# Registry of the piece types, filled when each Piece subclass is defined
+PIECE_TYPES: List[Type["Piece"]] = []
+NAME_TO_PIECE_TYPE: Dict[str, Type["Piece"]] = {}
+SYMBOL_TO_PIECE_TYPE: Dict[str, Type["Piece"]] = {}
+PIECE_INSTANCES: Dict[Tuple[Type["Piece"], Color], "Piece"] = {}
+
 
 class Piece:
-    def __init__(self, color):
-        self.step_attacks = []
-        self.diagonal_slide = False
-        self.vertical_slide = False
-        self.horizontal_slide = False
-        self.symbol = ""
-        self.name = ""
-        self.color = color
-        self.can_castle = False
-        self.symmetry = True
-        self.price = 0
-        self.is_unique = False
-        self.can_be_promotion = True
-        self.is_invincible = False
-        self.can_capture = True
+    """
+    A piece is an immutable flyweight, there is only one instance per piece type and color.
+    The rules of the piece type are class attributes, and the instances only hold the color, an integer id and a
+    precomputed hash, so King(WHITE) is a dictionary lookup that always returns the same object.
+    """
+    __slots__ = ("color", "id", "hash")
+    step_attacks = ()
+    leaps = ()  # (files, ranks) offsets of the pieces compiled by betza, they replace step_attacks
+    riders = ()  # (offsets, limit) rides of the pieces compiled by betza that are not a diagonal, vertical or horizontal slide
+    diagonal_slide = False
+    vertical_slide = False
+    horizontal_slide = False
+    symbol = ""
+    name = ""
+    can_castle = False
+    symmetry = True
+    price = 0
+    is_unique = False
+    can_be_promotion = True
+    is_invincible = False
+    can_capture = True
+    type_id = -1
+
+    def __init_subclass__(cls, **kwargs):
+        """Every piece type is registered with an integer id when its class is defined"""
+        super().__init_subclass__(**kwargs)
+        cls.type_id = len(PIECE_TYPES)
+        PIECE_TYPES.append(cls)
+        NAME_TO_PIECE_TYPE[cls.name] = cls
+        SYMBOL_TO_PIECE_TYPE[cls.symbol] = cls
+        SYMBOL_TO_NAME.setdefault(cls.symbol.lower(), cls.name)
+
+    def __new__(cls, color: Color):
+        piece = PIECE_INSTANCES.get((cls, color))
+        if piece is None:
+            piece = object.__new__(cls)
+            object.__setattr__(piece, "color", color)
+            object.__setattr__(piece, "id", 2 * cls.type_id + (0 if color is WHITE else 1))
+            object.__setattr__(piece, "hash", hash(piece.id))
+            PIECE_INSTANCES[(cls, color)] = piece
+        return piece
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} pieces are immutable")
+
+    def __reduce__(self):
+        return type(self), (self.color,)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     def get_symbol(self):
         return self.symbol if self.color is WHITE else self.symbol.lower()
@@ -43,154 +90,137 @@ class Piece:
         return ("White " if self.color is WHITE else "Black ") + self.name
 
     def __eq__(self, other):
-        if not isinstance(other, Piece):
-            return False
-        if hash(self) != hash(other):
-            return False
-        return True
+        return self is other
 
     def __hash__(self):
-        return hash(self.name) + hash(self.color)
+        return self.hash
 
     def __ne__(self, other):
-        return not self.__eq__(other)
+        return self is not other
 
 
 class King(Piece):
-    def __init__(self, color: Color):
-        Piece.__init__(self, color)
-        self.step_attacks = [1, -1, 7, 8, 9, -7, -8, -9]
-        self.name = "King"
-        self.symbol = "K"
-        self.price = 0
-        self.can_be_promotion = False
+    __slots__ = ()
+    step_attacks = (1, -1, 7, 8, 9, -7, -8, -9)
+    name = "King"
+    symbol = "K"
+    price = 0
+    can_be_promotion = False
 
 
 class Pawn(Piece):
-    def __init__(self, color: Color):
-        Piece.__init__(self, color)
-        self.step_attacks = [[7, 9], [-7, -9]]
-        self.name = "Pawn"
-        self.symbol = "P"
-        self.symmetry = False
-        self.price = 1
-        self.can_be_promotion = False
+    __slots__ = ()
+    step_attacks = ((7, 9), (-7, -9))
+    name = "Pawn"
+    symbol = "P"
+    symmetry = False
+    price = 1
+    can_be_promotion = False
 
 
 class Bishop(Piece):
-    def __init__(self, color: Color):
-        Piece.__init__(self, color)
-        self.diagonal_slide = True
-        self.name = "Bishop"
-        self.symbol = "B"
-        self.price = 6
+    __slots__ = ()
+    diagonal_slide = True
+    name = "Bishop"
+    symbol = "B"
+    price = 6
 
 
 class Knight(Piece):
-    def __init__(self, color: Color):
-        Piece.__init__(self, color)
-        self.step_attacks = [6, -6, 10, -10, 15, -15, 17, -17]
-        self.name = "Knight"
-        self.symbol = "N"
-        self.price = 5
+    __slots__ = ()
+    step_attacks = (6, -6, 10, -10, 15, -15, 17, -17)
+    name = "Knight"
+    symbol = "N"
+    price = 5
 
 
 class Rook(Piece):
-    def __init__(self, color: Color):
-        Piece.__init__(self, color)
-        self.vertical_slide = True
-        self.horizontal_slide = True
-        self.name = "Rook"
-        self.symbol = "R"
-        self.can_castle = True
-        self.price = 10
+    __slots__ = ()
+    vertical_slide = True
+    horizontal_slide = True
+    name = "Rook"
+    symbol = "R"
+    can_castle = True
+    price = 10
 
 
 class Queen(Piece):
-    def __init__(self, color: Color):
-        Piece.__init__(self, color)
-        self.vertical_slide = True
-        self.horizontal_slide = True
-        self.diagonal_slide = True
-        self.is_unique = True
-        self.name = "Queen"
-        self.symbol = "Q"
-        self.price = 17
+    __slots__ = ()
+    vertical_slide = True
+    horizontal_slide = True
+    diagonal_slide = True
+    is_unique = True
+    name = "Queen"
+    symbol = "Q"
+    price = 17
 
 
 class Amazon(Piece):
-    def __init__(self, color: Color):
-        Piece.__init__(self, color)
-        self.step_attacks = [6, -6, 10, -10, 15, -15, 17, -17]
-        self.vertical_slide = True
-        self.horizontal_slide = True
-        self.diagonal_slide = True
-        self.is_unique = True
-        self.name = "Amazon"
-        self.symbol = "Z"
-        self.price = 24
+    __slots__ = ()
+    step_attacks = (6, -6, 10, -10, 15, -15, 17, -17)
+    vertical_slide = True
+    horizontal_slide = True
+    diagonal_slide = True
+    is_unique = True
+    name = "Amazon"
+    symbol = "Z"
+    price = 24
 
 
 class Archbishop(Piece):
-    def __init__(self, color: Color):
-        Piece.__init__(self, color)
-        self.diagonal_slide = True
-        self.step_attacks = [6, -6, 10, -10, 15, -15, 17, -17]
-        self.name = "Archbishop"
-        self.symbol = "A"
-        self.price = 12
+    __slots__ = ()
+    diagonal_slide = True
+    step_attacks = (6, -6, 10, -10, 15, -15, 17, -17)
+    name = "Archbishop"
+    symbol = "A"
+    price = 12
 
 
 class Chancellor(Piece):
-    def __init__(self, color: Color):
-        Piece.__init__(self, color)
-        self.vertical_slide = True
-        self.horizontal_slide = True
-        self.step_attacks = [6, -6, 10, -10, 15, -15, 17, -17]
-        self.is_unique = True
-        self.name = "Chancellor"
-        self.symbol = "C"
-        self.price = 16
+    __slots__ = ()
+    vertical_slide = True
+    horizontal_slide = True
+    step_attacks = (6, -6, 10, -10, 15, -15, 17, -17)
+    is_unique = True
+    name = "Chancellor"
+    symbol = "C"
+    price = 16
 
 
 class Ghost(Piece):
-    def __init__(self, color: Color):
-        Piece.__init__(self, color)
-        self.step_attacks = [8, 16, -8, -16, 1, 2, -1, -2]
-        self.name = "Ghost"
-        self.symbol = "G"
-        self.can_castle = True
-        self.price = 7
+    __slots__ = ()
+    step_attacks = (8, 16, -8, -16, 1, 2, -1, -2)
+    name = "Ghost"
+    symbol = "G"
+    can_castle = True
+    price = 7
 
 
 class Wall(Piece):
-    def __init__(self, color: Color):
-        Piece.__init__(self, color)
-        self.name = "Wall"
-        self.symbol = "W"
-        self.can_castle = True
-        self.price = 0
-        self.can_be_promotion = False
+    __slots__ = ()
+    name = "Wall"
+    symbol = "W"
+    can_castle = True
+    price = 0
+    can_be_promotion = False
 
 
 class Archer(Piece):
-    def __init__(self, color: Color):
-        Piece.__init__(self, color)
-        self.step_attacks = [7, 9, -7, -9, 14, 18, -14, -18]
-        self.name = "Archer"
-        self.symbol = "H"
-        self.price = 4
+    __slots__ = ()
+    step_attacks = (7, 9, -7, -9, 14, 18, -14, -18)
+    name = "Archer"
+    symbol = "H"
+    price = 4
 
 
 class Frog(Piece):
-    def __init__(self, color: Color):
-        Piece.__init__(self, color)
-        self.step_attacks = [6, -6, 10, -10, 15, -15, 17, -17, 16, -16, 2, -2]
-        self.name = "Frog"
-        self.symbol = "F"
-        self.price = 2
-        self.is_invincible = True
-        self.can_capture = False
+    __slots__ = ()
+    step_attacks = (6, -6, 10, -10, 15, -15, 17, -17, 16, -16, 2, -2)
+    name = "Frog"
+    symbol = "F"
+    price = 2
+    is_invincible = True
+    can_capture = False
 
 
 ALL_PIECES = [Pawn(WHITE), Knight(WHITE), Bishop(WHITE), Rook(WHITE), Queen(WHITE), King(WHITE),
@@ -204,3 +234,13 @@ BLACK_UNIQUE_PIECES = [Queen(BLACK), Chancellor(BLACK), Amazon(BLACK)]
 
 WHITE_COMMON_PIECES = [Knight(WHITE), Bishop(WHITE), Archer(WHITE), Frog(WHITE), Archbishop(WHITE)]
 BLACK_COMMON_PIECES = [Knight(BLACK), Bishop(BLACK), Archer(BLACK), Frog(BLACK), Archbishop(BLACK)]
+
+
+def get_piece(name: str, color: Color) -> Piece:
+    """Get the interned piece of a given name and color"""
+    return NAME_TO_PIECE_TYPE[name](color)
+
+
+def piece_from_symbol(symbol: str, color: Color) -> Piece:
+    """Get the interned piece of a given symbol, the case of the symbol is ignored"""
+    return SYMBOL_TO_PIECE_TYPE[symbol.upper()](color)
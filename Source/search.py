@@ -0,0 +1,426 @@
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from time import monotonic
+from analysis_cache import AnalysisCache, AnalysisEntry, BOUND_EXACT, BOUND_LOWER, BOUND_UPPER
+from chess_deck import ChessDeck
+from computer import BB_PROMOTION_RANKS, BB_RANK_2, BB_RANK_7, BB_SQUARES
+from move import Move
+
+Color = bool
+COLORS = [WHITE, BLACK] = [True, False]
+
+MATE_SCORE = 100_000
+MATE_BOUND = MATE_SCORE - 1000  # The scores beyond it are mates, that depend on the ply
+PIECE_VALUE = 100  # The price of the pieces is scaled to centipawns
+DEFAULT_MOVES_TO_GO = 30
+KILLERS_PER_PLY = 2
+
+# The stages of the moves of a node, each one is generated only if the previous ones did not cut off
+STAGES = [HASH_STAGE, CAPTURE_STAGE, KILLER_STAGE, QUIET_STAGE] = ["hash", "captures", "killers", "quiets"]
+
+# The selective pruning techniques, each one can be enabled on its own
+PRUNINGS = [NULL_MOVE, LATE_MOVE_REDUCTIONS, FUTILITY, RAZORING] = ["null move", "late move reductions", "futility", "razoring"]
+NULL_MOVE_REDUCTION = 2
+LATE_MOVE_COUNT = 3  # The quiet moves after this number of searched moves are reduced
+FUTILITY_MARGIN = 2 * PIECE_VALUE
+RAZORING_MARGIN = 4 * PIECE_VALUE
+
+
+class Searcher:
+    """
+    A negamax alpha-beta search over a ChessDeck, using make_move and pop. It evaluates the material unless it is given
+    an evaluator, an object with an evaluate(chess) method that scores from the point of view of the side to move.
+    The search asks should_stop every check_every nodes, so a stop request or a deadline can interrupt it
+    without checking the clock on every node. An interrupted depth is discarded.
+    With an AnalysisCache, the root and the nodes up to cache_plies are looked up before they are searched and stored
+    after, the deeper nodes are too many to be worth it.
+    The moves of the nodes are generated in stages, see gen_staged_moves, and the cutoffs of each stage are counted.
+    With staged False every node generates all its moves and sorts them, as the root does.
+    The pruning techniques of PRUNINGS are enabled by their names, none by default, and the times each one is applied
+    are counted in prunings:
+        Null move: the side to move passes, if a reduced search still fails high the node is cut. It is not tried in
+        check, after another null move, or when the side to move only has its king, pawns and pieces that cannot
+        capture, like the Frogs, where passing would be better than any move (zugzwang).
+        Late move reductions: the quiet moves that come late in the order are searched one ply shallower with a null
+        window, and searched again at full depth if they raise alpha.
+        Futility: at the frontier, the quiet moves are skipped when the evaluation is far below alpha.
+    A move is quiet for the late move reductions and the futility if it does not capture, does not give check, and is
+    not a pawn move to the seventh or the promotion rank.
+        Razoring: at depth 2, a node whose evaluation is far below alpha is searched at depth 1.
+    """
+
+    def __init__(self, chess: ChessDeck, should_stop: Callable[[], bool] = lambda: False, check_every: int = 64,
+                 evaluator=None, cache: Optional[AnalysisCache] = None, cache_plies: int = 2, staged: bool = True,
+                 pruning: Iterable[str] = ()):
+        self.chess = chess
+        self.staged = staged
+        self.pruning = frozenset(pruning)
+        unknown = self.pruning - set(PRUNINGS)
+        if unknown:
+            raise ValueError(f"Unknown pruning {', '.join(sorted(unknown))}, the options are {', '.join(PRUNINGS)}")
+        self.evaluator = evaluator
+        self.cache = cache
+        self.cache_plies = cache_plies
+        self.should_stop = should_stop
+        self.check_every = check_every
+        self.values = {piece.name: piece.price * PIECE_VALUE for piece in chess.piece_set}
+        self.nodes = 0
+        self.stopped = False
+        self.best_move: Optional[Move] = None
+        self.killers: List[List[Move]] = []
+        self.stage_counts: Dict[str, int] = {stage: 0 for stage in STAGES}
+        self.cutoffs: Dict[str, int] = {stage: 0 for stage in STAGES}
+        self.prunings: Dict[str, int] = {name: 0 for name in PRUNINGS}
+
+    def evaluate(self) -> int:
+        """Material balance from the point of view of the side to move"""
+        if self.evaluator is not None:
+            return self.evaluator.evaluate(self.chess)
+        game = self.chess.game
+        score = 0
+        for name, value in self.values.items():
+            if value:
+                score += value * ((game[name] & game['White']).bit_count() - (game[name] & game['Black']).bit_count())
+        return score if self.chess.turn is WHITE else -score
+
+    def order_moves(self, moves: List[Move], first: Optional[Move] = None) -> List[Move]:
+        """The given move goes first, then the captures of the most valuable pieces, then the rest"""
+        game = self.chess.game
+        their_pieces = game['Black'] if self.chess.turn is WHITE else game['White']
+
+        def key(move: Move) -> int:
+            if first is not None and move == first:
+                return -2 * MATE_SCORE
+            if BB_SQUARES[move.to_sq] & their_pieces:
+                return -self.values.get(self.chess.get_type_at(move.to_sq), 0)
+            return 0
+
+        return sorted(moves, key=key)
+
+    def get_victim_value(self, move: Move) -> int:
+        """The value of the captured piece, a capture to an empty square is an en passant of a pawn"""
+        return self.values.get(self.chess.get_type_at(move.to_sq) or 'Pawn', 0)
+
+    def get_killers(self, ply: int) -> List[Move]:
+        while len(self.killers) <= ply:
+            self.killers.append([])
+        return self.killers[ply]
+
+    def add_killer(self, move: Move, ply: int):
+        """The quiet moves that cut off are tried early in the other nodes of the same ply"""
+        killers = self.get_killers(ply)
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[KILLERS_PER_PLY:]
+
+    def gen_staged_moves(self, hash_move: Optional[Move], ply: int) -> Iterator[Tuple[str, Move]]:
+        """
+        Generate the legal moves of the node in stages, with the stage of each move: the hash move, the captures by
+        the value of the captured piece, the killer moves of the ply and the rest of the quiet moves.
+        Every stage is generated when the previous one is exhausted, so a cutoff skips the generation of the rest.
+        The hash move and the killers come from other positions, so they are checked with is_legal.
+        """
+        chess = self.chess
+        game = chess.game
+        capture_mask = (game['Black'] if chess.turn is WHITE else game['White']) | game['En passant']
+        tried = []
+        if hash_move is not None and chess.is_legal(hash_move):
+            self.stage_counts[HASH_STAGE] += 1
+            tried.append(hash_move)
+            yield HASH_STAGE, hash_move
+
+        self.stage_counts[CAPTURE_STAGE] += 1
+        captures = sorted(chess.gen_legal_moves(capture_mask), key=self.get_victim_value, reverse=True)
+        for move in captures:
+            if move not in tried:
+                yield CAPTURE_STAGE, move
+
+        self.stage_counts[KILLER_STAGE] += 1
+        for move in list(self.get_killers(ply)):
+            if move not in tried and not BB_SQUARES[move.to_sq] & capture_mask and chess.is_legal(move):
+                tried.append(move)
+                yield KILLER_STAGE, move
+
+        self.stage_counts[QUIET_STAGE] += 1
+        for move in chess.gen_legal_moves(~capture_mask):
+            if move not in tried:
+                yield QUIET_STAGE, move
+
+    def gen_ordered_moves(self, hash_move: Optional[Move], ply: int) -> Iterator[Tuple[str, Move]]:
+        """All the legal moves at once, sorted by order_moves, in the stage of the quiet moves"""
+        for move in self.order_moves(list(self.chess.gen_legal_moves()), hash_move):
+            yield QUIET_STAGE, move
+
+    def get_cutoff_rates(self) -> Dict[str, float]:
+        """The fraction of the cutoffs found by each stage"""
+        total = sum(self.cutoffs.values())
+        return {stage: cutoffs / total if total else 0.0 for stage, cutoffs in self.cutoffs.items()}
+
+    def is_in_check(self) -> bool:
+        return self.chess.is_square_attacked(self.chess.get_king_square(self.chess.turn), not self.chess.turn)
+
+    def can_pass(self) -> bool:
+        """The side to move has a piece that can capture other than the king and the pawns, so passing is not better than moving"""
+        game = self.chess.game
+        pieces = game['White'] if self.chess.turn is WHITE else game['Black']
+        return bool(pieces & ~game['King'] & ~game['Pawn'] & ~game['Non capture'])
+
+    def search_null_move(self, depth: int, beta: int, ply: int) -> int:
+        """Pass the turn and search with a null window around beta"""
+        self.chess.make_null_move()
+        score = -self.negamax(depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + 1, ply + 1, False)
+        self.chess.pop()
+        return score
+
+    def is_quiet(self, move: Move, capture_mask: int) -> bool:
+        """A move that does not capture, promote or push a pawn to the seventh rank, the checks are found after the move"""
+        to_bb = BB_SQUARES[move.to_sq]
+        pawn_ranks = BB_PROMOTION_RANKS | (BB_RANK_7 if self.chess.turn is WHITE else BB_RANK_2)
+        return not to_bb & capture_mask and not (to_bb & pawn_ranks and BB_SQUARES[move.from_sq] & self.chess.game['Pawn'])
+
+    def get_no_moves_score(self, ply: int) -> int:
+        """The score of a node without legal moves, a checkmate or a stalemate"""
+        king_sq = self.chess.get_king_square(self.chess.turn)
+        if self.chess.is_square_attacked(king_sq, not self.chess.turn):
+            return -MATE_SCORE + ply
+        return 0
+
+    @staticmethod
+    def score_to_cache(score: int, ply: int) -> int:
+        """The mate scores count the plies from the root, they are stored counting from the position"""
+        if score > MATE_BOUND:
+            return score + ply
+        if score < -MATE_BOUND:
+            return score - ply
+        return score
+
+    @staticmethod
+    def score_from_cache(score: int, ply: int) -> int:
+        if score > MATE_BOUND:
+            return score - ply
+        if score < -MATE_BOUND:
+            return score + ply
+        return score
+
+    def store(self, depth: int, score: int, bound: int, move: Optional[Move], ply: int):
+        self.cache.put(self.chess, AnalysisEntry(depth, self.score_to_cache(score, ply), bound, move))
+
+    def is_interrupted(self) -> bool:
+        self.nodes += 1
+        if not self.nodes % self.check_every and self.should_stop():
+            self.stopped = True
+        return self.stopped
+
+    def negamax(self, depth: int, alpha: int, beta: int, ply: int, is_null_allowed: bool = True) -> int:
+        if self.is_interrupted():
+            return 0
+
+        if depth <= 0:
+            if next(self.chess.gen_legal_moves(), None) is None:
+                return self.get_no_moves_score(ply)
+            return self.evaluate()
+
+        is_cached = self.cache is not None and ply <= self.cache_plies
+        cached_move = None
+        if is_cached:
+            entry = self.cache.get(self.chess)
+            if entry is not None:
+                entry.score = self.score_from_cache(entry.score, ply)
+                score = entry.get_score(depth, alpha, beta)
+                if score is not None:
+                    return score
+                cached_move = entry.move
+
+        is_in_check = bool(self.pruning) and self.is_in_check()
+        if NULL_MOVE in self.pruning and is_null_allowed and not is_in_check and depth > NULL_MOVE_REDUCTION and \
+                beta < MATE_BOUND and self.can_pass():
+            score = self.search_null_move(depth, beta, ply)
+            if self.stopped:
+                return 0
+            if score >= beta:
+                self.prunings[NULL_MOVE] += 1
+                return beta
+
+        is_futile = False
+        if (FUTILITY in self.pruning or RAZORING in self.pruning) and depth <= 2 and not is_in_check and \
+                -MATE_BOUND < alpha < MATE_BOUND:
+            static_score = self.evaluate()
+            if RAZORING in self.pruning and depth == 2 and static_score + RAZORING_MARGIN <= alpha:
+                self.prunings[RAZORING] += 1
+                depth = 1
+            is_futile = FUTILITY in self.pruning and depth == 1 and static_score + FUTILITY_MARGIN <= alpha
+        is_reducible = LATE_MOVE_REDUCTIONS in self.pruning and depth >= 3 and not is_in_check
+        game = self.chess.game
+        capture_mask = (game['Black'] if self.chess.turn is WHITE else game['White']) | game['En passant']
+
+        best_move = None
+        has_moves = False
+        searched = 0
+        moves = self.gen_staged_moves(cached_move, ply) if self.staged else self.gen_ordered_moves(cached_move, ply)
+        for stage, move in moves:
+            has_moves = True
+            is_quiet = (is_futile or is_reducible) and self.is_quiet(move, capture_mask)
+            self.chess.make_move(move)
+            if is_quiet and self.is_in_check():
+                is_quiet = False  # The move gives check
+            if is_futile and is_quiet and searched:
+                self.chess.pop()
+                self.prunings[FUTILITY] += 1
+                continue
+            if is_reducible and is_quiet and searched >= LATE_MOVE_COUNT and stage is QUIET_STAGE:
+                self.prunings[LATE_MOVE_REDUCTIONS] += 1
+                score = -self.negamax(depth - 2, -alpha - 1, -alpha, ply + 1)
+                if score > alpha and not self.stopped:
+                    score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            else:
+                score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            self.chess.pop()
+            searched += 1
+            if self.stopped:
+                return 0
+            if score >= beta:
+                self.cutoffs[stage] += 1
+                if stage is QUIET_STAGE and self.staged:
+                    self.add_killer(move, ply)
+                if is_cached:
+                    self.store(depth, score, BOUND_LOWER, move, ply)
+                return score
+            if score > alpha:
+                alpha, best_move = score, move
+        if not has_moves:
+            return self.get_no_moves_score(ply)
+        if is_cached:
+            self.store(depth, alpha, BOUND_UPPER if best_move is None else BOUND_EXACT, best_move, ply)
+        return alpha
+
+    def search_root(self, depth: int) -> Optional[Tuple[int, Move]]:
+        """Search the root at a fixed depth, returns None if the search was stopped before finishing it"""
+        first = self.best_move
+        if self.cache is not None:
+            entry = self.cache.get(self.chess)
+            if entry is not None and entry.move is not None and self.chess.is_legal(entry.move):
+                if entry.bound == BOUND_EXACT and entry.depth >= depth:
+                    self.best_move = entry.move
+                    return entry.score, entry.move
+                first = first or entry.move
+        moves = self.order_moves(list(self.chess.gen_legal_moves()), first)
+        if not moves:
+            return None
+        alpha, beta = -MATE_SCORE - 1, MATE_SCORE + 1
+        best_move = moves[0]
+        for move in moves:
+            self.chess.make_move(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, 1)
+            self.chess.pop()
+            if self.stopped:
+                return None
+            if score > alpha:
+                alpha, best_move = score, move
+        self.best_move = best_move
+        if self.cache is not None:
+            self.store(depth, alpha, BOUND_EXACT, best_move, 0)
+        return alpha, best_move
+
+    def iterate(self, max_depth: int) -> Iterator[Tuple[int, int, Move]]:
+        """Search with increasing depth until max_depth or until stopped, yields (depth, score, best move) per finished depth"""
+        for depth in range(1, max_depth + 1):
+            result = self.search_root(depth)
+            if result is None:
+                return
+            yield depth, result[0], result[1]
+
+
+class TimeManager:
+    """
+    The TimeManager computes the deadlines of a move decision from the clock. The soft deadline is the time the search
+    should use, no new depth is started after it. The hard deadline is the limit that interrupts the running depth.
+    The deadlines are absolute monotonic times, that are shared by all the processes, 0 means no deadline.
+    """
+
+    def __init__(self, overhead: float = 0.02, hard_ratio: float = 3.0, max_fraction: float = 0.4):
+        self.overhead = overhead
+        self.hard_ratio = hard_ratio
+        self.max_fraction = max_fraction
+        self.soft_deadline = 0.0
+        self.hard_deadline = 0.0
+
+    def allocate(self, remaining: Optional[float] = None, increment: float = 0.0, moves_to_go: Optional[int] = None,
+                 movetime: Optional[float] = None, start: Optional[float] = None):
+        """Set the deadlines from the remaining time and increment of the player, or from a fixed time per move, in seconds"""
+        start = monotonic() if start is None else start
+        if movetime:
+            self.soft_deadline = self.hard_deadline = start + max(movetime - self.overhead, 0.0)
+        elif remaining is not None:
+            available = max(remaining - self.overhead, 0.0)
+            soft = min(available / (moves_to_go or DEFAULT_MOVES_TO_GO) + 0.8 * increment, available * self.max_fraction)
+            hard = min(soft * self.hard_ratio, available * self.max_fraction)
+            self.soft_deadline = start + soft
+            self.hard_deadline = start + max(hard, soft)
+        else:
+            self.soft_deadline = self.hard_deadline = 0.0
+
+    def is_hard_deadline_passed(self) -> bool:
+        return bool(self.hard_deadline) and monotonic() >= self.hard_deadline
+
+    def is_soft_deadline_passed(self) -> bool:
+        return bool(self.soft_deadline) and monotonic() >= self.soft_deadline
+
+
+class SearchResult:
+    def __init__(self, move: Optional[Move], score: int, depth: int, nodes: int, elapsed: float):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+
+class SearchController:
+    """
+    Iterative deepening under a TimeManager. The hard deadline is only checked at the node checkpoints of the
+    Searcher, every check_every nodes, so the clock stays off the hot path. Between depths the controller stops when
+    the soft deadline has passed, when the next depth is not expected to finish before the soft deadline, or when the
+    best move has been stable for some depths and half of the soft time is used.
+    """
+
+    def __init__(self, chess: ChessDeck, time_manager: TimeManager, max_depth: int = 64, stability: int = 4,
+                 check_every: int = 64, should_stop: Callable[[], bool] = lambda: False, evaluator=None,
+                 cache: Optional[AnalysisCache] = None, staged: bool = True, pruning: Iterable[str] = ()):
+        self.chess = chess
+        self.time_manager = time_manager
+        self.max_depth = max_depth
+        self.stability = stability
+        self.external_stop = should_stop
+        self.searcher = Searcher(chess, self.should_stop, check_every, evaluator, cache, staged=staged, pruning=pruning)
+
+    def should_stop(self) -> bool:
+        return self.external_stop() or self.time_manager.is_hard_deadline_passed()
+
+    def is_time_for_next_depth(self, start: float, depth_start: float, stable_depths: int) -> bool:
+        soft_deadline = self.time_manager.soft_deadline
+        if not soft_deadline:
+            return True
+        now = monotonic()
+        if now >= soft_deadline:
+            return False
+        if stable_depths >= self.stability and now - start >= (soft_deadline - start) / 2:
+            return False
+        # The branching factor of the next depth is unknown, so the last depth time is used as a lower bound
+        return now + (now - depth_start) <= soft_deadline
+
+    def run(self) -> SearchResult:
+        start = monotonic()
+        result = SearchResult(None, 0, 0, 0, 0.0)
+        stable_depths = 0
+        depth_start = start
+        for depth, score, move in self.searcher.iterate(self.max_depth):
+            stable_depths = stable_depths + 1 if move == result.move else 0
+            result = SearchResult(move, score, depth, self.searcher.nodes, monotonic() - start)
+            if self.external_stop() or not self.is_time_for_next_depth(start, depth_start, stable_depths):
+                break
+            depth_start = monotonic()
+
+        if result.move is None:
+            result.move = next(self.chess.gen_legal_moves(), None)
+        result.nodes = self.searcher.nodes
+        result.elapsed = monotonic() - start
+        return result
@@ -0,0 +1,146 @@
+from typing import Dict, Hashable, List, Optional, Tuple
+from collections import OrderedDict
+from hashlib import blake2b
+from chess_deck import ChessDeck
+from bitboards import BitboardManager
+from move import Move
+from pieces import NAME_TO_PIECE_TYPE
+
+Square = int
+Bitboard = int
+Color = bool
+PositionKey = Tuple[int, ...]
+
+COLORS = [WHITE, BLACK] = [True, False]
+
+# The symmetries are involutions that commute, so a transform is a set of flags and is its own inverse
+IDENTITY = 0
+MIRROR = 1
+COLOR_FLIP = 2
+
+
+class SymmetryManager:
+    """
+    The SymmetryManager maps the positions of a game to a canonical form under the symmetries that are valid for them.
+    The horizontal mirror is valid when nobody has castling rights and every piece moves the same to both sides, and
+    the color flip is valid when both decks are the same, in which case the board is flipped vertically, the colors
+    are swapped and the turn is inverted.
+    The canonical key is the smallest of the keys of the valid transforms.
+    """
+
+    def __init__(self, chess: ChessDeck):
+        self.bbm = BitboardManager()
+        self.piece_keys = sorted({piece.name for piece in chess.piece_set}, key=lambda name: NAME_TO_PIECE_TYPE[name].type_id)
+        self.can_flip_colors = self.are_decks_equal(chess)
+        self.can_mirror = self.are_pieces_mirrored(chess)
+
+    @staticmethod
+    def are_decks_equal(chess: ChessDeck) -> bool:
+        """Both decks are equal when they have the same piece types in the same slots and the same promotion piece"""
+        white = [None if piece is None else piece.name for piece in chess.white_deck]
+        black = [None if piece is None else piece.name for piece in chess.black_deck]
+        return white == black and chess.white_prom.name == chess.black_prom.name
+
+    @staticmethod
+    def are_pieces_mirrored(chess: ChessDeck) -> bool:
+        """The pieces compiled by betza may move only to the left or to the right, then the board cannot be mirrored"""
+        for piece in chess.piece_set:
+            for offsets in [piece.leaps, *(rides for rides, _ in piece.riders)]:
+                if {(-files, ranks) for files, ranks in offsets} != set(offsets):
+                    return False
+        return True
+
+    def get_valid_transforms(self, game: Dict) -> List[int]:
+        transforms = [IDENTITY]
+        if not game['Castling'] and self.can_mirror:
+            transforms.append(MIRROR)
+        if self.can_flip_colors:
+            transforms += [transform | COLOR_FLIP for transform in transforms]
+        return transforms
+
+    def transform_bitboard(self, bb: Bitboard, transform: int) -> Bitboard:
+        if transform & MIRROR:
+            bb = self.bbm.flip_horizontal(bb)
+        if transform & COLOR_FLIP:
+            bb = self.bbm.flip_vertical(bb)
+        return bb
+
+    @staticmethod
+    def transform_square(sq: Square, transform: int) -> Square:
+        if transform & MIRROR:
+            sq ^= 7
+        if transform & COLOR_FLIP:
+            sq ^= 56
+        return sq
+
+    def transform_move(self, move: Move, transform: int) -> Move:
+        """Map a move to the transformed board, and back, since every transform is its own inverse"""
+        return Move(self.transform_square(move.from_sq, transform), self.transform_square(move.to_sq, transform),
+                    move.promotion, move.drop)
+
+    def get_key(self, game: Dict, turn: Color, transform: int = IDENTITY) -> PositionKey:
+        """The key is a tuple of integers, so it hashes the same in every process"""
+        white, black = game['White'], game['Black']
+        if transform & COLOR_FLIP:
+            white, black = black, white
+            turn = not turn
+        key = [int(turn), self.transform_bitboard(white, transform), self.transform_bitboard(black, transform),
+               self.transform_bitboard(game['Castling'], transform), self.transform_bitboard(game['En passant'], transform)]
+        key += [self.transform_bitboard(game[name], transform) for name in self.piece_keys]
+        return tuple(key)
+
+    def canonicalize(self, game: Dict, turn: Color) -> Tuple[PositionKey, int]:
+        """Return the canonical key of the position and the transform that maps the position onto it"""
+        return min((self.get_key(game, turn, transform), transform) for transform in self.get_valid_transforms(game))
+
+    def get_canonical_key(self, chess: ChessDeck) -> PositionKey:
+        return self.canonicalize(chess.game, chess.turn)[0]
+
+    @staticmethod
+    def compute_position_hash(key: PositionKey) -> int:
+        """A stable 64 bits hash of a key, to store it on disk or share it between processes"""
+        digest = blake2b(b"".join(value.to_bytes(8, "little") for value in key), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def get_position_hash(self, chess: ChessDeck) -> int:
+        return self.compute_position_hash(self.get_canonical_key(chess))
+
+
+class CanonicalCache:
+    """
+    A bounded cache of positions keyed by their canonical form, for transposition tables and evaluation caches.
+    The values must be invariant under the symmetries, as scores relative to the side to move are.
+    A best move is stored on the canonical board and mapped back to the board of the position that reads it.
+    """
+
+    def __init__(self, symmetry: SymmetryManager, max_size: int = 1 << 20):
+        self.symmetry = symmetry
+        self.max_size = max_size
+        self.entries: OrderedDict[Hashable, Tuple[object, Optional[Move]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chess: ChessDeck) -> Tuple[Optional[object], Optional[Move]]:
+        key, transform = self.symmetry.canonicalize(chess.game, chess.turn)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        value, move = entry
+        return value, None if move is None else self.symmetry.transform_move(move, transform)
+
+    def put(self, chess: ChessDeck, value: object, move: Optional[Move] = None):
+        key, transform = self.symmetry.canonicalize(chess.game, chess.turn)
+        self.entries[key] = (value, None if move is None else self.symmetry.transform_move(move, transform))
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get_hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,243 @@
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import numpy as np
+from chess_deck import ChessDeck
+from game_record import GameReader, RESULT_WHITE_WINS, RESULT_BLACK_WINS, RESULT_DRAW
+from opening_book import compute_book_key
+from pieces import PIECE_TYPES
+from symmetry import SymmetryManager
+
+COLORS = [WHITE, BLACK] = [True, False]
+
+# Two planes per piece type, one per color, and a last plane that is full when white is to move
+CHANNELS = 2 * len(PIECE_TYPES) + 1
+ACTIONS = 64 * 64
+SAMPLE_DTYPE = np.dtype([
+    ("planes", np.uint8, (CHANNELS, 8, 8)),
+    ("legal", np.uint8, (ACTIONS // 8,)),  # The legal action mask over get_action_space, packed in bits
+    ("outcome", np.float32),  # The mean of the outcomes, 1, 0 or -1 from the point of view of the side to move
+    ("games", np.uint32),  # The number of games whose outcomes are averaged
+    ("hash", np.uint64),
+])
+MANIFEST = "manifest.json"
+
+
+def bitboard_to_plane(bb: int) -> np.ndarray:
+    """Unpack a bitboard into an 8x8 plane, the row is the rank and the column the file"""
+    return np.unpackbits(np.frombuffer(bb.to_bytes(8, "little"), np.uint8), bitorder="little").reshape(8, 8)
+
+
+def encode_position(chess: ChessDeck, sample: np.ndarray):
+    """
+    Fill the planes and the legal action mask of a sample with the current position. CHANNELS is sized with the piece
+    types registered when this module is imported, a piece compiled by betza later has no plane and raises ValueError.
+    """
+    game = chess.game
+    planes = sample["planes"]
+    planes[:] = 0
+    for piece in chess.piece_set:
+        if piece.id >= CHANNELS - 1:
+            raise ValueError(f"The piece {piece.name} was registered after training_data was imported, it has no plane")
+        bb = game[piece.name] & (game["White"] if piece.color else game["Black"])
+        if bb:
+            planes[piece.id] = bitboard_to_plane(bb)
+    if chess.turn is WHITE:
+        planes[-1] = 1
+
+    legal = np.zeros(ACTIONS, np.uint8)
+    legal[[move.get_action_space() for move in chess.gen_legal_moves()]] = 1
+    sample["legal"] = np.packbits(legal, bitorder="little")
+
+
+def convert_games(path: str, start: int, stop: int) -> np.ndarray:
+    """
+    The convert_games function is the job of the process pool, it converts the games [start, stop) of a game file
+    into samples. The games without a result are skipped, since their positions have no outcome.
+    The hash of a sample is the one of the opening book, of the deck signatures and the canonical position, so the
+    symmetric copies of a position are the same sample and the same board with other decks is not.
+    """
+    outcome_of = {RESULT_WHITE_WINS: 1, RESULT_BLACK_WINS: -1, RESULT_DRAW: 0}
+    samples = []
+    with GameReader(path) as reader:
+        for index in range(start, min(stop, len(reader))):
+            record = reader.read_game(index)
+            if record.result not in outcome_of:
+                continue
+            symmetry = signatures = None
+            for chess, _ in reader.replay(index):
+                if symmetry is None:
+                    symmetry = SymmetryManager(chess)
+                    signatures = (chess.white_pieces_deck.get_signature(WHITE), chess.black_pieces_deck.get_signature(BLACK))
+                sample = np.zeros((), SAMPLE_DTYPE)
+                encode_position(chess, sample)
+                white_outcome = outcome_of[record.result]
+                sample["outcome"] = white_outcome if chess.turn is WHITE else -white_outcome
+                sample["games"] = 1
+                key, _ = symmetry.canonicalize(chess.game, chess.turn)
+                sample["hash"] = compute_book_key(*signatures, symmetry.compute_position_hash(key))
+                samples.append(sample)
+    return np.array(samples, SAMPLE_DTYPE)
+
+
+class ShardWriter:
+    """
+    The ShardWriter writes samples into fixed size np.memmap shards and keeps the manifest of the directory.
+    The samples of a shard are shuffled before it is flushed, so a contiguous slice of a shard is a random minibatch.
+    A position is written once, by its hash, and the outcomes of the games that reach it again are averaged into it:
+    seen keeps the sum of the outcomes and the number of games of every hash, and locations the shard and the row of
+    its sample, -1 for the buffer. The shards already flushed whose outcomes changed are rewritten when it is closed.
+    """
+
+    def __init__(self, directory: str, shard_size: int = 1 << 16, seed: int = 0):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.rng = np.random.default_rng(seed)
+        self.buffer = np.zeros(shard_size, SAMPLE_DTYPE)
+        self.count = 0
+        self.seen: Dict[int, List[float]] = {}
+        self.locations: Dict[int, Tuple[int, int]] = {}
+        self.dirty: Set[int] = set()
+        self.shards: List[Dict] = []
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as file:
+                manifest = json.load(file)
+            self.shards = manifest["shards"]
+            self.shard_size = manifest["shard_size"]
+            self.buffer = np.zeros(self.shard_size, SAMPLE_DTYPE)
+            for index, shard in enumerate(ShardLoader(directory).shards):
+                rows = zip(shard["hash"].tolist(), shard["outcome"].tolist(), shard["games"].tolist())
+                for row, (sample_hash, outcome, games) in enumerate(rows):
+                    self.seen[sample_hash] = [outcome * games, games]
+                    self.locations[sample_hash] = (index, row)
+
+    def add(self, samples: np.ndarray):
+        for sample in samples:
+            sample_hash = int(sample["hash"])
+            games = int(sample["games"])
+            total = self.seen.get(sample_hash)
+            if total is not None:
+                total[0] += float(sample["outcome"]) * games
+                total[1] += games
+                index, row = self.locations[sample_hash]
+                if index < 0:
+                    self.buffer["outcome"][row] = total[0] / total[1]
+                    self.buffer["games"][row] = total[1]
+                else:
+                    self.dirty.add(index)
+                continue
+            self.seen[sample_hash] = [float(sample["outcome"]) * games, games]
+            self.locations[sample_hash] = (-1, self.count)
+            self.buffer[self.count] = sample
+            self.count += 1
+            if self.count == self.shard_size:
+                self.flush()
+
+    def flush(self):
+        if not self.count:
+            return
+        index = len(self.shards)
+        name = f"shard_{index:05d}.bin"
+        shard = np.memmap(os.path.join(self.directory, name), SAMPLE_DTYPE, mode="w+", shape=(self.shard_size,))
+        shard[:self.count] = self.buffer[self.rng.permutation(self.count)]
+        for row, sample_hash in enumerate(shard["hash"][:self.count].tolist()):
+            self.locations[sample_hash] = (index, row)
+        shard.flush()
+        del shard
+        self.shards.append({"path": name, "count": self.count})
+        self.count = 0
+        self.write_manifest()
+
+    def update_outcomes(self):
+        """Rewrite the mean outcomes of the flushed shards that have positions reached again by later games"""
+        for index in sorted(self.dirty):
+            shard = np.memmap(os.path.join(self.directory, self.shards[index]["path"]), SAMPLE_DTYPE, mode="r+",
+                              shape=(self.shard_size,))
+            count = self.shards[index]["count"]
+            totals = [self.seen[sample_hash] for sample_hash in shard["hash"][:count].tolist()]
+            shard["outcome"][:count] = [outcome / games for outcome, games in totals]
+            shard["games"][:count] = [games for _, games in totals]
+            shard.flush()
+            del shard
+        self.dirty.clear()
+
+    def write_manifest(self):
+        manifest = {"shard_size": self.shard_size, "channels": CHANNELS, "actions": ACTIONS,
+                    "dtype": [list(field) if len(field) == 2 else [field[0], field[1], list(field[2])]
+                              for field in SAMPLE_DTYPE.descr],
+                    "pieces": [piece_type.name for piece_type in PIECE_TYPES],
+                    "shards": self.shards}
+        with open(os.path.join(self.directory, MANIFEST), "w") as file:
+            json.dump(manifest, file, indent=1)
+
+    def close(self):
+        self.flush()
+        self.update_outcomes()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def build_shards(game_paths: List[str], directory: str, shard_size: int = 1 << 16, games_per_job: int = 64,
+                 workers: Optional[int] = None, seed: int = 0) -> int:
+    """
+    The pipeline stage that converts game files into shards, the games are split in jobs that run in a process pool,
+    and their samples are deduplicated and written in the order of the jobs, pool.map returns them in that order even
+    if a later job finishes first. The outcomes of a position reached by several games are averaged.
+    Returns the number of samples written.
+    """
+    jobs = []
+    for path in game_paths:
+        with GameReader(path) as reader:
+            games = len(reader)
+        jobs += [(path, start, start + games_per_job) for start in range(0, games, games_per_job)]
+
+    with ShardWriter(directory, shard_size, seed) as writer, ProcessPoolExecutor(workers) as pool:
+        before = len(writer.seen)
+        for samples in pool.map(convert_games, *zip(*jobs)) if jobs else []:
+            writer.add(samples)
+    return len(writer.seen) - before
+
+
+class ShardLoader:
+    """
+    The ShardLoader maps the shards of a directory read only. sample_batch returns a random contiguous slice of a random
+    shard, a view on the memory map that is not copied, which is a random minibatch because the shards are shuffled.
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, MANIFEST)) as file:
+            self.manifest = json.load(file)
+        self.shards = [np.memmap(os.path.join(directory, shard["path"]), SAMPLE_DTYPE, mode="r",
+                                 shape=(self.manifest["shard_size"],))[:shard["count"]]
+                       for shard in self.manifest["shards"]]
+        self.counts = np.array([len(shard) for shard in self.shards], np.int64)
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def sample_batch(self, batch_size: int, rng: np.random.Generator) -> np.ndarray:
+        """A zero copy minibatch, the shards smaller than the batch are only chosen if all of them are"""
+        eligible = self.counts >= batch_size
+        if not eligible.any():
+            eligible = self.counts > 0
+        weights = np.where(eligible, self.counts, 0) / np.where(eligible, self.counts, 0).sum()
+        shard = self.shards[rng.choice(len(self.shards), p=weights)]
+        start = rng.integers(0, max(len(shard) - batch_size, 0) + 1)
+        return shard[start:start + batch_size]
+
+    def iter_batches(self, batch_size: int, seed: int = 0) -> Iterator[np.ndarray]:
+        rng = np.random.default_rng(seed)
+        while True:
+            yield self.sample_batch(batch_size, rng)
+
+    @staticmethod
+    def unpack_legal(batch: np.ndarray) -> np.ndarray:
+        """Unpack the legal action masks of a batch to booleans of shape (batch, 4096)"""
+        return np.unpackbits(batch["legal"], axis=-1, bitorder="little").astype(bool)